@@ -0,0 +1,495 @@
+# 告警记录：每张告警卡片的发起和处理保存在本地 SQLite 文件中，可以按会话、操作人和时间范围查询未处理的告警和
+# 平均处理时长（MTTR）。写入由后台线程按批提交，不阻塞事件和卡片回调。每个会话每小时、每天的告警数和处理时长另外汇总在
+# alarm_hours、alarm_days 表中，统计只读取汇总行和部分索引，表中有几百万条告警时查询也只需要几毫秒。
+# Alarm records: the raise and the resolution of every alarm card are kept in a local SQLite file, to query open
+# alarms and the mean time to resolve (MTTR) by chat, operator and time range. Writes are committed in batches by a
+# background thread and never block events or card callbacks. Alarm counts and resolve times are also rolled up per
+# chat and hour or day in the alarm_hours and alarm_days tables, so statistics only read rollup rows and partial indexes
+# and take a few milliseconds with millions of alarms in the table.
+# usage: python3 alarm_store.py report --hours 24
+#        python3 alarm_store.py open --receive-id oc_xxx
+#        python3 alarm_store.py operator ou_xxx --hours 168
+import time
+import heapq
+import logging
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+import codec
+from card_render import SecondClock, fixed_timezone
+
+_clock = SecondClock("%Y-%m-%d %H:%M:%S (UTC+8)", 8)
+_tz = fixed_timezone(8)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alarms (
+    message_id TEXT PRIMARY KEY,
+    receive_id_type TEXT NOT NULL,
+    receive_id TEXT NOT NULL,
+    raised_at REAL NOT NULL,
+    raised_by TEXT,
+    message_count INTEGER NOT NULL DEFAULT 1,
+    resolved_at REAL,
+    resolved_by TEXT,
+    notes TEXT
+);
+CREATE INDEX IF NOT EXISTS alarms_receiver ON alarms (receive_id, raised_at);
+CREATE INDEX IF NOT EXISTS alarms_open ON alarms (receive_id, raised_at) WHERE resolved_at IS NULL;
+CREATE INDEX IF NOT EXISTS alarms_open_time ON alarms (raised_at) WHERE resolved_at IS NULL;
+CREATE INDEX IF NOT EXISTS alarms_raiser ON alarms (raised_by, raised_at) WHERE raised_by IS NOT NULL;
+CREATE INDEX IF NOT EXISTS alarms_resolver ON alarms (resolved_by, resolved_at, raised_at)
+    WHERE resolved_by IS NOT NULL;
+CREATE TABLE IF NOT EXISTS alarm_hours (
+    hour INTEGER NOT NULL,
+    receive_id TEXT NOT NULL,
+    raised INTEGER NOT NULL DEFAULT 0,
+    resolved INTEGER NOT NULL DEFAULT 0,
+    resolve_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, receive_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alarm_hours_receiver ON alarm_hours (receive_id, hour);
+CREATE TABLE IF NOT EXISTS alarm_days (
+    day INTEGER NOT NULL,
+    receive_id TEXT NOT NULL,
+    raised INTEGER NOT NULL DEFAULT 0,
+    resolved INTEGER NOT NULL DEFAULT 0,
+    resolve_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, receive_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alarm_days_receiver ON alarm_days (receive_id, day);
+"""
+
+# 汇总行的累加：raised 按发起的小时计，resolved 和 resolve_seconds 按处理的小时计；
+# alarm_days 与 alarm_hours 相同，按天（UTC）汇总，长时间范围的统计读取天汇总，只有两端不足一天的部分读取小时汇总
+# Rollup increments: raised counts in the hour of the raise, resolved and resolve_seconds in the hour of the resolve.
+# alarm_days is the same per day (UTC), statistics over long ranges read the day rollup and only the partial days at
+# both ends read the hour rollup.
+UPSERT_ROLLUP = """
+INSERT INTO {table} ({column}, receive_id, raised, resolved, resolve_seconds) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT ({column}, receive_id) DO UPDATE SET
+    raised = raised + excluded.raised,
+    resolved = resolved + excluded.resolved,
+    resolve_seconds = resolve_seconds + excluded.resolve_seconds
+"""
+UPSERT_HOUR = UPSERT_ROLLUP.format(table="alarm_hours", column="hour")
+UPSERT_DAY = UPSERT_ROLLUP.format(table="alarm_days", column="day")
+
+RAISE = "raise"
+RESOLVE = "resolve"
+
+
+class AlarmStore(object):
+    def __init__(self, path, flush_interval=1.0, batch_size=1000, max_pending=100000):
+        # 待写入的事件每 flush_interval 秒或攒够 batch_size 个时在一个事务中提交；
+        # 数据库持续不可写时最多保留 max_pending 个事件，更多的事件被丢弃并计入 dropped
+        # Pending events are committed in one transaction every flush_interval seconds or once batch_size are queued.
+        # While the database can't be written at most max_pending events are kept, further events are dropped and
+        # counted in dropped.
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        # 持有该锁时写入，后台线程和 flush() 的调用方不会同时写
+        # held while writing, so the background thread and callers of flush() don't write at the same time
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        # 写入用的连接和数据库文件都在第一次写入时才创建
+        # the writing connection and the database file are created on the first write
+        self._writer = None
+        self._schema_ready = False
+        self.recorded = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        # 找不到发起记录或已经处理过的告警的处理事件
+        # resolve events of alarms without a raise record or already resolved
+        self.unmatched = 0
+        self._thread = threading.Thread(target=self._run, name="alarm-store", daemon=True)
+        self._thread.start()
+
+    def raised(self, message_id, receive_id_type, receive_id, raised_by=None, message_count=1, raised_at=None):
+        # 记录发出的告警卡片，message_id 是告警卡片消息的 id
+        # record an alarm card that was sent, message_id is the id of the card's message
+        raised_at = raised_at or time.time()
+        self._record((RAISE, message_id, receive_id_type, receive_id, raised_at, raised_by, message_count))
+
+    def resolved(self, message_id, resolved_by, notes="", resolved_at=None):
+        # 记录告警的处理，同一条告警只记录第一次处理
+        # record the resolution of an alarm, only the first one counts
+        self._record((RESOLVE, message_id, resolved_at or time.time(), resolved_by, notes))
+
+    def _record(self, event):
+        with self._lock:
+            self.recorded += 1
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(event)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        # 立即写入待写入的事件，例如查询之前
+        # write the pending events now, e.g. before a query
+        with self._write_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return
+            try:
+                self._write(events)
+            except Exception as e:
+                logging.exception(f"write {len(events)} alarm events failed: {e}")
+                # 放回队首，下次再试
+                # put them back in front and try again next time
+                with self._lock:
+                    self._pending[:0] = events
+                    overflow = len(self._pending) - self.max_pending
+                    if overflow > 0:
+                        del self._pending[self.max_pending:]
+                        self.dropped += overflow
+
+    def close(self):
+        # 停止后台线程，写入剩余的事件
+        # stop the background thread and write the remaining events
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "unmatched": self.unmatched,
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _write(self, events):
+        if self._writer is None:
+            self._writer = self._connect(check_same_thread=False)
+        db = self._writer
+        raises = [event[1:] for event in events if event[0] == RAISE]
+        resolves = [event[1:] for event in events if event[0] == RESOLVE]
+        # (hour, receive_id) -> [raised, resolved, resolve_seconds]
+        hours = {}
+        unmatched = 0
+        with db:
+            # 发起记录先写入，同一批中的处理事件能找到它
+            # raises go first, so resolve events of the same batch find them
+            for message_id, receive_id_type, receive_id, raised_at, raised_by, message_count in raises:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO alarms (message_id, receive_id_type, receive_id, raised_at, raised_by, "
+                    "message_count) VALUES (?, ?, ?, ?, ?, ?)",
+                    (message_id, receive_id_type, receive_id, raised_at, raised_by, message_count),
+                )
+                if cursor.rowcount:
+                    hours.setdefault((int(raised_at // 3600), receive_id), [0, 0, 0.0])[0] += 1
+            for message_id, resolved_at, resolved_by, notes in resolves:
+                row = db.execute(
+                    "SELECT receive_id, raised_at FROM alarms WHERE message_id = ? AND resolved_at IS NULL",
+                    (message_id,),
+                ).fetchone()
+                if row is None:
+                    unmatched += 1
+                    continue
+                receive_id, raised_at = row
+                db.execute(
+                    "UPDATE alarms SET resolved_at = ?, resolved_by = ?, notes = ? WHERE message_id = ?",
+                    (resolved_at, resolved_by, notes, message_id),
+                )
+                rollup = hours.setdefault((int(resolved_at // 3600), receive_id), [0, 0, 0.0])
+                rollup[1] += 1
+                rollup[2] += max(resolved_at - raised_at, 0.0)
+            days = {}
+            for (hour, receive_id), rollup in hours.items():
+                day = days.setdefault((hour // 24, receive_id), [0, 0, 0.0])
+                for i, value in enumerate(rollup):
+                    day[i] += value
+            db.executemany(UPSERT_HOUR, ((*key, *rollup) for key, rollup in hours.items()))
+            db.executemany(UPSERT_DAY, ((*key, *rollup) for key, rollup in days.items()))
+        with self._lock:
+            self.written += len(events) - unmatched
+            self.unmatched += unmatched
+            self.batches += 1
+
+    def _connect(self, check_same_thread=True):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            db.executescript(SCHEMA)
+            self._schema_ready = True
+        return db
+
+    @contextmanager
+    def _db(self):
+        db = self._connect()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def open_alarms(self, receive_id=None, since=None, until=None, limit=20):
+        # 未处理的告警，返回 (总数, 最早的 limit 条 [(message_id, receive_id_type, receive_id, raised_at, raised_by)])
+        # open alarms, returns (total, the oldest limit of them [(message_id, receive_id_type, receive_id, raised_at,
+        # raised_by)])
+        where, params = _range("raised_at", since, until)
+        if receive_id is not None:
+            where += " AND receive_id = ?"
+            params += (receive_id,)
+        with self._db() as db:
+            total = db.execute(f"SELECT COUNT(*) FROM alarms WHERE resolved_at IS NULL{where}", params).fetchone()[0]
+            rows = db.execute(
+                f"SELECT message_id, receive_id_type, receive_id, raised_at, raised_by FROM alarms "
+                f"WHERE resolved_at IS NULL{where} ORDER BY raised_at LIMIT ?",
+                params + (limit,),
+            ).fetchall()
+        return total, rows
+
+    def open_by_receiver(self, limit=10):
+        # 未处理告警最多的会话和用户：[(receive_id, 未处理数, 最早发起时间)]
+        # chats and users with the most open alarms: [(receive_id, open alarms, oldest raised_at)]
+        with self._db() as db:
+            return db.execute(
+                "SELECT receive_id, COUNT(*), MIN(raised_at) FROM alarms WHERE resolved_at IS NULL "
+                "GROUP BY receive_id ORDER BY COUNT(*) DESC, MIN(raised_at) LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def alarms(self, receive_id, since=None, until=None, limit=100):
+        # 一个会话或用户在时间范围内的告警，最新的在前
+        # the alarms of a chat or user in the time range, newest first
+        where, params = _range("raised_at", since, until)
+        with self._db() as db:
+            return db.execute(
+                f"SELECT message_id, raised_at, raised_by, message_count, resolved_at, resolved_by, notes FROM alarms "
+                f"WHERE receive_id = ?{where} ORDER BY raised_at DESC LIMIT ?",
+                (receive_id,) + params + (limit,),
+            ).fetchall()
+
+    def mttr(self, since=None, until=None, receive_id=None, limit=10):
+        # 按小时汇总的统计，since 和 until 向下取整到小时。返回 (合计, 告警最多的 limit 个会话)，
+        # 每项是 (receive_id, 发起数, 处理数, 平均处理秒数)，合计的 receive_id 为 None
+        # Statistics from the rollups, since and until are rounded down to the hour. Returns (total, the limit chats
+        # with the most alarms), each as (receive_id, raised, resolved, mean seconds to resolve); the total has
+        # receive_id None.
+        parts = []
+        params = ()
+        for table, column, start, end in _rollup_ranges(_hour(since), _hour(until)):
+            where, part_params = _range(column, start, end)
+            if receive_id is not None:
+                where += " AND receive_id = ?"
+                part_params += (receive_id,)
+            parts.append(f"SELECT receive_id, raised, resolved, resolve_seconds FROM {table} WHERE 1{where}")
+            params += part_params
+        with self._db() as db:
+            rows = db.execute(
+                f"SELECT receive_id, SUM(raised), SUM(resolved), SUM(resolve_seconds) "
+                f"FROM ({' UNION ALL '.join(parts)}) GROUP BY receive_id",
+                params,
+            ).fetchall()
+        raised = sum(row[1] for row in rows)
+        resolved = sum(row[2] for row in rows)
+        resolve_seconds = sum(row[3] for row in rows)
+        chats = [
+            (chat, chat_raised, chat_resolved, chat_seconds / chat_resolved if chat_resolved else None)
+            for chat, chat_raised, chat_resolved, chat_seconds in heapq.nlargest(limit, rows, key=lambda row: row[1])
+        ]
+        return (None, raised, resolved, resolve_seconds / resolved if resolved else None), chats
+
+    def operator(self, open_id, since=None, until=None):
+        # 一个用户在时间范围内发起和处理的告警数，以及处理的平均时长
+        # alarms a user raised and resolved in the time range, and their mean time to resolve
+        raised_where, raised_params = _range("raised_at", since, until)
+        resolved_where, resolved_params = _range("resolved_at", since, until)
+        with self._db() as db:
+            raised = db.execute(
+                f"SELECT COUNT(*) FROM alarms WHERE raised_by = ?{raised_where}", (open_id,) + raised_params
+            ).fetchone()[0]
+            resolved, mttr = db.execute(
+                f"SELECT COUNT(*), AVG(resolved_at - raised_at) FROM alarms WHERE resolved_by = ?{resolved_where}",
+                (open_id,) + resolved_params,
+            ).fetchone()
+        return {"open_id": open_id, "raised": raised, "resolved": resolved, "mttr": mttr}
+
+    def report(self, hours=24, open_id=None, limit=10):
+        # 告警统计卡片使用的数据：未处理的告警、最近 hours 小时每个会话的 MTTR，以及 open_id 的个人统计
+        # data of the alarm stats card: open alarms, MTTR per chat over the last hours hours and open_id's own numbers
+        self.flush()
+        start = time.perf_counter()
+        now = time.time()
+        since = now - hours * 3600
+        open_total = self.open_alarms(limit=0)[0]
+        total, chats = self.mttr(since, None, limit=limit)
+        report = {
+            "hours": hours,
+            "open": open_total,
+            "open_by_receiver": self.open_by_receiver(limit),
+            "total": total,
+            "chats": chats,
+            "operator": self.operator(open_id, since) if open_id is not None else None,
+        }
+        report["query_ms"] = (time.perf_counter() - start) * 1000
+        return report
+
+
+def _range(column, since, until):
+    where = ""
+    params = ()
+    if since is not None:
+        where += f" AND {column} >= ?"
+        params += (since,)
+    if until is not None:
+        where += f" AND {column} < ?"
+        params += (until,)
+    return where, params
+
+
+def _hour(timestamp):
+    return None if timestamp is None else int(timestamp // 3600)
+
+
+def _rollup_ranges(first_hour, end_hour):
+    # 用天汇总覆盖 [first_hour, end_hour) 中的整天，两端剩下的小时用小时汇总：[(表, 列, 起, 止)]，None 表示不限
+    # cover the whole days of [first_hour, end_hour) with the day rollup and the hours left at both ends with the hour
+    # rollup: [(table, column, start, end)], None is unbounded
+    first_day = None if first_hour is None else -(-first_hour // 24)
+    end_day = None if end_hour is None else end_hour // 24
+    if first_day is not None and end_day is not None and first_day >= end_day:
+        return [("alarm_hours", "hour", first_hour, end_hour)]
+    ranges = [("alarm_days", "day", first_day, end_day)]
+    if first_hour is not None and first_hour < first_day * 24:
+        ranges.append(("alarm_hours", "hour", first_hour, first_day * 24))
+    if end_hour is not None and end_day * 24 < end_hour:
+        ranges.append(("alarm_hours", "hour", end_day * 24, end_hour))
+    return ranges
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, _tz).strftime("%m-%d %H:%M")
+
+
+def render_report_card(report):
+    # 告警统计卡片
+    # the alarm stats card
+    hours = report["hours"]
+    open_lines = [
+        f"- {receive_id}：{count} 条，最早 {format_time(oldest)} / {count} open, oldest {format_time(oldest)}"
+        for receive_id, count, oldest in report["open_by_receiver"]
+    ]
+    _, raised, resolved, mttr = report["total"]
+    chat_lines = [
+        f"- {receive_id}：发起 {chat_raised}，处理 {chat_resolved}，MTTR {format_duration(chat_mttr)}"
+        for receive_id, chat_raised, chat_resolved, chat_mttr in report["chats"]
+    ]
+    elements = [
+        {
+            "tag": "markdown",
+            "content": "\n".join([f"**未处理告警 Open alarms：{report['open']}**"] + open_lines),
+        },
+        {
+            "tag": "markdown",
+            "content": "\n".join(
+                [
+                    f"**最近 {hours} 小时 Last {hours}h：发起 raised {raised}，处理 resolved {resolved}，"
+                    f"MTTR {format_duration(mttr)}**"
+                ]
+                + chat_lines
+            ),
+        },
+    ]
+    operator = report["operator"]
+    if operator is not None:
+        elements.append(
+            {
+                "tag": "markdown",
+                "content": f"**我 Me**：发起 raised {operator['raised']}，处理 resolved {operator['resolved']}，"
+                f"MTTR {format_duration(operator['mttr'])}",
+            }
+        )
+    elements.append(
+        {"tag": "note", "elements": [{"tag": "plain_text", "content": f"{_clock.now()}，{report['query_ms']:.1f}ms"}]}
+    )
+    return codec.dumps(
+        {
+            "header": {
+                "template": "blue",
+                "title": {"tag": "plain_text", "content": "告警统计 Alarm stats"},
+            },
+            "elements": elements,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query the alarm records of the bot")
+    parser.add_argument("--db", default="alarms.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="open alarms and MTTR per chat")
+    report_parser.add_argument("--hours", type=int, default=24)
+    open_parser = commands.add_parser("open", help="list open alarms")
+    open_parser.add_argument("--receive-id")
+    open_parser.add_argument("--limit", type=int, default=20)
+    operator_parser = commands.add_parser("operator", help="alarms a user raised and resolved")
+    operator_parser.add_argument("open_id")
+    operator_parser.add_argument("--hours", type=int, default=24)
+    args = parser.parse_args()
+
+    store = AlarmStore(args.db)
+    if args.command == "report":
+        report = store.report(args.hours)
+        print(f"open alarms: {report['open']}")
+        for receive_id, count, oldest in report["open_by_receiver"]:
+            print(f"  {receive_id}\t{count}\toldest {format_time(oldest)}")
+        _, raised, resolved, mttr = report["total"]
+        print(f"last {args.hours}h: {raised} raised, {resolved} resolved, MTTR {format_duration(mttr)}")
+        for receive_id, chat_raised, chat_resolved, chat_mttr in report["chats"]:
+            print(f"  {receive_id}\t{chat_raised} raised\t{chat_resolved} resolved\tMTTR {format_duration(chat_mttr)}")
+        print(f"{report['query_ms']:.1f}ms")
+    elif args.command == "open":
+        total, rows = store.open_alarms(args.receive_id, limit=args.limit)
+        print(f"open alarms: {total}")
+        for message_id, receive_id_type, receive_id, raised_at, raised_by in rows:
+            print(f"  {format_time(raised_at)}\t{receive_id_type} {receive_id}\t{message_id}\t{raised_by or ''}")
+    else:
+        operator = store.operator(args.open_id, time.time() - args.hours * 3600)
+        print(
+            f"{args.open_id} last {args.hours}h: {operator['raised']} raised, {operator['resolved']} resolved, "
+            f"MTTR {format_duration(operator['mttr'])}"
+        )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
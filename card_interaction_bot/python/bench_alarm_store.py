@@ -0,0 +1,76 @@
+# 告警记录基准：通过后台批量写入记录 --alarms 条告警（分布在 --chats 个会话、--days 天内，--resolved 比例已处理），
+# 然后统计各查询的耗时。
+# Alarm store benchmark: records --alarms alarms (over --chats chats and --days days, a --resolved share of them
+# resolved) through the batched background writes, then times the queries.
+# usage: python3 bench_alarm_store.py --alarms 1000000
+import os
+import time
+import random
+import tempfile
+import argparse
+
+from alarm_store import AlarmStore, render_report_card
+
+
+def timeit(fn, number=20):
+    fn()
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--alarms", type=int, default=1000000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--operators", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--resolved", type=float, default=0.99)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as directory:
+        # 一次性写入全部告警，队列不设上限
+        # all alarms are recorded at once, the queue is unbounded
+        store = AlarmStore(os.path.join(directory, "alarms.db"), max_pending=args.alarms * 2)
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(args.alarms):
+            raised_at = now - args.days * 86400 * (1 - i / args.alarms)
+            chat = random.randrange(args.chats)
+            message_id = f"om_bench_{i}"
+            store.raised(message_id, "chat_id", f"oc_bench_{chat}", f"ou_bench_{chat % args.operators}", 1, raised_at)
+            if random.random() < args.resolved:
+                resolved_at = min(raised_at + random.expovariate(1 / 600), now)
+                store.resolved(message_id, f"ou_bench_{random.randrange(args.operators)}", "", resolved_at)
+        recorded = time.perf_counter() - start
+        store.flush()
+        elapsed = time.perf_counter() - start
+        stats = store.stats()
+        print(
+            f"recorded {stats['recorded']} events in {recorded:.1f}s ({stats['recorded'] / recorded:.0f}/s on the "
+            f"caller), written in {stats['batches']} batches after {elapsed:.1f}s ({stats['written'] / elapsed:.0f}/s)"
+        )
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"database {size / 1024 / 1024:.0f}MB")
+
+        week = now - 7 * 86400
+        queries = (
+            ("open alarms", lambda: store.open_alarms()),
+            ("open alarms of a chat", lambda: store.open_alarms("oc_bench_7")),
+            ("open alarms by chat", lambda: store.open_by_receiver()),
+            ("alarms of a chat, 7 days", lambda: store.alarms("oc_bench_7", week)),
+            ("MTTR per chat, 24 hours", lambda: store.mttr(now - 86400)),
+            ("MTTR per chat, 7 days", lambda: store.mttr(week)),
+            ("MTTR of a chat, 30 days", lambda: store.mttr(now - 30 * 86400, receive_id="oc_bench_7")),
+            ("operator, 7 days", lambda: store.operator("ou_bench_7", week)),
+            ("stats card, 24 hours", lambda: render_report_card(store.report(24, "ou_bench_7"))),
+        )
+        for name, fn in queries:
+            print(f"{name:<26} {timeit(fn) * 1000:>7.2f}ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
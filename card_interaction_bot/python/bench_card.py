@@ -0,0 +1,75 @@
+# 卡片内容构造的微基准：每次构造并序列化整个模板卡片（原来的做法）和预编译的 CardTemplate。
+# Micro-benchmark of building card contents: building and serializing the whole template card on every send
+# (the previous way) and the precompiled CardTemplate.
+# usage: python3 bench_card.py --number 200000
+import time
+import argparse
+from datetime import datetime, timezone, timedelta
+
+import codec
+from card_render import CardTemplate, SecondClock
+
+WELCOME_CARD_ID = "AAqkz9Dc1HRxx"
+ALERT_CARD_ID = "AAqkz9Dc1HRyy"
+
+
+def welcome_card(open_id):
+    return codec.dumps(
+        {
+            "type": "template",
+            "data": {
+                "template_id": WELCOME_CARD_ID,
+                "template_variable": {"open_id": open_id},
+            },
+        }
+    )
+
+
+def alarm_card():
+    return codec.dumps(
+        {
+            "type": "template",
+            "data": {
+                "template_id": ALERT_CARD_ID,
+                "template_variable": {
+                    "alarm_time": datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S (UTC+8)"),
+                },
+            },
+        }
+    )
+
+
+def timeit(fn, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    welcome = CardTemplate(WELCOME_CARD_ID)
+    alarm = CardTemplate(ALERT_CARD_ID)
+    clock = SecondClock("%Y-%m-%d %H:%M:%S (UTC+8)", 8)
+    open_id = 'ou_7d8a6e6df7621556ce0d21922b676706c"\\'
+    # 两种方式的输出解析后相同
+    # both ways parse to the same card
+    assert codec.loads(welcome_card(open_id)) == codec.loads(welcome.render({"open_id": open_id}))
+    assert codec.loads(alarm_card()) == codec.loads(alarm.render({"alarm_time": clock.now()}))
+
+    runs = (
+        ("welcome", lambda: welcome_card(open_id), lambda: welcome.render({"open_id": open_id})),
+        ("alarm", alarm_card, lambda: alarm.render({"alarm_time": clock.now()})),
+    )
+    print(f"codec backend: {codec.BACKEND}")
+    for name, before, after in runs:
+        old = timeit(before, args.number)
+        new = timeit(after, args.number)
+        print(f"{name:<8} dumps {old * 1e6:>6.2f}us  precompiled {new * 1e6:>6.2f}us  {old / new:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
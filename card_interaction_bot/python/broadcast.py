@@ -0,0 +1,446 @@
+# 告警广播任务：把同一张卡片发送给大量会话和用户，进度保存在本地 SQLite 文件中，进程崩溃后可以继续执行而不重复发送。
+# open_id 接收者通过批量发送消息接口每次发送 batch_size 个，其它接收者（chat_id 等）在 workers 个线程中逐个发送。
+# Alarm broadcast jobs: one card is sent to many chats and users. Progress is checkpointed to a local SQLite file,
+# so a job resumes after a crash without sending again. open_id recipients go through the batch message API
+# batch_size at a time, other recipients (chat_id ...) are sent one by one on workers threads.
+# usage: python3 broadcast.py start on_call.txt
+#        python3 broadcast.py resume <job_id>
+#        python3 broadcast.py status <job_id> --recipients failed
+import os
+import time
+import uuid
+import socket
+import hashlib
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    msg_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    job_id TEXT NOT NULL,
+    receive_id_type TEXT NOT NULL,
+    receive_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (job_id, receive_id_type, receive_id)
+);
+CREATE INDEX IF NOT EXISTS recipients_status ON recipients (job_id, status);
+"""
+
+# 接收者状态：pending 未发送，sending 所在批次已发出但未收到结果，sent 已发送，invalid 接口报告无效，failed 重试后仍失败。
+# 逐个发送的消息带有由任务和接收者生成的 uuid，开放平台 1 小时内对相同 uuid 只发送一次，崩溃前已发出的消息继续执行时不会重复；
+# 批量发送接口不支持去重，崩溃时处于 sending 的批次会重新发送。
+# Recipient status: pending not sent yet, sending its batch went out without a result, sent, invalid as reported by the
+# API, failed after all attempts. Messages sent one by one carry a uuid made from the job and the recipient, and the open
+# platform sends a uuid at most once an hour, so a message that went out just before a crash isn't sent twice on resume.
+# The batch message API has no deduplication, a batch still sending at the crash is sent again.
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+INVALID = "invalid"
+FAILED = "failed"
+
+# 执行中的任务由一个进程持有租约（owner 为 "主机名:进程号"），租约在每次保存进度时续期。多个 worker 同时启动时只有取得租约的
+# 进程继续执行任务；租约过期或持有者是本机已退出的进程时，其它进程可以接手。
+# A running job is leased by one process (owner is "hostname:pid"), the lease is renewed at every checkpoint. When
+# several workers start at once only the one that takes the lease resumes a job; another process can take over once
+# the lease expires or when its owner is a process on this host that has exited.
+
+
+class Broadcaster(object):
+    def __init__(
+        self, path, send_message, batch_send_message=None, workers=10, batch_size=200, attempts=3, lease=30.0
+    ):
+        # send_message(receive_id_type, receive_id, msg_type, content, uuid) 返回发送消息接口的响应；
+        # batch_send_message(open_ids, msg_type, content) 返回 (message_id, 无效的 open_id)，为 None 时全部逐个发送
+        # send_message(receive_id_type, receive_id, msg_type, content, uuid) returns the send message API's response,
+        # batch_send_message(open_ids, msg_type, content) returns (message_id, invalid open_ids); None sends one by one
+        self.path = path
+        self.send_message = send_message
+        self.batch_send_message = batch_send_message
+        self.workers = workers
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.lease = lease
+        # 第一次使用时才创建数据库文件
+        # the database file is created on first use
+        self._schema_ready = False
+
+    def create(self, recipients, msg_type, content, job_id=None):
+        # recipients: [(receive_id_type, receive_id)]，重复的接收者只发送一次
+        # recipients: [(receive_id_type, receive_id)], a repeated recipient is sent once
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO jobs (job_id, msg_type, content, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, msg_type, content, PENDING, now),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO recipients (job_id, receive_id_type, receive_id, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((job_id, receive_id_type, receive_id, PENDING, now) for receive_id_type, receive_id in recipients),
+            )
+        return job_id
+
+    def unfinished(self):
+        if not os.path.exists(self.path):
+            return []
+        with self._db() as db:
+            return [row[0] for row in db.execute("SELECT job_id FROM jobs WHERE status != 'done' ORDER BY created_at")]
+
+    def claim_unfinished(self):
+        # 取得未完成任务的租约，返回取得的任务；其它进程正在执行的任务被跳过
+        # take the lease of the unfinished jobs, returns the jobs taken; jobs running in another process are skipped
+        return [job_id for job_id in self.unfinished() if self.claim(job_id)]
+
+    def claim(self, job_id):
+        # 取得或续期任务的租约，任务由其它进程持有时返回 False
+        # take or renew the job's lease, returns False when another process holds it
+        owner = _owner()
+        with self._db() as db:
+            row = db.execute("SELECT owner, lease_until FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"no broadcast job {job_id!r}")
+            held_by, lease_until = row
+            now = time.time()
+            if held_by not in (None, owner) and lease_until > now and _alive(held_by):
+                return False
+            # 只在读取后没有其它进程取得租约时更新
+            # only updated if no other process took the lease since it was read
+            return db.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ? WHERE job_id = ? AND owner IS ? AND lease_until IS ?",
+                (owner, now + self.lease, job_id, held_by, lease_until),
+            ).rowcount == 1
+
+    def run(self, job_id, retry_failed=False, cancel=None, progress=None, progress_interval=5.0):
+        # 发送任务中尚未发送的接收者，返回 report()。cancel 是 threading.Event，设置后不再发出新请求，
+        # 等待已发出的请求完成并保存进度；progress(report) 每 progress_interval 秒调用一次。
+        # Send to the job's recipients that haven't been sent yet, returns report(). cancel is a threading.Event: once
+        # set no new request goes out, requests in flight finish and are checkpointed. progress(report) is called
+        # every progress_interval seconds. Raises RuntimeError when another process is running the job.
+        if not self.claim(job_id):
+            raise RuntimeError(f"broadcast job {job_id} is running in another process")
+        db = self._connect()
+        try:
+            msg_type, content = db.execute("SELECT msg_type, content FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            statuses = (PENDING, SENDING, FAILED) if retry_failed else (PENDING, SENDING)
+            rows = db.execute(
+                f"SELECT receive_id_type, receive_id FROM recipients WHERE job_id = ? "
+                f"AND status IN ({', '.join('?' * len(statuses))})",
+                (job_id, *statuses),
+            ).fetchall()
+            db.execute("UPDATE jobs SET status = 'running' WHERE job_id = ?", (job_id,))
+            db.commit()
+            tasks = self._tasks(job_id, rows, msg_type, content)
+            start = time.monotonic()
+            done = self._send(db, job_id, tasks, cancel, progress, progress_interval, start)
+            report = self.report(job_id, db)
+            finished = report["pending"] == 0 and report["failed"] == 0
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ?",
+                ("done" if finished else "incomplete", time.time() if finished else None, job_id),
+            )
+            db.commit()
+            elapsed = time.monotonic() - start
+            report["status"] = "done" if finished else "incomplete"
+            report["run_recipients"] = done
+            report["run_seconds"] = elapsed
+            report["run_per_second"] = done / elapsed if elapsed else 0.0
+            return report
+        finally:
+            # 释放租约
+            # release the lease
+            db.rollback()
+            db.execute(
+                "UPDATE jobs SET owner = NULL, lease_until = NULL WHERE job_id = ? AND owner = ?", (job_id, _owner())
+            )
+            db.commit()
+            db.close()
+
+    def report(self, job_id, db=None):
+        # 各状态的接收者数
+        # number of recipients per status
+        own = db is None
+        db = db or self._connect()
+        try:
+            row = db.execute("SELECT status, created_at, finished_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"no broadcast job {job_id!r}")
+            status, created_at, finished_at = row
+            counts = dict(
+                db.execute("SELECT status, COUNT(*) FROM recipients WHERE job_id = ? GROUP BY status", (job_id,))
+            )
+        finally:
+            if own:
+                db.close()
+        report = {"job_id": job_id, "status": status, "created_at": created_at, "finished_at": finished_at}
+        for name in (SENT, INVALID, FAILED):
+            report[name] = counts.get(name, 0)
+        report["pending"] = counts.get(PENDING, 0) + counts.get(SENDING, 0)
+        report["total"] = sum(counts.values())
+        return report
+
+    def recipients(self, job_id, status=None):
+        # 每个接收者的状态：[(receive_id_type, receive_id, status, message_id, error, attempts)]
+        # status of every recipient: [(receive_id_type, receive_id, status, message_id, error, attempts)]
+        sql = "SELECT receive_id_type, receive_id, status, message_id, error, attempts FROM recipients WHERE job_id = ?"
+        params = (job_id,)
+        if status is not None:
+            sql += " AND status = ?"
+            params += (status,)
+        with self._db() as db:
+            return db.execute(sql, params).fetchall()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            db.executescript(SCHEMA)
+            # 旧版本创建的数据库没有租约字段
+            # databases created by older versions have no lease columns
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            db.commit()
+            self._schema_ready = True
+        return db
+
+    @contextmanager
+    def _db(self):
+        # 提交并关闭
+        # commits and closes
+        db = self._connect()
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _tasks(self, job_id, rows, msg_type, content):
+        # [(recipients, fn)]，fn() 返回 [(receive_id_type, receive_id, status, message_id, error, attempts)]
+        # [(recipients, fn)], fn() returns [(receive_id_type, receive_id, status, message_id, error, attempts)]
+        tasks = []
+        batches = []
+        batched = []
+        for receive_id_type, receive_id in rows:
+            if self.batch_send_message is not None and receive_id_type == "open_id":
+                batched.append(receive_id)
+            else:
+                recipient = (receive_id_type, receive_id)
+                tasks.append(([recipient], lambda r=recipient: [self._send_one(job_id, *r, msg_type, content)]))
+        for i in range(0, len(batched), self.batch_size):
+            open_ids = batched[i:i + self.batch_size]
+            recipients = [("open_id", open_id) for open_id in open_ids]
+            batches.append((recipients, lambda o=open_ids: self._send_batch(o, msg_type, content)))
+        # 批量发送更快，排在前面
+        # batches are faster, they go first
+        return batches + tasks
+
+    def _send_one(self, job_id, receive_id_type, receive_id, msg_type, content):
+        message_uuid = hashlib.md5(f"{job_id}/{receive_id_type}/{receive_id}".encode("utf-8")).hexdigest()
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            try:
+                response = self.send_message(receive_id_type, receive_id, msg_type, content, message_uuid)
+                return receive_id_type, receive_id, SENT, response.data.message_id, None, attempt
+            except Exception as e:
+                error = str(e)
+                if attempt < self.attempts:
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+        return receive_id_type, receive_id, FAILED, None, error, self.attempts
+
+    def _send_batch(self, open_ids, msg_type, content):
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            try:
+                message_id, invalid = self.batch_send_message(open_ids, msg_type, content)
+                invalid = set(invalid)
+                return [
+                    ("open_id", open_id, INVALID if open_id in invalid else SENT, message_id, None, attempt)
+                    for open_id in open_ids
+                ]
+            except Exception as e:
+                error = str(e)
+                if attempt < self.attempts:
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+        return [("open_id", open_id, FAILED, None, error, self.attempts) for open_id in open_ids]
+
+    def _send(self, db, job_id, tasks, cancel, progress, progress_interval, start):
+        # 最多 workers * 2 个请求在排队或执行，结果每 100 个接收者或每秒保存一次
+        # at most workers * 2 requests queue or run, results are saved every 100 recipients or every second
+        done = 0
+        unsaved = 0
+        last_commit = last_progress = time.monotonic()
+        in_flight = set()
+        tasks = iter(tasks)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="broadcast") as pool:
+            while True:
+                while len(in_flight) < self.workers * 2 and not (cancel is not None and cancel.is_set()):
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    recipients, fn = task
+                    if len(recipients) > 1:
+                        # 批量发送没有去重，发出前先记录，崩溃后能知道哪些批次可能已经发出
+                        # the batch API doesn't deduplicate, record the batch before it goes out
+                        self._update(db, job_id, [(t, i, SENDING, None, None, 0) for t, i in recipients])
+                        db.commit()
+                    in_flight.add(pool.submit(fn))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results = future.result()
+                    self._update(db, job_id, results)
+                    done += len(results)
+                    unsaved += len(results)
+                now = time.monotonic()
+                if unsaved >= 100 or now - last_commit >= 1.0:
+                    self._renew(db, job_id)
+                    db.commit()
+                    unsaved = 0
+                    last_commit = now
+                if progress is not None and now - last_progress >= progress_interval:
+                    report = self.report(job_id, db)
+                    report["run_per_second"] = done / (now - start)
+                    progress(report)
+                    last_progress = now
+        db.commit()
+        return done
+
+    def _renew(self, db, job_id):
+        db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND owner = ?",
+            (time.time() + self.lease, job_id, _owner()),
+        )
+
+    def _update(self, db, job_id, results):
+        now = time.time()
+        db.executemany(
+            "UPDATE recipients SET status = ?, message_id = ?, error = ?, attempts = attempts + ?, updated_at = ? "
+            "WHERE job_id = ? AND receive_id_type = ? AND receive_id = ?",
+            (
+                (status, message_id, error, attempts, now, job_id, receive_id_type, receive_id)
+                for receive_id_type, receive_id, status, message_id, error, attempts in results
+            ),
+        )
+
+
+def _owner():
+    # 按调用时的进程号计算，fork 出的 worker 各不相同
+    # computed at call time, so forked workers differ
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _alive(owner):
+    # 持有者是本机进程时检查它是否还在运行，其它主机的进程无法检查，视为运行中
+    # whether the owner is still running; processes on other hosts can't be checked and count as running
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        pass
+    return True
+
+
+def load_recipients(path):
+    # 每行一个接收者："chat_id oc_xxx"、"open_id ou_xxx"，或只写 id，按前缀 oc_、ou_ 判断类型；# 开头的行是注释
+    # one recipient per line: "chat_id oc_xxx", "open_id ou_xxx", or the id alone typed by its oc_ or ou_ prefix;
+    # lines starting with # are comments
+    recipients = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if len(parts) == 2:
+                recipients.append((parts[0], parts[1]))
+            elif line.startswith("oc_"):
+                recipients.append(("chat_id", line))
+            elif line.startswith("ou_"):
+                recipients.append(("open_id", line))
+            else:
+                raise ValueError(f"can't tell the id type of {line!r}, write it as '<receive_id_type> <receive_id>'")
+    return recipients
+
+
+def format_report(report):
+    line = (
+        f"job {report['job_id']} {report['status']}: {report['sent']}/{report['total']} sent, "
+        f"{report['invalid']} invalid, {report['failed']} failed, {report['pending']} pending"
+    )
+    if "run_per_second" in report:
+        line += f", {report['run_per_second']:.1f} recipients/s"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="broadcast an alarm card to many chats and users")
+    commands = parser.add_subparsers(dest="command", required=True)
+    start_parser = commands.add_parser("start", help="broadcast an alarm card to the recipients in a file")
+    start_parser.add_argument("path", help="recipients, one per line")
+    resume_parser = commands.add_parser("resume", help="continue an unfinished job")
+    resume_parser.add_argument("job_id", nargs="?", help="default: every unfinished job")
+    resume_parser.add_argument("--retry-failed", action="store_true")
+    status_parser = commands.add_parser("status", help="show a job's progress")
+    status_parser.add_argument("job_id")
+    status_parser.add_argument("--recipients", metavar="STATUS", help="list the recipients with this status")
+    args = parser.parse_args()
+
+    # 使用 main.py 中的 client、发送函数和告警卡片
+    # the client, send functions and alarm card of main.py are used
+    import main as bot
+
+    broadcaster = bot.broadcaster
+    try:
+        if args.command == "start":
+            job_id = bot.start_alarm_broadcast(load_recipients(args.path))
+            print(format_report(broadcaster.run(job_id, progress=lambda r: print(format_report(r)))))
+        elif args.command == "resume" and args.job_id:
+            report = broadcaster.run(args.job_id, args.retry_failed, progress=lambda r: print(format_report(r)))
+            print(format_report(report))
+        elif args.command == "resume":
+            # 任务依次执行，每个任务在开始时才取得租约（run() 中），前面的任务执行期间不会占着后面任务的租约；
+            # 其它进程正在执行的任务被跳过
+            # jobs run one after another and each takes its lease as it starts (in run()), so later jobs aren't
+            # held while earlier ones run; jobs running in another process are skipped
+            for job_id in broadcaster.unfinished():
+                try:
+                    report = broadcaster.run(job_id, args.retry_failed, progress=lambda r: print(format_report(r)))
+                except RuntimeError as e:
+                    print(f"skipped: {e}")
+                    continue
+                print(format_report(report))
+        else:
+            print(format_report(broadcaster.report(args.job_id)))
+            if args.recipients:
+                for row in broadcaster.recipients(args.job_id, args.recipients):
+                    print("\t".join("" if value is None else str(value) for value in row))
+    except (ValueError, RuntimeError) as e:
+        raise SystemExit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import time
+import functools
+from json.encoder import encode_basestring
+from datetime import datetime, timezone, timedelta
+
+import codec
+
+
+# 预编译的模板卡片：每个 template_id 的外层结构只序列化一次，发送时只需转义并拼接 template_variable 的值。
+# 输出与 codec.dumps({"type": "template", "data": {"template_id": ..., "template_variable": ...}}) 等价。
+# A precompiled template card: the envelope of a template_id is serialized once, a send only escapes and splices
+# in the values of template_variable. The output is equivalent to
+# codec.dumps({"type": "template", "data": {"template_id": ..., "template_variable": ...}}).
+class CardTemplate(object):
+    def __init__(self, template_id):
+        self.template_id = template_id
+        self._prefix = '{"type":"template","data":{"template_id":' + codec.dumps(template_id) + ',"template_variable":'
+        # 变量名 -> 序列化后的 "name":
+        # variable name -> serialized "name":
+        self._keys = {}
+
+    def render(self, template_variable):
+        if codec.BACKEND == "orjson":
+            # orjson 序列化一个小 dict 比逐个转义更快
+            # orjson serializes a small dict faster than escaping value by value
+            return self._prefix + codec.dumps(template_variable) + "}}"
+        try:
+            return self._prefix + "{" + ",".join(
+                [
+                    # 字符串直接转义，其它类型交给 codec
+                    # strings are escaped directly, other types go through codec
+                    self._keys[name] + (encode_basestring(value) if value.__class__ is str else codec.dumps(value))
+                    for name, value in template_variable.items()
+                ]
+            ) + "}}}"
+        except KeyError:
+            for name in template_variable:
+                self._keys.setdefault(name, encode_basestring(name) + ":")
+            return self.render(template_variable)
+
+
+@functools.lru_cache(maxsize=None)
+def fixed_timezone(hours):
+    return timezone(timedelta(hours=hours))
+
+
+# 按秒缓存的当前时间字符串，同一秒内只格式化一次
+# The current time formatted at most once per second.
+class SecondClock(object):
+    def __init__(self, fmt, utc_offset_hours=0):
+        self.fmt = fmt
+        self.tz = fixed_timezone(utc_offset_hours)
+        # (秒, 格式化结果)，整体替换，多线程读写不需要加锁
+        # (second, formatted), replaced as a whole so threads need no lock
+        self._last = (None, "")
+
+    def now(self):
+        second = int(time.time())
+        last_second, text = self._last
+        if second != last_second:
+            text = datetime.fromtimestamp(second, self.tz).strftime(self.fmt)
+            self._last = (second, text)
+        return text
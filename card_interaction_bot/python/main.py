@@ -1,8 +1,16 @@
 import os
-import json
-from datetime import datetime, timezone, timedelta
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import lark_oapi as lark
+from replay import EventRecorder
+from coalescer import Coalescer
+from card_render import CardTemplate, SecondClock
+from broadcast import Broadcaster, load_recipients
+from storm_control import StormControl
+from alarm_store import AlarmStore, render_report_card
+import codec
 from lark_oapi.api.im.v1 import *
 from lark_oapi.api.application.v6 import *
 from lark_oapi.event.callback.model.p2_card_action_trigger import (
@@ -13,22 +21,87 @@ from lark_oapi.event.callback.model.p2_card_action_trigger import (
 WELCOME_CARD_ID = os.getenv("WELCOME_CARD_ID")
 ALERT_CARD_ID = os.getenv("ALERT_CARD_ID")
 ALERT_RESOLVED_CARD_ID = os.getenv("ALERT_RESOLVED_CARD_ID")
+# 把收到的事件录制到该文件，供 replay.py 回放；{pid} 会替换为进程号，多进程运行时每个进程各写一个文件
+# Record received events to this file for replay.py; {pid} is replaced by the process id, so that every
+# process writes its own file when running under supervisor.py.
+RECORD_EVENTS = os.getenv("RECORD_EVENTS", "")
+# 合并群聊中连续的消息，只发送一张告警卡片：COALESCE_WINDOW 秒内没有新消息、距第一条消息已过 COALESCE_MAX_DELAY 秒
+# 或攒够 COALESCE_MAX_BATCH 条消息时发送，卡片变量 message_count 是合并的消息数。COALESCE_WINDOW 为 0（默认）时不合并。
+# 合并后的卡片由 COALESCE_WORKERS 个线程发送。
+# Merge consecutive messages of a group chat into a single alarm card, sent once no new message arrived for
+# COALESCE_WINDOW seconds, COALESCE_MAX_DELAY seconds after the first message or once COALESCE_MAX_BATCH messages
+# are collected; the card variable message_count is the number of merged messages. Messages are not merged when
+# COALESCE_WINDOW is 0, the default. Merged cards are sent by COALESCE_WORKERS threads.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", "2"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "20"))
+COALESCE_WORKERS = int(os.getenv("COALESCE_WORKERS", "8"))
+# 告警广播：ON_CALL_RECIPIENTS 文件中每行一个接收者（chat_id 或 open_id），点击菜单“广播告警”时向所有接收者发送告警卡片。
+# 进度保存在 BROADCAST_DB 中，机器人启动时继续执行未完成的广播；BROADCAST_WORKERS 个线程逐个发送，
+# open_id 接收者每 BROADCAST_BATCH_SIZE 个通过批量发送消息接口发送，设置 BROADCAST_BATCH_SIZE=0 时全部逐个发送。
+# Alarm broadcast: the ON_CALL_RECIPIENTS file holds one recipient (chat_id or open_id) per line, the "Broadcast alarm"
+# menu sends the alarm card to all of them. Progress is kept in BROADCAST_DB and unfinished broadcasts resume when the
+# bot starts. BROADCAST_WORKERS threads send one by one, open_id recipients go through the batch message API
+# BROADCAST_BATCH_SIZE at a time; BROADCAST_BATCH_SIZE=0 sends everything one by one.
+# 告警风暴控制：每个会话或用户每分钟最多 STORM_RATE_PER_MINUTE 张告警卡片，允许突发 STORM_BURST 张，
+# 超出的告警计入一张每 STORM_UPDATE_INTERVAL 秒更新一次的汇总卡片。STORM_RATE_PER_MINUTE=0 时不限制。
+# Alarm storm control: at most STORM_RATE_PER_MINUTE alarm cards a minute per chat or user with bursts of STORM_BURST,
+# further alarms are counted on one aggregated card updated every STORM_UPDATE_INTERVAL seconds.
+# STORM_RATE_PER_MINUTE=0 turns it off.
+STORM_RATE_PER_MINUTE = float(os.getenv("STORM_RATE_PER_MINUTE", "6"))
+STORM_BURST = int(os.getenv("STORM_BURST", "10"))
+STORM_UPDATE_INTERVAL = int(os.getenv("STORM_UPDATE_INTERVAL", "30"))
+# supervisor.py 运行的工作进程数，单进程运行时为 1。开放平台把事件分散推送给各个进程的长连接，而风暴控制和消息合并
+# 只在进程内生效：每个进程使用 STORM_RATE_PER_MINUTE 和 STORM_BURST 的 1/SUPERVISOR_WORKERS，合计仍是配置的限额；
+# 每个进程各有一张汇总卡片，同一会话的消息只在同一进程内合并。
+# Worker processes run by supervisor.py, 1 when run alone. Lark spreads events over the workers' long connections,
+# while storm control and coalescing only act within a process: every worker gets 1/SUPERVISOR_WORKERS of
+# STORM_RATE_PER_MINUTE and STORM_BURST so that together they keep the configured limit. Each worker keeps its own
+# aggregated card, and a chat's messages are only merged with those that reach the same worker.
+SUPERVISOR_WORKERS = max(1, int(os.getenv("SUPERVISOR_WORKERS", "1")))
+ON_CALL_RECIPIENTS = os.getenv("ON_CALL_RECIPIENTS", "")
+BROADCAST_DB = os.getenv("BROADCAST_DB", "broadcast.db")
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+# 卡片回调：回调在长连接的事件循环中执行，调用 OpenAPI 的操作（发送告警卡片）交给 CARD_ACTION_WORKERS 个后台线程，
+# 回调立即返回提示，不等待操作完成；操作产生的卡片在回调响应之后用回调中的 token 延时更新。
+# Card callbacks: the callback runs on the long connection's event loop, so work calling OpenAPI (sending alarm cards)
+# goes to CARD_ACTION_WORKERS background threads and the callback answers with a toast at once, without waiting for
+# it. A card the work produces is delivered after the callback's response with a delayed update using its token.
+CARD_ACTION_WORKERS = int(os.getenv("CARD_ACTION_WORKERS", "8"))
+# 告警记录：发出的告警卡片和处理结果保存在 SQLite 文件 ALARM_DB 中，点击菜单“告警统计”时发送未处理的告警和
+# 最近 ALARM_STATS_HOURS 小时每个会话的平均处理时长。ALARM_DB 为空时不记录。
+# Alarm records: alarm cards sent and their resolutions are kept in the SQLite file ALARM_DB, the "Alarm stats" menu
+# sends the open alarms and the mean time to resolve per chat over the last ALARM_STATS_HOURS hours.
+# An empty ALARM_DB records nothing.
+ALARM_DB = os.getenv("ALARM_DB", "alarms.db")
+ALARM_STATS_HOURS = int(os.getenv("ALARM_STATS_HOURS", "24"))
+
+# 卡片内容按 template_id 预编译，时间字符串每秒只格式化一次
+# Card contents are precompiled per template_id, and the time string is formatted once per second.
+welcome_card = CardTemplate(WELCOME_CARD_ID)
+alarm_card = CardTemplate(ALERT_CARD_ID)
+clock = SecondClock("%Y-%m-%d %H:%M:%S (UTC+8)", 8)
 
 
 # 发送消息
 # Send a message
 # # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-def send_message(receive_id_type, receive_id, msg_type, content):
+# uuid 用于去重，1 小时内相同 uuid 的请求只发送一条消息
+# uuid deduplicates, requests with the same uuid send at most one message an hour
+def send_message(receive_id_type, receive_id, msg_type, content, uuid=None):
+    request_body = (
+        CreateMessageRequestBody.builder()
+        .receive_id(receive_id)
+        .msg_type(msg_type)
+        .content(content)
+    )
+    if uuid is not None:
+        request_body.uuid(uuid)
     request = (
         CreateMessageRequest.builder()
         .receive_id_type(receive_id_type)
-        .request_body(
-            CreateMessageRequestBody.builder()
-            .receive_id(receive_id)
-            .msg_type(msg_type)
-            .content(content)
-            .build()
-        )
+        .request_body(request_body.build())
         .build()
     )
 
@@ -43,40 +116,115 @@ def send_message(receive_id_type, receive_id, msg_type, content):
     return response
 
 
+# 批量发送消息给多个用户，返回 (message_id, 无效的 open_id)；卡片以对象而不是字符串放在 card 字段中
+# Send a message to many users at once, returns (message_id, invalid open_ids). A card goes in the card field as an
+# object rather than a string.
+# https://open.feishu.cn/document/server-docs/im-v1/batch_message/send-messages-in-batches
+def batch_send_message(open_ids, msg_type, content):
+    body = {"open_ids": open_ids, "msg_type": msg_type}
+    if msg_type == "interactive":
+        body["card"] = codec.loads(content)
+    else:
+        body["content"] = codec.loads(content)
+    request = (
+        lark.BaseRequest.builder()
+        .http_method(lark.HttpMethod.POST)
+        .uri("/open-apis/message/v4/batch_send/")
+        .token_types({lark.AccessTokenType.TENANT})
+        .headers({"Content-Type": "application/json; charset=utf-8"})
+        .body(body)
+        .build()
+    )
+    response = client.request(request)
+    if not response.success():
+        raise Exception(
+            f"batch send message failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+        )
+    data = codec.loads(response.raw.content).get("data") or {}
+    return data.get("message_id"), data.get("invalid_open_ids") or []
+
+
 # 发送欢迎卡片
 # Construct a welcome card
 # https://open.feishu.cn/document/uAjLw4CM/ukzMukzMukzM/feishu-cards/send-feishu-card#718fe26b
 def send_welcome_card(open_id):
-    content = json.dumps(
-        {
-            "type": "template",
-            "data": {
-                "template_id": WELCOME_CARD_ID,
-                "template_variable": {"open_id": open_id},
-            },
-        }
-    )
+    content = welcome_card.render({"open_id": open_id})
     return send_message("open_id", open_id, "interactive", content)
 
 
 # 发送告警卡片
 # Construct an alarm card
 # https://open.feishu.cn/document/uAjLw4CM/ukzMukzMukzM/feishu-cards/send-feishu-card#718fe26b
-def send_alarm_card(receive_id_type, receive_id):
-    content = json.dumps(
-        {
-            "type": "template",
-            "data": {
-                "template_id": ALERT_CARD_ID,
-                "template_variable": {
-                    "alarm_time": datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S (UTC+8)"),
-                },
-            },
-        }
-    )
+def send_alarm_card(receive_id_type, receive_id, message_count=None):
+    template_variable = {"alarm_time": clock.now()}
+    if message_count is not None:
+        template_variable["message_count"] = message_count
+    content = alarm_card.render(template_variable)
     return send_message(receive_id_type, receive_id, "interactive", content)
 
 
+# 更新卡片内容，卡片需要开启 update_multi
+# Update the content of a card, the card needs update_multi.
+# https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/patch
+def patch_message(message_id, content):
+    request = (
+        PatchMessageRequest.builder()
+        .message_id(message_id)
+        .request_body(PatchMessageRequestBody.builder().content(content).build())
+        .build()
+    )
+    response = client.im.v1.message.patch(request)
+    if not response.success():
+        raise Exception(
+            f"client.im.v1.message.patch failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+        )
+    return response
+
+
+# 延时更新卡片：响应卡片回调之后，用回调中的 token 更新卡片，token 30 分钟内有效，最多更新 2 次
+# Delayed card update: after the card callback was answered, update the card with the token of the callback.
+# The token is valid for 30 minutes and updates a card at most twice.
+# https://open.feishu.cn/document/server-docs/im-v1/message-card/delay-update-message-card
+def update_card_later(token, card):
+    request = (
+        lark.BaseRequest.builder()
+        .http_method(lark.HttpMethod.POST)
+        .uri("/open-apis/interactive/v1/card/update")
+        .token_types({lark.AccessTokenType.TENANT})
+        .headers({"Content-Type": "application/json; charset=utf-8"})
+        .body({"token": token, "card": card})
+        .build()
+    )
+    response = client.request(request)
+    if not response.success():
+        raise Exception(
+            f"delay update card failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+        )
+    return response
+
+
+# 发起告警：经过告警风暴控制，超出频率的告警计入汇总卡片而不发送新卡片。发出的告警卡片记录在告警记录中，
+# raised_by 是发起告警的用户
+# Raise an alarm. It goes through storm control, alarms above the rate are counted on the aggregated card
+# instead of sending new cards. Alarm cards sent are recorded in the alarm store, raised_by is the user who raised it.
+def raise_alarm(receive_id_type, receive_id, message_count=None, raised_by=None):
+    if storm_control is not None and not storm_control.allow(receive_id_type, receive_id, message_count or 1):
+        return None
+    response = send_alarm_card(receive_id_type, receive_id, message_count)
+    if alarm_store is not None:
+        alarm_store.raised(response.data.message_id, receive_id_type, receive_id, raised_by, message_count or 1)
+    return response
+
+
+# 为合并后的一批群聊消息发送一张告警卡片
+# Send one alarm card for a merged batch of group messages.
+def send_coalesced_alarm_card(chat_id, batch):
+    try:
+        raise_alarm("chat_id", chat_id, len(batch))
+    except Exception as e:
+        print(f"send alarm card for {len(batch)} messages to {chat_id} failed: {e}")
+
+
 # 处理用户进入机器人单聊事件
 # handle user enter bot single chat event
 # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/chat-access_event/events/bot_p2p_chat_entered
@@ -99,7 +247,54 @@ def do_p2_application_bot_menu_v6(data: P2ApplicationBotMenuV6) -> None:
     # 通过菜单 event_key 区分不同菜单。 你可以在开发者后台配置菜单的event_key
     # Use event_key to distinguish different menus. You can configure the event_key of the menu in the developer console.
     if event_key == "send_alarm":
-        send_alarm_card("open_id", open_id)
+        raise_alarm("open_id", open_id, raised_by=open_id)
+    elif event_key == "alarm_stats" and alarm_store is not None:
+        # 统计需要写入未保存的记录并查询 SQLite，在后台线程中执行，不阻塞长连接的事件循环
+        # the stats flush pending records and query SQLite, so they run on a background thread instead of the long
+        # connection's event loop
+        card_action_pool.submit(send_alarm_stats, open_id)
+    elif event_key == "broadcast_alarm" and ON_CALL_RECIPIENTS:
+        # 广播在后台线程中执行，完成后把结果发给点击菜单的用户
+        # the broadcast runs on a background thread, the result is sent to the user who clicked the menu
+        job_id = start_alarm_broadcast(load_recipients(ON_CALL_RECIPIENTS))
+        run_broadcast_in_background(job_id, open_id)
+
+
+# 告警统计卡片只发给点击菜单的用户
+# the alarm stats card goes to the user who clicked the menu only
+def send_alarm_stats(open_id):
+    try:
+        report = alarm_store.report(ALARM_STATS_HOURS, open_id)
+        send_message("open_id", open_id, "interactive", render_report_card(report))
+    except Exception as e:
+        print(f"send alarm stats failed: {e}")
+
+
+# 创建告警广播任务，卡片内容在创建时生成并保存，继续执行时发送相同的卡片
+# Create an alarm broadcast job. The card is rendered and saved at creation, so a resumed job sends the same card.
+def start_alarm_broadcast(recipients):
+    return broadcaster.create(recipients, "interactive", alarm_card.render({"alarm_time": clock.now()}))
+
+
+def run_broadcast_in_background(job_id, notify_open_id=None):
+    def run():
+        try:
+            report = broadcaster.run(job_id)
+            text = (
+                f"告警广播 {job_id}：已发送 {report['sent']}/{report['total']}，无效 {report['invalid']}，"
+                f"失败 {report['failed']}，{report['run_per_second']:.1f} 个/秒\n"
+                f"Alarm broadcast {job_id}: {report['sent']}/{report['total']} sent, {report['invalid']} invalid, "
+                f"{report['failed']} failed, {report['run_per_second']:.1f}/s"
+            )
+        except Exception as e:
+            text = f"告警广播 {job_id} 失败：{e}\nAlarm broadcast {job_id} failed: {e}"
+        print(text)
+        if notify_open_id is not None:
+            send_message("open_id", notify_open_id, "text", codec.dumps({"text": text}))
+
+    thread = threading.Thread(target=run, name=f"broadcast-{job_id}", daemon=True)
+    thread.start()
+    return thread
 
 
 # 接收用户发送的消息（包括单聊和群聊），接受到消息后发送告警卡片
@@ -111,28 +306,85 @@ def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
     chat_id = data.event.message.chat_id
     open_id = data.event.sender.sender_id.open_id
 
-    if chat_type == "group":
-        send_alarm_card("chat_id", chat_id)
+    if chat_type == "group" and coalescer is not None:
+        coalescer.add(chat_id, data)
+    elif chat_type == "group":
+        raise_alarm("chat_id", chat_id, raised_by=open_id)
     elif chat_type == "p2p":
-        send_alarm_card("open_id", open_id)
+        raise_alarm("open_id", open_id, raised_by=open_id)
+
+
+def toast(type, zh_cn, en_us):
+    return {"toast": {"type": type, "content": zh_cn, "i18n": {"zh_cn": zh_cn, "en_us": en_us}}}
+
 
+# 在后台线程中执行卡片回调的操作 work()，它返回回调的响应内容；回调立即返回 interim。
+# 响应内容中有卡片时，在回调返回之后用 token 延时更新卡片。
+# Run the work of a card callback on a background thread, work() returns the content of the callback response; the
+# callback returns interim at once. The card of the content, if any, is delivered with a delayed update after the
+# callback has returned.
+def respond_later(token, work, interim):
+    responded = threading.Event()
+    card_action_pool.submit(finish_card_action, token, work, responded)
+    responded.set()
+    return P2CardActionTriggerResponse(interim)
 
-# 处理卡片按钮点击回调
-# handle card button click callback
+
+def finish_card_action(token, work, responded):
+    try:
+        card = work().get("card")
+        if card is not None:
+            responded.wait()
+            update_card_later(token, card)
+    except Exception as e:
+        print(f"deferred card action failed: {e}")
+
+
+# 处理告警：记录处理结果，返回已处理的提示和卡片。message_id 是告警卡片消息的 id
+# Resolve an alarm: record the resolution and return the toast and the resolved card. message_id is the id of the
+# alarm card's message.
+def resolve_alarm(message_id, open_id, alarm_time, notes):
+    if alarm_store is not None and message_id:
+        alarm_store.resolved(message_id, open_id, notes)
+    return {
+        **toast("info", "已处理完成！", "Resolved!"),
+        "card": {
+            "type": "template",
+            "data": {
+                "template_id": ALERT_RESOLVED_CARD_ID,
+                "template_variable": {
+                    "alarm_time": alarm_time,
+                    "open_id": open_id,
+                    "complete_time": clock.now(),
+                    "notes": notes,
+                },
+            },
+        },
+    }
+
+
+# 处理卡片按钮点击回调。调用 OpenAPI 的操作在后台线程中执行，回调不等待网络请求
+# handle card button click callback. Work calling OpenAPI runs on a background thread, the callback never waits for
+# the network.
 # https://open.feishu.cn/document/uAjLw4CM/ukzMukzMukzM/feishu-cards/card-callback-communication
 def do_p2_card_action_trigger(data: P2CardActionTrigger) -> P2CardActionTriggerResponse:
     print(f"[ P2CardActionTrigger access ], data: {data}")
     open_id = data.event.operator.open_id
     action = data.event.action
+    token = data.event.token
 
     # 通过 action 区分不同按钮点击，你可以在卡片搭建工具配置按钮的action。此处处理用户点击了欢迎卡片中的发起告警按钮
     # Use action to distinguish different buttons. You can configure the action of the button in the card building tool.
     # Here, handle the situation where the user clicks the "Initiate Alarm" button on the welcome card.
     if action.value["action"] == "send_alarm":
-        # 响应回调请求，保持卡片原内容不变
-        # Respond to the callback request and keep the original content of the card unchanged.
-        send_alarm_card("open_id", open_id)
-        return P2CardActionTriggerResponse({})
+        # 响应回调请求，保持卡片原内容不变，提示正在发送告警卡片
+        # Respond to the callback request and keep the original content of the card unchanged. A toast tells the user
+        # the alarm is on its way.
+        def send():
+            raise_alarm("open_id", open_id, raised_by=open_id)
+            return {}
+
+        return respond_later(token, send, toast("info", "正在发起告警", "Raising the alarm"))
 
     # 通过 action 区分不同按钮， 你可以在卡片搭建工具配置按钮的action。此处处理用户点击了告警卡片中的已处理按钮
     # Use action to distinguish different buttons. You can configure the action of the button in the card building tool.
@@ -144,27 +396,49 @@ def do_p2_card_action_trigger(data: P2CardActionTrigger) -> P2CardActionTriggerR
         if action.form_value and "notes_input" in action.form_value:
             notes = str(action.form_value["notes_input"])
 
-        content = {
-            "toast": {
-                "type": "info",
-                "content": "已处理完成！",
-                "i18n": {"zh_cn": "已处理完成！", "en_us": "Resolved!"},
-            },
-            "card": {
-                "type": "template",
-                "data": {
-                    "template_id": ALERT_RESOLVED_CARD_ID,
-                    "template_variable": {
-                        "alarm_time": action.value["time"],
-                        "open_id": open_id,
-                        "complete_time": datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S (UTC+8)"),
-                        "notes": notes,
-                    },
-                },
-            },
-        }
-        return P2CardActionTriggerResponse(content)
+        alarm_time = action.value["time"]
+        message_id = data.event.context.open_message_id if data.event.context else None
+        # 处理告警只记录到 alarm_store 的写入队列，不调用 OpenAPI，直接返回已处理的卡片
+        # resolving only queues a write to alarm_store and calls no OpenAPI, the resolved card is returned directly
+        return P2CardActionTriggerResponse(resolve_alarm(message_id, open_id, alarm_time, notes))
+
 
+card_action_pool = ThreadPoolExecutor(CARD_ACTION_WORKERS, thread_name_prefix="card-action")
+
+coalescer = None
+if COALESCE_WINDOW > 0:
+    coalesce_pool = ThreadPoolExecutor(COALESCE_WORKERS, thread_name_prefix="alarm-sender")
+    coalescer = Coalescer(
+        lambda chat_id, batch: coalesce_pool.submit(send_coalesced_alarm_card, chat_id, batch),
+        COALESCE_WINDOW,
+        COALESCE_MAX_DELAY,
+        COALESCE_MAX_BATCH,
+    )
+
+storm_control = None
+if STORM_RATE_PER_MINUTE > 0:
+    storm_control = StormControl(
+        lambda receive_id_type, receive_id, content: send_message(
+            receive_id_type, receive_id, "interactive", content
+        ).data.message_id,
+        patch_message,
+        STORM_RATE_PER_MINUTE / SUPERVISOR_WORKERS,
+        -(-STORM_BURST // SUPERVISOR_WORKERS),
+        update_interval=STORM_UPDATE_INTERVAL,
+    )
+
+alarm_store = None
+if ALARM_DB:
+    alarm_store = AlarmStore(ALARM_DB)
+    atexit.register(alarm_store.close)
+
+broadcaster = Broadcaster(
+    BROADCAST_DB,
+    send_message,
+    batch_send_message if BROADCAST_BATCH_SIZE > 0 else None,
+    BROADCAST_WORKERS,
+    max(BROADCAST_BATCH_SIZE, 1),
+)
 
 # 注册事件回调
 # Register event handler.
@@ -178,6 +452,9 @@ event_handler = (
     .register_p2_card_action_trigger(do_p2_card_action_trigger)
     .build()
 )
+if RECORD_EVENTS:
+    recorder = EventRecorder(RECORD_EVENTS.format(pid=os.getpid())).install(event_handler)
+    atexit.register(recorder.close)
 
 
 # 创建 LarkClient 对象，用于请求OpenAPI, 并创建 LarkWSClient 对象，用于使用长连接接收事件。
@@ -191,8 +468,26 @@ wsClient = lark.ws.Client(
 )
 
 
+# 供 supervisor.py 汇总的统计信息
+# Stats aggregated by supervisor.py.
+def stats():
+    stats = {}
+    if coalescer is not None:
+        stats["coalescer"] = coalescer.stats()
+    if storm_control is not None:
+        stats["storm_control"] = storm_control.stats()
+    if alarm_store is not None:
+        stats["alarm_store"] = alarm_store.stats()
+    return stats
+
+
 def main():
     print("Starting bot...")
+    # 继续执行上次未完成的告警广播；supervisor.py 的多个 worker 中只有取得任务租约的一个继续执行
+    # resume the alarm broadcasts left unfinished last time; of the supervisor.py workers only the one that takes a
+    # job's lease resumes it
+    for job_id in broadcaster.claim_unfinished():
+        run_broadcast_in_background(job_id)
     # 启动长连接，并注册事件处理器。
     # Start long connection and register event handler.
     # https://open.feishu.cn/document/server-docs/event-subscription-guide/event-subscription-configure-/request-url-configuration-case#d286cc88
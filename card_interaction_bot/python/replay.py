@@ -0,0 +1,256 @@
+# 长连接事件的录制与回放。
+# 录制：设置 RECORD_EVENTS=events.jsonl.gz 运行机器人，收到的每个事件连同到达时间写入 gzip 压缩的 JSONL。
+# 回放：把录制的事件按原速、N 倍速或最快速度交给 event_handler，OpenAPI 请求发往本地模拟服务 fake_open_api.py，
+# 输出处理吞吐量、延迟分布和每轮回放后的内存增长。
+# Record and replay of long connection events.
+# Record: run the bot with RECORD_EVENTS=events.jsonl.gz, every event received is written with its arrival time
+# to gzip compressed JSONL.
+# Replay: feed recorded events to event_handler at 1x, Nx or max speed, with OpenAPI requests going to the local
+# stand-in fake_open_api.py, and report handler throughput, latency distribution and memory growth per round.
+# usage: python3 replay.py generate events.jsonl.gz --events 2000 --chats 50 --rate 200
+#        python3 replay.py run events.jsonl.gz --speed max --rounds 3 --latency 0.05
+import os
+import gc
+import sys
+import gzip
+import time
+import random
+import argparse
+import importlib
+import threading
+import codec
+
+
+class EventRecorder(object):
+    # 每行一个事件：{"t": 距录制开始的秒数, "payload": 事件原文}
+    # one event per line: {"t": seconds since recording started, "payload": raw event}
+    def __init__(self, path):
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self.recorded = 0
+
+    def install(self, event_handler):
+        # 长连接通过 _do_without_validation 把事件交给 event_handler，在这里记录事件
+        # The long connection hands events to event_handler through _do_without_validation, record them there.
+        do = event_handler._do_without_validation
+
+        def recorded(payload):
+            self.record(payload)
+            return do(payload)
+
+        event_handler._do_without_validation = recorded
+        return self
+
+    def record(self, payload):
+        line = codec.dumps({"t": round(time.monotonic() - self._start, 6), "payload": payload.decode("utf-8")})
+        with self._lock:
+            self._file.write(line + "\n")
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_events(path):
+    # [(t, payload bytes)]
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [(line["t"], line["payload"].encode("utf-8")) for line in map(codec.loads, f) if line]
+
+
+def generate_events(path, events, chats, rate, kinds):
+    # 生成合成的录制文件，用于没有真实录制时的回放
+    # write a synthetic recording, to replay when there is no real one
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for i in range(events):
+            kind = kinds[i % len(kinds)]
+            chat = i % chats
+            payload = _SYNTHETIC[kind](i, chat)
+            f.write(codec.dumps({"t": round(i / rate, 6), "payload": codec.dumps(payload)}) + "\n")
+
+
+def _header(i, event_type):
+    return {
+        "event_id": f"ev_replay_{i}",
+        "event_type": event_type,
+        "create_time": str(int(time.time() * 1000)),
+        "token": "",
+        "app_id": "cli_replay",
+        "tenant_key": "tenant_replay",
+    }
+
+
+def _message_event(i, chat):
+    chat_type = "p2p" if chat % 2 else "group"
+    return {
+        "schema": "2.0",
+        "header": _header(i, "im.message.receive_v1"),
+        "event": {
+            "sender": {"sender_id": {"open_id": f"ou_replay_{chat}"}, "sender_type": "user"},
+            "message": {
+                "message_id": f"om_replay_{i}",
+                "chat_id": f"oc_replay_{chat}",
+                "chat_type": chat_type,
+                "message_type": "text",
+                "content": codec.dumps({"text": f"replay {i} " + "x" * random.randint(0, 200)}),
+            },
+        },
+    }
+
+
+def _bot_menu_event(i, chat):
+    return {
+        "schema": "2.0",
+        "header": _header(i, "application.bot.menu_v6"),
+        "event": {
+            "operator": {"operator_id": {"open_id": f"ou_replay_{chat}"}},
+            "event_key": "send_alarm",
+            "timestamp": int(time.time()),
+        },
+    }
+
+
+def _card_action_event(i, chat):
+    return {
+        "schema": "2.0",
+        "header": _header(i, "card.action.trigger"),
+        "event": {
+            "operator": {"open_id": f"ou_replay_{chat}"},
+            "token": f"c-replay-{i}",
+            "action": {
+                "value": {"action": "complete_alarm", "time": "2024-01-01 00:00:00 (UTC+8)"},
+                "tag": "button",
+                "form_value": {"notes_input": f"note {i}"},
+            },
+            "context": {"open_message_id": f"om_replay_{i}", "open_chat_id": f"oc_replay_{chat}"},
+        },
+    }
+
+
+_SYNTHETIC = {
+    "message": _message_event,
+    "bot_menu": _bot_menu_event,
+    "card_action": _card_action_event,
+}
+
+
+class ReplayResult(object):
+    def __init__(self, latencies, errors, elapsed, rss_before, rss_after):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.rss_before = rss_before
+        self.rss_after = rss_after
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(round(p / 100.0 * (len(self.latencies) - 1))))]
+
+    def summary(self):
+        throughput = len(self.latencies) / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{len(self.latencies):>6} events {throughput:>8.1f} events/s  "
+            f"p50 {self.percentile(50) * 1000:>7.2f}ms  p95 {self.percentile(95) * 1000:>7.2f}ms  "
+            f"p99 {self.percentile(99) * 1000:>7.2f}ms  max {self.percentile(100) * 1000:>7.2f}ms  "
+            f"errors {self.errors}  rss {self.rss_after / 2 ** 20:.1f}MB "
+            f"({(self.rss_after - self.rss_before) / 2 ** 20:+.1f}MB)"
+        )
+
+
+def replay(event_handler, events, speed=None, drain=None):
+    # speed 为 None 时不等待，尽快回放；否则按录制的时间间隔除以 speed 回放。
+    # 延迟是 event_handler 处理每个事件的耗时；吞吐量的计时包括 drain()，即等待后台处理完成的时间。
+    # speed None replays as fast as possible, otherwise at the recorded intervals divided by speed.
+    # Latency is the time event_handler takes per event; throughput is timed up to drain(), which waits for
+    # work handed to background workers.
+    latencies, errors = [], 0
+    gc.collect()
+    rss_before = _rss()
+    start = time.perf_counter()
+    first = events[0][0] if events else 0.0
+    for t, payload in events:
+        if speed:
+            delay = (t - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        begin = time.perf_counter()
+        try:
+            event_handler._do_without_validation(payload)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - begin)
+    if drain is not None:
+        drain()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    return ReplayResult(latencies, errors, elapsed, rss_before, _rss())
+
+
+def _rss():
+    # 当前常驻内存（字节），没有 /proc 时退回到峰值
+    # current resident memory in bytes, the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(args):
+    # 在导入机器人模块之前设置好凭证，OpenAPI 请求都发往本地模拟服务
+    # credentials are set before the bot module is imported, every OpenAPI request goes to the local stand-in
+    os.environ.setdefault("APP_ID", "cli_replay")
+    os.environ.setdefault("APP_SECRET", "secret")
+    import lark_oapi as lark
+    from fake_open_api import FakeOpenApiServer
+
+    events = read_events(args.path)
+    module = importlib.import_module(args.module)
+    speed = None if args.speed == "max" else float(args.speed)
+    executor = getattr(module, "executor", None)
+    drain = getattr(executor, "drain", None)
+    with FakeOpenApiServer(latency=args.latency) as fake:
+        module.client = (
+            lark.Client.builder()
+            .app_id(os.environ["APP_ID"])
+            .app_secret(os.environ["APP_SECRET"])
+            .domain(fake.url)
+            .log_level(lark.LogLevel.ERROR)
+            .build()
+        )
+        print(f"replaying {len(events)} events from {args.path} at {args.speed} speed, {args.rounds} rounds")
+        for i in range(args.rounds):
+            result = replay(module.event_handler, events, speed, drain)
+            print(f"round {i + 1}: {result.summary()}")
+        print(f"open api requests: {fake.counters}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="record and replay long connection events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="replay a recording against the local open api stand-in")
+    run_parser.add_argument("path")
+    run_parser.add_argument("--speed", default="max", help="1 for recorded speed, N for N times faster, or max")
+    run_parser.add_argument("--rounds", type=int, default=3, help="replay the recording this many times")
+    run_parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every open api call")
+    run_parser.add_argument("--module", default="main", help="bot module defining event_handler and client")
+    generate_parser = commands.add_parser("generate", help="write a synthetic recording")
+    generate_parser.add_argument("path")
+    generate_parser.add_argument("--events", type=int, default=1000)
+    generate_parser.add_argument("--chats", type=int, default=50)
+    generate_parser.add_argument("--rate", type=float, default=100, help="events per second in the recording")
+    generate_parser.add_argument("--kind", action="append", choices=sorted(_SYNTHETIC), help="default: message")
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate_events(args.path, args.events, args.chats, args.rate, args.kind or ["message"])
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
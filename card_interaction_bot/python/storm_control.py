@@ -0,0 +1,203 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import codec
+from card_render import SecondClock
+
+_clock = SecondClock("%Y-%m-%d %H:%M:%S (UTC+8)", 8)
+
+
+# 告警风暴控制：每个接收者（chat_id 或 open_id）一个令牌桶，每分钟最多 rate_per_minute 张告警卡片，允许突发 burst 张。
+# 超出的告警不再发送新卡片，而是计入一张汇总卡片（“最近 5 分钟共 N 条告警”），后台线程每 update_interval 秒更新一次。
+# 长时间没有告警的接收者会被移除，最多记录 max_keys 个接收者，内存有上限。
+# Alarm storm control: one token bucket per recipient (chat_id or open_id) allows rate_per_minute alarm cards a minute
+# with bursts of burst cards. Alarms beyond that don't send new cards, they are counted on one aggregated card
+# ("N alarms in the last 5 minutes") that a background thread updates every update_interval seconds.
+# Recipients without recent alarms are dropped and at most max_keys recipients are tracked, so memory is bounded.
+class StormControl(object):
+    def __init__(
+        self,
+        send_card,
+        update_card,
+        rate_per_minute=6,
+        burst=10,
+        window=300,
+        update_interval=30,
+        max_keys=10000,
+    ):
+        # send_card(receive_id_type, receive_id, content) 返回 message_id；update_card(message_id, content) 更新卡片
+        # send_card(receive_id_type, receive_id, content) returns the message_id, update_card(message_id, content)
+        # updates the card
+        self.send_card = send_card
+        self.update_card = update_card
+        self.rate = rate_per_minute / 60.0
+        self.burst = float(burst)
+        self.window = window
+        self.update_interval = update_interval
+        self.max_keys = max_keys
+        # 告警计数按 update_interval 秒分槽，最近 window 秒的告警数是各槽之和
+        # alarms are counted in slots of update_interval seconds, the last window seconds are the sum of the slots
+        self._slots = max(1, -(-window // update_interval))
+        # (receive_id_type, receive_id) -> _KeyState，按最近使用排序
+        # (receive_id_type, receive_id) -> _KeyState, least recently used first
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.allowed = 0
+        self.suppressed = 0
+        self.cards_sent = 0
+        self.cards_updated = 0
+        self.evicted = 0
+        self._thread = threading.Thread(target=self._run, name="storm-control", daemon=True)
+        self._thread.start()
+
+    def allow(self, receive_id_type, receive_id, count=1):
+        # 返回 True 时由调用方发送告警卡片；返回 False 时告警已计入汇总卡片。count 是这次合并的告警数。
+        # True means the caller sends the alarm card, False means the alarm went to the aggregated card.
+        # count is the number of alarms merged into this one.
+        now = time.monotonic()
+        key = (receive_id_type, receive_id)
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState(self.burst, now, self._slots)
+                if len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._keys.move_to_end(key)
+            state.tokens = min(self.burst, state.tokens + (now - state.last) * self.rate)
+            state.last = now
+            state.count(self._slot(now), count)
+            if state.tokens >= 1:
+                state.tokens -= 1
+                self.allowed += 1
+                return True
+            state.suppressed += count
+            state.dirty = True
+            self.suppressed += count
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "storms": sum(1 for state in self._keys.values() if state.message_id is not None or state.dirty),
+                "allowed": self.allowed,
+                "suppressed": self.suppressed,
+                "cards_sent": self.cards_sent,
+                "cards_updated": self.cards_updated,
+                "evicted": self.evicted,
+            }
+
+    def close(self):
+        # 停止后台线程，最后更新一次汇总卡片
+        # stop the background thread and update the aggregated cards one last time
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def render(self, alarms, suppressed):
+        # 汇总卡片，需要 update_multi 才能更新
+        # the aggregated card, update_multi is required to update it
+        minutes = self.window // 60
+        return codec.dumps(
+            {
+                "config": {"update_multi": True},
+                "header": {
+                    "template": "red",
+                    "title": {"tag": "plain_text", "content": "告警风暴 Alarm storm"},
+                },
+                "elements": [
+                    {
+                        "tag": "markdown",
+                        "content": f"最近 {minutes} 分钟共 **{alarms}** 条告警，其中 {suppressed} 条合并到本卡片\n"
+                        f"**{alarms}** alarms in the last {minutes} min, {suppressed} of them merged into this card",
+                    },
+                    {"tag": "note", "elements": [{"tag": "plain_text", "content": _clock.now()}]},
+                ],
+            }
+        )
+
+    def _slot(self, now):
+        return int(now // self.update_interval)
+
+    def _run(self):
+        while not self._stopped.wait(self.update_interval):
+            self.flush()
+
+    def flush(self):
+        # 更新有新告警的汇总卡片，并移除空闲的接收者
+        # update the aggregated cards with new alarms and drop idle recipients
+        now = time.monotonic()
+        slot = self._slot(now)
+        updates = []
+        with self._lock:
+            for key, state in list(self._keys.items()):
+                alarms = state.total(slot)
+                if state.dirty:
+                    state.dirty = False
+                    # 上一张汇总卡片超过 window 秒没有更新时，发送一张新卡片
+                    # a new aggregated card once the previous one wasn't updated for window seconds
+                    if state.message_id is not None and now - state.updated > self.window:
+                        state.message_id = None
+                        state.suppressed_total = 0
+                    state.suppressed_total += state.suppressed
+                    state.suppressed = 0
+                    state.updated = now
+                    updates.append((key, state, alarms, state.suppressed_total))
+                elif alarms == 0 and state.tokens + (now - state.last) * self.rate >= self.burst:
+                    # 令牌桶已满，窗口内没有告警：与从未出现过的接收者相同
+                    # a full bucket and no alarms in the window: same as a recipient never seen
+                    del self._keys[key]
+        for (receive_id_type, receive_id), state, alarms, suppressed in updates:
+            content = self.render(alarms, suppressed)
+            try:
+                if state.message_id is None:
+                    state.message_id = self.send_card(receive_id_type, receive_id, content)
+                    self.cards_sent += 1
+                else:
+                    self.update_card(state.message_id, content)
+                    self.cards_updated += 1
+            except Exception as e:
+                logging.exception(f"update aggregated alarm card of {receive_id} failed: {e}")
+                # 下次再试
+                # try again next time
+                with self._lock:
+                    state.dirty = True
+
+
+class _KeyState(object):
+    __slots__ = ("tokens", "last", "counts", "slot", "suppressed", "suppressed_total", "dirty", "message_id", "updated")
+
+    def __init__(self, tokens, now, slots):
+        self.tokens = tokens
+        self.last = now
+        # 环形计数：counts[i] 是第 slot - i 个时间槽的告警数
+        # ring of counts: counts[i] holds the alarms of time slot `slot - i`
+        self.counts = [0] * slots
+        self.slot = 0
+        # 上次更新汇总卡片之后被合并的告警数，以及当前汇总卡片合并的总数
+        # alarms merged since the aggregated card was last updated, and in total on the current card
+        self.suppressed = 0
+        self.suppressed_total = 0
+        self.dirty = False
+        self.message_id = None
+        self.updated = 0.0
+
+    def _advance(self, slot):
+        shift = slot - self.slot
+        if shift > 0:
+            shift = min(shift, len(self.counts))
+            self.counts = [0] * shift + self.counts[:-shift]
+            self.slot = slot
+
+    def count(self, slot, n):
+        self._advance(slot)
+        self.counts[0] += n
+
+    def total(self, slot):
+        self._advance(slot)
+        return sum(self.counts)
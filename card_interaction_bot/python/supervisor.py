@@ -0,0 +1,232 @@
+import os
+import time
+import queue
+import signal
+import logging
+import argparse
+import importlib
+import threading
+import multiprocessing
+
+# 工作进程数，每个进程建立自己的长连接；开放平台把每个事件推送给其中一个连接。
+# Number of worker processes, each opens its own long connection; Lark pushes every event to one of them.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+# 汇总并打印统计信息的间隔（秒）
+# Seconds between aggregated stats reports.
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "30"))
+# 崩溃的进程在 1, 2, 4 ... 秒后重启，最多等待 RESTART_BACKOFF_MAX 秒；运行超过 STABLE_SECONDS 秒后重置
+# Crashed workers restart after 1, 2, 4 ... seconds, at most RESTART_BACKOFF_MAX; reset after STABLE_SECONDS of uptime.
+RESTART_BACKOFF_MAX = 60.0
+STABLE_SECONDS = 60.0
+
+
+class EventCounter(object):
+    # 工作进程内处理的事件数、失败数和耗时
+    # Events handled in a worker process, failures and time spent.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def wrap(self, do):
+        def counted(payload):
+            start = time.perf_counter()
+            try:
+                return do(payload)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.events += 1
+                    self.seconds += time.perf_counter() - start
+
+        return counted
+
+    def snapshot(self):
+        with self._lock:
+            return {"events": self.events, "failed": self.failed, "seconds": self.seconds}
+
+
+def run_worker(index, module_name, stats_queue, interval, workers):
+    # 工作进程入口：导入机器人模块（会创建自己的 client 和 wsClient），统计事件并定期上报，然后启动长连接。
+    # 模块可以通过 SUPERVISOR_WORKERS 把按进程计算的限额（例如告警风暴控制）分给各个进程。
+    # Worker entry point: import the bot module (which creates its own client and wsClient), count events,
+    # report them periodically and start the long connection. The module can use SUPERVISOR_WORKERS to split
+    # limits kept per process (e.g. alarm storm control) between the workers.
+    os.environ["SUPERVISOR_WORKERS"] = str(workers)
+    os.environ["SUPERVISOR_WORKER_INDEX"] = str(index)
+    module = importlib.import_module(module_name)
+    counter = EventCounter()
+    handler = module.event_handler
+    # 长连接通过 _do_without_validation 把事件交给 event_handler
+    # The long connection hands events to event_handler through _do_without_validation.
+    handler._do_without_validation = counter.wrap(handler._do_without_validation)
+    extra_stats = getattr(module, "stats", None)
+
+    def report():
+        while True:
+            time.sleep(interval)
+            stats = counter.snapshot()
+            if extra_stats is not None:
+                stats.update(extra_stats())
+            stats_queue.put((index, os.getpid(), time.time(), stats))
+
+    threading.Thread(target=report, name="stats-reporter", daemon=True).start()
+    module.main()
+
+
+class Worker(object):
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 1.0
+        self.restart_at = 0.0
+        self.reported_at = 0.0
+        self.stats = {}
+        # 进程重启前累计的事件数，重启后计数从零开始
+        # Events counted by earlier incarnations, counters start from zero after a restart.
+        self.previous = {"events": 0, "failed": 0}
+
+
+class Supervisor(object):
+    def __init__(self, module_name="main", workers=WORKER_PROCESSES, stats_interval=STATS_INTERVAL):
+        self.module_name = module_name
+        self.stats_interval = stats_interval
+        # spawn：每个工作进程重新导入模块，不继承父进程的事件循环和连接
+        # spawn: every worker imports the module afresh instead of inheriting the parent's event loop and sockets.
+        self._context = multiprocessing.get_context("spawn")
+        self._stats_queue = self._context.Queue()
+        self._workers = [Worker(i) for i in range(workers)]
+        self._stopping = False
+        self._last_report = (time.monotonic(), 0)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for worker in self._workers:
+            self._start(worker)
+        next_report = time.monotonic() + self.stats_interval
+        try:
+            while not self._stopping:
+                self._drain_stats(timeout=1.0)
+                self._check_workers()
+                if time.monotonic() >= next_report:
+                    logging.info(self.format_stats(self.stats()))
+                    next_report = time.monotonic() + self.stats_interval
+        finally:
+            self._terminate()
+
+    def stats(self):
+        # 汇总所有工作进程的统计：存活进程数、重启次数、事件总数和吞吐量
+        # Aggregate over all workers: live processes, restarts, total events and throughput.
+        now = time.monotonic()
+        events = sum(w.previous["events"] + w.stats.get("events", 0) for w in self._workers)
+        failed = sum(w.previous["failed"] + w.stats.get("failed", 0) for w in self._workers)
+        last_time, last_events = self._last_report
+        self._last_report = (now, events)
+        return {
+            "alive": sum(1 for w in self._workers if w.process is not None and w.process.is_alive()),
+            "workers": len(self._workers),
+            "restarts": sum(w.restarts for w in self._workers),
+            "events": events,
+            "failed": failed,
+            "events_per_second": (events - last_events) / (now - last_time) if now > last_time else 0.0,
+            "per_worker": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid if w.process is not None else None,
+                    "alive": w.process is not None and w.process.is_alive(),
+                    "restarts": w.restarts,
+                    "last_report_age": time.time() - w.reported_at if w.reported_at else None,
+                    **w.stats,
+                }
+                for w in self._workers
+            ],
+        }
+
+    @staticmethod
+    def format_stats(stats):
+        return (
+            f"workers {stats['alive']}/{stats['workers']} alive, restarts {stats['restarts']}, "
+            f"events {stats['events']} ({stats['events_per_second']:.1f}/s), failed {stats['failed']}"
+        )
+
+    def _start(self, worker):
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(worker.index, self.module_name, self._stats_queue, self.stats_interval, len(self._workers)),
+            name=f"bot-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = 0.0
+
+    def _check_workers(self):
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for worker in self._workers:
+            if worker.process.is_alive():
+                continue
+            if not worker.restart_at:
+                uptime = now - worker.started_at
+                if uptime >= STABLE_SECONDS:
+                    worker.backoff = 1.0
+                worker.restart_at = now + worker.backoff
+                logging.warning(
+                    f"worker {worker.index} (pid {worker.process.pid}) exited with {worker.process.exitcode} "
+                    f"after {uptime:.0f}s, restarting in {worker.backoff:.0f}s"
+                )
+                worker.backoff = min(worker.backoff * 2, RESTART_BACKOFF_MAX)
+                worker.previous["events"] += worker.stats.get("events", 0)
+                worker.previous["failed"] += worker.stats.get("failed", 0)
+                worker.stats = {}
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                self._start(worker)
+
+    def _drain_stats(self, timeout):
+        try:
+            item = self._stats_queue.get(timeout=timeout)
+            while True:
+                index, pid, reported_at, stats = item
+                worker = self._workers[index]
+                # 忽略已退出的旧进程晚到的上报
+                # ignore late reports from a previous incarnation of the worker
+                if worker.process is not None and worker.process.pid == pid:
+                    worker.stats = stats
+                    worker.reported_at = reported_at
+                item = self._stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _terminate(self):
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the bot in several processes, each with its own long connection")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES)
+    parser.add_argument("--module", default="main", help="bot module defining event_handler and main()")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    Supervisor(args.module, args.workers, args.stats_interval).run()
+
+
+if __name__ == "__main__":
+    main()
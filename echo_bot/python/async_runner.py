@@ -0,0 +1,196 @@
+import types
+import itertools
+import asyncio
+import logging
+import threading
+import httpx
+from importlib import metadata
+from lark_oapi.core.http import transport as lark_transport
+
+# share_sdk_async_client 检查过的 SDK 版本，与 requirements.txt 一致
+# the SDK version share_sdk_async_client was checked against, as pinned in requirements.txt
+SHARED_CLIENT_SDK_VERSION = "1.7.4"
+
+
+# 在共享事件循环上运行协程事件处理函数：同一个 key（例如 chat_id）的事件按顺序处理，
+# 最多 max_in_flight 个协程同时在等待 OpenAPI，最多 max_pending 个事件在排队。
+# Runs coroutine event handlers on a shared event loop. Events with the same key (e.g. chat_id) are handled
+# in order, at most max_in_flight coroutines wait on OpenAPI at a time and at most max_pending events queue up.
+class AsyncRunner(object):
+    def __init__(self, max_in_flight=100, max_pending=10000):
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        # 在事件循环中懒创建
+        # created lazily inside the event loop
+        self._semaphore = None
+        # key -> 该 key 最后提交的任务，新任务等它完成后再执行；任务结束后如果仍是最后一个则删除
+        # key -> last task submitted for the key, a new task waits for it; removed when done if still the last
+        self._tails = {}
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.pending = 0
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.overflowed = 0
+        self.max_in_flight_seen = 0
+
+    def wrap(self, handler, key):
+        # 返回同步函数，注册到 EventDispatcherHandler；它只把协程交给事件循环，立即返回。
+        # 所有协程都在同一个事件循环中执行：第一次调用发生在运行中的事件循环（长连接的）里时使用该循环，
+        # 否则使用一个后台线程中的事件循环；之后从其它线程（例如 Coalescer 的合并线程）提交的也交给这个循环。
+        # Returns a plain function to register on EventDispatcherHandler, it hands the coroutine to the event
+        # loop and returns at once. Every coroutine runs on one loop: the running loop (the long connection's) if the
+        # first call comes from one, otherwise a loop in a background thread. Later calls from other threads (e.g. the
+        # Coalescer's) are handed to that same loop, so a key's tasks never span two loops.
+        def submit_handler(data):
+            event_key = key(data)
+            if self.pending >= self.max_pending:
+                # 返回失败，由开放平台稍后重新推送
+                # fail the event, Lark pushes it again later
+                self.overflowed += 1
+                raise Exception(f"too many pending events, event of {event_key} dropped")
+            loop = self._event_loop()
+            if loop is _running_loop():
+                self._submit(loop, event_key, handler, data)
+            else:
+                loop.call_soon_threadsafe(self._submit, loop, event_key, handler, data)
+
+        return submit_handler
+
+    def stats(self):
+        return {
+            "keys": len(self._tails),
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_in_flight_seen": self.max_in_flight_seen,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+        }
+
+    async def join(self):
+        # 等待已提交的事件处理完
+        # wait until the submitted events are handled
+        while self._tails:
+            await asyncio.gather(*self._tails.values(), return_exceptions=True)
+
+    def drain(self, timeout=None):
+        # 在其它线程中等待事件循环上已提交的事件处理完
+        # wait from another thread until the events submitted to the loop are handled
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.join(), self._loop).result(timeout)
+
+    def _submit(self, loop, key, handler, data):
+        self.pending += 1
+        self.submitted += 1
+        previous = self._tails.get(key)
+        task = loop.create_task(self._run(key, handler, data, previous))
+        self._tails[key] = task
+
+    async def _run(self, key, handler, data, previous):
+        try:
+            if previous is not None:
+                # 只等待完成，前一个事件失败不影响本事件
+                # wait for completion only, a failed previous event doesn't fail this one
+                await asyncio.wait([previous])
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            async with self._semaphore:
+                self.pending -= 1
+                self.in_flight += 1
+                self.max_in_flight_seen = max(self.max_in_flight_seen, self.in_flight)
+                try:
+                    await handler(data)
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logging.exception(f"handle event of {key} failed: {e}")
+                finally:
+                    self.in_flight -= 1
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    def _event_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = _running_loop()
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-runner", daemon=True).start()
+            return self._loop
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# SDK 的异步请求（acreate、areply 等）每次都新建 httpx.AsyncClient，创建时加载证书约需几十毫秒 CPU，
+# 并且每个请求都要重新建立连接。这里让它们轮流使用几个带连接池的 client。每个 client 最多
+# connections_per_client 个连接：httpcore 分配连接的开销随连接池大小成倍增长，小连接池更快。
+# The SDK's async requests (acreate, areply ...) create a new httpx.AsyncClient per call, which spends tens of
+# milliseconds of CPU loading certificates and opens a new connection for every request. This makes them take
+# turns on a few pooled clients instead. Each client holds at most connections_per_client connections: the cost of
+# assigning a connection in httpcore grows much faster than the pool size, so small pools are faster.
+#
+# SDK 没有传入 client 的接口，只能替换 lark_oapi.core.http.transport 模块中的 httpx，影响整个进程，所以需要主动开启
+# （main.py 的 SHARE_SDK_CLIENT）。只在安装的 SDK 正是检查过的 SHARED_CLIENT_SDK_VERSION 时替换，否则保持 SDK 的默认行为，
+# 返回 None。
+# The SDK has no way to pass a client in, so the httpx module seen by lark_oapi.core.http.transport is replaced for
+# the whole process, which is why this is opt-in (SHARE_SDK_CLIENT in main.py). It is only replaced when the installed
+# SDK is exactly SHARED_CLIENT_SDK_VERSION, the version this was checked against; otherwise the SDK's default is
+# kept and None is returned.
+def share_sdk_async_client(max_connections=100, connections_per_client=10):
+    try:
+        version = metadata.version("lark-oapi")
+    except metadata.PackageNotFoundError:
+        version = None
+    if version != SHARED_CLIENT_SDK_VERSION or not hasattr(lark_transport, "httpx"):
+        logging.warning(
+            f"lark-oapi {version} is not {SHARED_CLIENT_SDK_VERSION}, keeping its default httpx.AsyncClient per request"
+        )
+        return None
+    connections_per_client = min(connections_per_client, max_connections)
+    clients = [
+        httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=connections_per_client, max_keepalive_connections=connections_per_client)
+        )
+        for _ in range(-(-max_connections // connections_per_client))
+    ]
+    lark_transport.httpx = _SharedHttpx(itertools.cycle(clients).__next__)
+    return clients
+
+
+class _SharedHttpx(object):
+    # 代替 httpx 模块：无参数的 AsyncClient() 返回共享的 client，其它属性来自 httpx
+    # stands in for the httpx module: AsyncClient() without arguments returns a shared client, the rest is httpx's
+    def __init__(self, next_client):
+        self._next_client = next_client
+
+    def AsyncClient(self, *args, **kwargs):
+        if args or kwargs:
+            return httpx.AsyncClient(*args, **kwargs)
+        return _SharedClient(self._next_client())
+
+    def __getattr__(self, name):
+        return getattr(httpx, name)
+
+
+class _SharedClient(object):
+    # async with 结束时不关闭共享的 client
+    # leaves the shared client open at the end of the async with block
+    def __init__(self, client):
+        self._client = client
+
+    async def __aenter__(self):
+        return self._client
+
+    async def __aexit__(self, *exc):
+        return False
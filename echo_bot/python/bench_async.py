@@ -0,0 +1,119 @@
+# 回复吞吐量基准：阻塞处理、按会话的线程池（默认模式）和异步模式（ASYNC_MODE=true），
+# OpenAPI 由本地模拟服务 fake_open_api.py 提供，每个请求增加 --latency 秒延迟。
+# Reply throughput benchmark: blocking handling, the per-chat thread pool (default mode) and async mode
+# (ASYNC_MODE=true), against the local stand-in fake_open_api.py with --latency seconds added to every call.
+# usage: APP_ID=cli_bench APP_SECRET=secret python3 bench_async.py --messages 500 --chats 100 --latency 0.2
+import os
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("APP_ID", "cli_bench")
+os.environ.setdefault("APP_SECRET", "secret")
+
+import lark_oapi as lark
+from lark_oapi.api.im.v1 import P2ImMessageReceiveV1
+import codec
+import main
+from fake_open_api import FakeOpenApiServer
+from keyed_executor import KeyedExecutor
+from async_runner import AsyncRunner, share_sdk_async_client
+
+
+def make_events(messages, chats):
+    events = []
+    for i in range(messages):
+        chat_type = "p2p" if i % 2 else "group"
+        payload = {
+            "schema": "2.0",
+            "header": {"event_id": f"ev_{i}", "event_type": "im.message.receive_v1"},
+            "event": {
+                "sender": {"sender_id": {"open_id": f"ou_{i % chats}"}, "sender_type": "user"},
+                "message": {
+                    "message_id": f"om_{i}",
+                    "chat_id": f"oc_{i % chats}",
+                    "chat_type": chat_type,
+                    "message_type": "text",
+                    "content": codec.dumps({"text": f"hello {i}"}),
+                },
+            },
+        }
+        events.append(lark.JSON.unmarshal(codec.dumps(payload), P2ImMessageReceiveV1))
+    return events
+
+
+def chat_key(data):
+    return data.event.message.chat_id
+
+
+def run_blocking(events):
+    # 长连接回调中直接调用阻塞的处理函数
+    # the blocking handler called straight from the long connection callback
+    for data in events:
+        main.do_p2_im_message_receive_v1(data)
+
+
+def run_keyed(events, workers):
+    executor = KeyedExecutor(workers, len(events))
+    handler = executor.wrap(main.do_p2_im_message_receive_v1, key=chat_key)
+    for data in events:
+        handler(data)
+    executor.shutdown()
+
+
+def run_async(events, max_in_flight):
+    runner = AsyncRunner(max_in_flight)
+    handler = runner.wrap(main.ado_p2_im_message_receive_v1, key=chat_key)
+
+    async def receive():
+        share_sdk_async_client(max_in_flight)
+        # 和长连接一样，在事件循环中调用同步的回调
+        # like the long connection, the plain callback is called inside the event loop
+        for data in events:
+            handler(data)
+        await runner.join()
+
+    asyncio.run(receive())
+    return runner.stats()
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every OpenAPI call")
+    parser.add_argument("--workers", type=int, default=main.WORKERS)
+    parser.add_argument("--max-in-flight", type=int, default=main.MAX_IN_FLIGHT)
+    parser.add_argument("--blocking-messages", type=int, default=25, help="the blocking path is slow, send fewer")
+    args = parser.parse_args()
+
+    with FakeOpenApiServer(latency=args.latency) as fake:
+        main.client = (
+            lark.Client.builder()
+            .app_id(os.environ["APP_ID"])
+            .app_secret(os.environ["APP_SECRET"])
+            .domain(fake.url)
+            .log_level(lark.LogLevel.ERROR)
+            .build()
+        )
+        # 先获取 tenant_access_token
+        # fetch the tenant_access_token first
+        run_blocking(make_events(1, 1))
+
+        runs = (
+            ("blocking", args.blocking_messages, lambda events: run_blocking(events)),
+            (f"keyed x{args.workers}", args.messages, lambda events: run_keyed(events, args.workers)),
+            (f"async x{args.max_in_flight}", args.messages, lambda events: run_async(events, args.max_in_flight)),
+        )
+        for name, messages, run in runs:
+            events = make_events(messages, args.chats)
+            before = fake.counters.get("message", 0)
+            start = time.perf_counter()
+            run(events)
+            elapsed = time.perf_counter() - start
+            sent = fake.counters.get("message", 0) - before
+            print(f"{name:<12} {messages:>5} messages {elapsed:>7.2f}s {sent / elapsed:>8.1f} replies/s")
+
+
+if __name__ == "__main__":
+    main_()
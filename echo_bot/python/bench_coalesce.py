@@ -0,0 +1,114 @@
+# 群聊突发消息的回复基准：逐条回复和合并回复（Coalescer）。OpenAPI 由本地模拟服务 fake_open_api.py 提供，
+# 每秒超过 --message-qps 个发送消息请求时返回 429，与开放平台的频率限制相同。
+# Benchmark of replies to a burst of group messages: one reply per message and merged replies (Coalescer),
+# against the local stand-in fake_open_api.py, which answers 429 above --message-qps message requests per second
+# like the open platform's rate limit.
+# usage: APP_ID=cli_bench APP_SECRET=secret python3 bench_coalesce.py --chats 10 --burst 50 --message-qps 50
+import os
+import time
+import argparse
+
+os.environ.setdefault("APP_ID", "cli_bench")
+os.environ.setdefault("APP_SECRET", "secret")
+
+import lark_oapi as lark
+from lark_oapi.api.im.v1 import P2ImMessageReceiveV1
+import codec
+import main
+from fake_open_api import FakeOpenApiServer
+from keyed_executor import KeyedExecutor
+from coalescer import Coalescer
+
+
+def make_burst(chats, burst):
+    events = []
+    for i in range(burst):
+        for chat in range(chats):
+            payload = {
+                "schema": "2.0",
+                "header": {"event_id": f"ev_{chat}_{i}", "event_type": "im.message.receive_v1"},
+                "event": {
+                    "sender": {"sender_id": {"open_id": f"ou_{i}"}, "sender_type": "user"},
+                    "message": {
+                        "message_id": f"om_{chat}_{i}",
+                        "chat_id": f"oc_{chat}",
+                        "chat_type": "group",
+                        "message_type": "text",
+                        "content": codec.dumps({"text": f"message {i}"}),
+                    },
+                },
+            }
+            events.append(lark.JSON.unmarshal(codec.dumps(payload), P2ImMessageReceiveV1))
+    return events
+
+
+def chat_key(data):
+    return data.event.message.chat_id
+
+
+def run(events, workers, coalescer_args):
+    executor = KeyedExecutor(workers, len(events))
+    handler = executor.wrap(main.do_p2_im_message_receive_v1, key=chat_key)
+    coalescer = None
+    if coalescer_args is not None:
+        batch_handler = executor.wrap(main.reply_batch, key=lambda batch: chat_key(batch[-1]))
+        coalescer = Coalescer(lambda chat_id, batch: batch_handler(batch), *coalescer_args)
+        handler = lambda data: coalescer.add(chat_key(data), data)
+    for data in events:
+        handler(data)
+    saved_calls = 0
+    if coalescer is not None:
+        # 等最后一批到期，close() 等待正在交给线程池的一批
+        # wait for the last batches to fall due, close() waits for a batch being handed to the executor
+        while coalescer.stats()["pending"]:
+            time.sleep(0.01)
+        coalescer.close()
+        saved_calls = coalescer.stats()["saved_calls"]
+    executor.shutdown()
+    return {**executor.stats(), "saved_calls": saved_calls}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--burst", type=int, default=50, help="messages per chat, sent at once")
+    parser.add_argument("--message-qps", type=int, default=50, help="rate limit of the stand-in's message api")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every OpenAPI call")
+    parser.add_argument("--workers", type=int, default=main.WORKERS)
+    parser.add_argument("--window", type=float, default=0.2)
+    parser.add_argument("--max-delay", type=float, default=main.COALESCE_MAX_DELAY)
+    parser.add_argument("--max-batch", type=int, default=main.COALESCE_MAX_BATCH)
+    args = parser.parse_args()
+
+    with FakeOpenApiServer(latency=args.latency, message_qps=args.message_qps) as fake:
+        main.client = (
+            lark.Client.builder()
+            .app_id(os.environ["APP_ID"])
+            .app_secret(os.environ["APP_SECRET"])
+            .domain(fake.url)
+            .log_level(lark.LogLevel.ERROR)
+            .build()
+        )
+        runs = (
+            ("per message", None),
+            ("coalesced", (args.window, args.max_delay, args.max_batch)),
+        )
+        for name, coalescer_args in runs:
+            # 每轮从新的一秒开始计算频率限制
+            # every run starts the rate limit in a fresh second
+            time.sleep(1)
+            events = make_burst(args.chats, args.burst)
+            before = dict(fake.counters)
+            start = time.perf_counter()
+            stats = run(events, args.workers, coalescer_args)
+            elapsed = time.perf_counter() - start
+            calls = fake.counters.get("message", 0) - before.get("message", 0)
+            limited = fake.counters.get("rate_limited", 0) - before.get("rate_limited", 0)
+            print(
+                f"{name:<12} {len(events):>5} messages {elapsed:>6.2f}s  calls {calls:>5}  rate limited {limited:>5}  "
+                f"failed {stats['failed']:>5}  saved calls {stats['saved_calls']:>5}"
+            )
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,88 @@
+# 图片和文件转发的内存基准：SDK 的 message_resource.get 把整个文件读入内存后再上传（buffered），
+# ResourceStreamer 分块下载到内存或临时文件后上传（streamed）。OpenAPI 由本地模拟服务 fake_open_api.py 提供。
+# 峰值内存是 tracemalloc 统计的 Python 分配的峰值，mmap 映射的临时文件属于页缓存，不计算在内。
+# Memory benchmark of passing images and files through: the SDK's message_resource.get reads the whole file into
+# memory before uploading it (buffered), ResourceStreamer downloads it in chunks into memory or a temporary file and
+# uploads from there (streamed). OpenAPI is served by the local stand-in fake_open_api.py. Peak memory is the peak
+# of Python allocations seen by tracemalloc, the temporary file mapped through mmap is page cache and not counted.
+# usage: APP_ID=cli_bench APP_SECRET=secret python3 bench_resource.py --sizes 262144 4194304 26214400 --transfers 8
+import os
+import time
+import argparse
+import tracemalloc
+import threading
+
+os.environ.setdefault("APP_ID", "cli_bench")
+os.environ.setdefault("APP_SECRET", "secret")
+
+import lark_oapi as lark
+from lark_oapi.api.im.v1 import *
+from fake_open_api import FakeOpenApiServer
+from resource_stream import ResourceStreamer, _check_response
+
+
+def buffered(client, message_id, file_key):
+    request = GetMessageResourceRequest.builder().message_id(message_id).file_key(file_key).type("file").build()
+    response = client.im.v1.message_resource.get(request)
+    _check_response("client.im.v1.message_resource.get", response)
+    body = CreateFileRequestBody.builder().file_type("stream").file_name("bench.bin").file(response.file).build()
+    response = client.im.v1.file.create(CreateFileRequest.builder().request_body(body).build())
+    _check_response("client.im.v1.file.create", response)
+
+
+def run(transfers, fn):
+    threads = [threading.Thread(target=fn, args=(f"om_bench_{i}", f"file_bench_{i}")) for i in range(transfers)]
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, tracemalloc.get_traced_memory()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256 * 1024, 4 * 1024 * 1024, 25 * 1024 * 1024])
+    parser.add_argument("--transfers", type=int, default=8, help="resources passed through at once")
+    parser.add_argument("--max-transfers", type=int, default=4, help="ResourceStreamer's cap on concurrent transfers")
+    parser.add_argument("--spool-max-memory", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    with FakeOpenApiServer() as fake:
+        client = (
+            lark.Client.builder()
+            .app_id(os.environ["APP_ID"])
+            .app_secret(os.environ["APP_SECRET"])
+            .domain(fake.url)
+            .log_level(lark.LogLevel.ERROR)
+            .build()
+        )
+        streamer = ResourceStreamer(
+            os.environ["APP_ID"], os.environ["APP_SECRET"], fake.url, args.max_transfers, args.spool_max_memory
+        )
+        runs = (
+            ("buffered", lambda message_id, file_key: buffered(client, message_id, file_key)),
+            ("streamed", lambda message_id, file_key: streamer.pass_through(client, message_id, file_key, "file")),
+        )
+        # 先获取 tenant_access_token
+        # fetch the tenant_access_token first
+        fake.resource_size = 1
+        streamer.pass_through(client, "om_bench", "file_bench", "file")
+        tracemalloc.start()
+        for size in args.sizes:
+            fake.resource_size = size
+            for name, fn in runs:
+                elapsed, peak = run(args.transfers, fn)
+                print(
+                    f"{name:<9} {args.transfers} x {size / 2 ** 20:>6.2f}MB {elapsed:>7.2f}s "
+                    f"{args.transfers * size / 2 ** 20 / elapsed:>8.1f}MB/s  peak {peak / 2 ** 20:>7.2f}MB"
+                )
+        tracemalloc.stop()
+        streamer.close()
+        print(f"open api requests: {fake.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import heapq
+import logging
+import threading
+import time
+import itertools
+
+
+# 按 key（例如 chat_id）合并短时间内连续到达的事件：一个 key 在 window 秒内没有新事件、
+# 或距离第一个事件已过 max_delay 秒、或已经攒够 max_batch 个事件时，把这一批交给 on_batch(key, items)。
+# on_batch 在合并线程中调用，应该尽快返回，例如把这一批提交到线程池。on_batch 抛出异常时（例如队列已满）
+# 这一批放回去，retry_delay 秒后（每次加倍）由合并线程重试，期间到达的事件排在它后面；重试 retries 次仍然失败的批次被丢弃并计数。
+# Merges events with the same key (e.g. chat_id) that arrive in quick succession. A key's batch is handed to
+# on_batch(key, items) once no new event arrived for window seconds, max_delay seconds after its first event, or as
+# soon as it holds max_batch events. on_batch is called on the coalescer's thread and should return quickly, e.g.
+# by submitting the batch to a thread pool. When on_batch raises (e.g. a full queue) the batch is put back and the
+# coalescer's thread retries it retry_delay seconds later, doubling each time; events arriving meanwhile queue up
+# behind it. A batch still failing after retries retries is dropped and counted.
+class Coalescer(object):
+    def __init__(
+        self, on_batch, window=0.5, max_delay=2.0, max_batch=20, name="coalescer", retries=3, retry_delay=0.05
+    ):
+        self.on_batch = on_batch
+        self.window = window
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # key -> 正在攒的一批，只有有待发送事件的 key 会出现在这里
+        # key -> batch being collected, only keys with pending events are kept
+        self._batches = {}
+        # (到期时间, 序号, batch)，每个 batch 最多一项；batch 到期时间推后时重新放入
+        # (deadline, sequence, batch), at most one entry per batch; pushed again when its deadline moves later
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        # 取出一批并交给 on_batch 的过程持有该锁，同一个 key 的批次按顺序交付
+        # held from taking a batch out to handing it to on_batch, so a key's batches are delivered in order
+        self._deliver = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self.received = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+        self.retried = 0
+        self.dropped_batches = 0
+        self.dropped_items = 0
+        # 触发发送的原因 -> 次数
+        # reason a batch was sent -> count
+        self.flushed_by = {"deadline": 0, "max_batch": 0, "forced": 0, "retry": 0}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, key, item):
+        with self._deliver:
+            now = time.monotonic()
+            with self._lock:
+                self.received += 1
+                batch = self._batches.get(key)
+                if batch is None:
+                    batch = self._batches[key] = _Batch(key, now)
+                    batch.deadline = now + min(self.window, self.max_delay)
+                    heapq.heappush(self._heap, (batch.deadline, next(self._sequence), batch))
+                    self._wakeup.notify()
+                elif not batch.attempts:
+                    # 推后到期时间即可，_run 取出旧的一项时会按新的到期时间重新放入；等待重试的批次不改变到期时间
+                    # moving the deadline is enough, _run pushes the entry again when it pops the old one; a batch
+                    # waiting for its retry keeps its deadline
+                    batch.deadline = min(now + self.window, batch.first + self.max_delay)
+                batch.items.append(item)
+                if len(batch.items) < self.max_batch or batch.attempts:
+                    return
+                del self._batches[key]
+                self.flushed_by["max_batch"] += 1
+                self._count(batch)
+            self._flush(batch)
+
+    def flush(self, key):
+        # 立即发送 key 正在攒的一批，例如在处理不能合并的事件之前，保证同一个 key 的事件按顺序处理（on_batch 失败、
+        # 这一批放回重试时除外）
+        # send key's pending batch now, e.g. before an event that can't be merged so a key's events stay in order
+        # (unless on_batch fails and the batch is put back for a retry)
+        with self._deliver:
+            with self._lock:
+                batch = self._batches.pop(key, None)
+                if batch is None:
+                    return
+                self.flushed_by["forced"] += 1
+                self._count(batch)
+            self._flush(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._batches),
+                "pending": sum(len(batch.items) for batch in self._batches.values()),
+                "received": self.received,
+                "batches": self.batches,
+                # 合并节省的调用数：每一批只需一次调用
+                # calls saved by merging: every batch takes a single call
+                "saved_calls": self.received - self.batches - sum(len(b.items) for b in self._batches.values()),
+                "max_batch_seen": self.max_batch_seen,
+                "retried": self.retried,
+                "dropped_batches": self.dropped_batches,
+                "dropped_items": self.dropped_items,
+                "flushed_by": dict(self.flushed_by),
+            }
+
+    def close(self):
+        # 发送所有正在攒的批次并停止合并线程
+        # send every pending batch and stop the coalescer's thread
+        with self._deliver:
+            with self._lock:
+                self._closed = True
+                batches = list(self._batches.values())
+                self._batches.clear()
+                for batch in batches:
+                    self.flushed_by["forced"] += 1
+                    self._count(batch)
+                self._wakeup.notify()
+            for batch in batches:
+                self._flush(batch)
+        self._thread.join()
+
+    def _count(self, batch):
+        self.batches += 1
+        self.max_batch_seen = max(self.max_batch_seen, len(batch.items))
+
+    def _flush(self, batch):
+        try:
+            self.on_batch(batch.key, batch.items)
+            return
+        except Exception as e:
+            error = e
+        with self._lock:
+            batch.attempts += 1
+            if batch.attempts <= self.retries and not self._closed:
+                self.retried += 1
+                self._retry_later(batch)
+                return
+            self.dropped_batches += 1
+            self.dropped_items += len(batch.items)
+        logging.error(
+            f"batch of {batch.key} dropped after {batch.attempts} attempts, {len(batch.items)} items: {error}"
+        )
+
+    def _retry_later(self, batch):
+        # 放回失败的批次；这期间该 key 已有新的一批时，失败的事件排在新事件前面一起重试
+        # put a failed batch back; when the key has a new batch by now, the failed events go in front of its events
+        self.batches -= 1
+        deadline = time.monotonic() + self.retry_delay * 2 ** (batch.attempts - 1)
+        pending = self._batches.get(batch.key)
+        if pending is not None:
+            pending.items[:0] = batch.items
+            pending.attempts = batch.attempts
+            # 旧的一项出堆时按新的到期时间重新放入
+            # the old entry is pushed again with the new deadline when it is popped
+            pending.deadline = max(pending.deadline, deadline)
+            return
+        batch.deadline = deadline
+        self._batches[batch.key] = batch
+        heapq.heappush(self._heap, (deadline, next(self._sequence), batch))
+        self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._wakeup.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._closed:
+                    return
+            with self._deliver:
+                with self._lock:
+                    batch = self._pop_due(time.monotonic())
+                if batch is not None:
+                    self._flush(batch)
+
+    def _pop_due(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            _, _, batch = heapq.heappop(self._heap)
+            if self._batches.get(batch.key) is not batch:
+                # 已经因为 max_batch 或 flush() 发送过了
+                # already sent because of max_batch or flush()
+                continue
+            if batch.deadline > now:
+                heapq.heappush(self._heap, (batch.deadline, next(self._sequence), batch))
+                continue
+            del self._batches[batch.key]
+            self.flushed_by["retry" if batch.attempts else "deadline"] += 1
+            self._count(batch)
+            return batch
+        return None
+
+
+class _Batch(object):
+    __slots__ = ("key", "first", "deadline", "items", "attempts")
+
+    def __init__(self, key, first):
+        self.key = key
+        self.first = first
+        self.deadline = first
+        self.items = []
+        # 交付失败的次数
+        # failed deliveries
+        self.attempts = 0
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3.8
+# json codec used on the hot paths. orjson is used when it is installed (pip install orjson),
+# the standard library otherwise. loads accepts str, bytes, bytearray and memoryview, so request
+# bodies and decrypted payloads are parsed without decoding them to str first.
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+else:
+    BACKEND = "json"
+
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = str(data, "utf-8")
+        return json.loads(data)
+
+    def dumps(obj):
+        # compact and utf-8, same output as orjson
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode("utf-8")
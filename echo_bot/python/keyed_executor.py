@@ -0,0 +1,130 @@
+import logging
+import threading
+from collections import deque
+
+
+# 按 key 串行、跨 key 并行的线程池：同一个 key（例如 chat_id）的任务按提交顺序逐个执行，
+# 不同 key 的任务在 N 个 worker 上并行执行，每个 key 的等待队列有上限。
+# Thread pool that runs tasks with the same key (e.g. chat_id) one at a time in submission order,
+# and tasks with different keys in parallel on N workers. Each key's queue is bounded.
+class KeyedExecutor(object):
+    def __init__(self, workers=8, max_queue_per_key=100, name="keyed-worker"):
+        self.max_queue_per_key = max_queue_per_key
+        # key -> 等待执行的任务，只有有任务的 key 会出现在这里，空闲的 key 不占内存
+        # key -> pending tasks, only keys with work are kept so idle keys take no memory
+        self._queues = {}
+        # 可以执行的 key，每个 key 同一时刻最多出现一次，保证同一个 key 只有一个 worker 在执行
+        # keys ready to run, a key is in here at most once so only one worker runs it at a time
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._stopping = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.overflowed = 0
+        # key -> 因队列已满被拒绝的任务数
+        # key -> tasks rejected because the key's queue was full
+        self.overflowed_by_key = {}
+        self.max_depth = 0
+        self._threads = [
+            threading.Thread(target=self._run, name="{}-{}".format(name, i), daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, fn, *args, **kwargs):
+        # 返回 False 表示该 key 的队列已满或线程池正在关闭，任务没有被接收
+        # returns False when the key's queue is full or the executor is shutting down
+        with self._lock:
+            if self._stopping:
+                return False
+            tasks = self._queues.get(key)
+            if tasks is None:
+                tasks = self._queues[key] = deque()
+                self._ready.append(key)
+                self._not_empty.notify()
+            elif len(tasks) >= self.max_queue_per_key:
+                self.overflowed += 1
+                self.overflowed_by_key[key] = self.overflowed_by_key.get(key, 0) + 1
+                return False
+            tasks.append((fn, args, kwargs))
+            self.submitted += 1
+            if len(tasks) > self.max_depth:
+                self.max_depth = len(tasks)
+            return True
+
+    def wrap(self, handler, key):
+        # 把事件处理函数包装成提交到线程池的函数，key(data) 返回事件的 key，处理函数本身不需要修改。
+        # 队列已满时抛出异常，长连接会返回失败，由开放平台稍后重新推送该事件。
+        # Wrap an event handler so that it runs on this executor, key(data) returns the event's key.
+        # The handler itself is unchanged. When the queue is full an exception is raised, the long
+        # connection then answers with an error and the event is pushed again later.
+        def submit_handler(data):
+            event_key = key(data)
+            if not self.submit(event_key, handler, data):
+                raise Exception(f"queue of {event_key} is full, event dropped")
+
+        return submit_handler
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._queues),
+                "pending": sum(len(tasks) for tasks in self._queues.values()),
+                "max_depth": self.max_depth,
+                "max_queue_per_key": self.max_queue_per_key,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "overflowed": self.overflowed,
+            }
+
+    def drain(self, timeout=None):
+        # 等待已提交的任务执行完，线程池继续接收任务；返回 False 表示超时
+        # wait until the submitted tasks are done, the executor keeps accepting tasks; False on timeout
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def shutdown(self, wait=True):
+        # 不再接收新任务，已提交的任务执行完后 worker 退出
+        # stop accepting tasks, workers exit once the submitted tasks are done
+        with self._lock:
+            self._stopping = True
+            self._not_empty.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    if self._stopping:
+                        return
+                    self._not_empty.wait()
+                key = self._ready.popleft()
+                fn, args, kwargs = self._queues[key].popleft()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logging.exception(f"task of {key} failed: {e}")
+                failed = True
+            else:
+                failed = False
+            with self._lock:
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                if self._queues[key]:
+                    # 放回队尾，其它 key 不会被一个繁忙的 key 饿死
+                    # back of the line, so one busy key can't starve the others
+                    self._ready.append(key)
+                    self._not_empty.notify()
+                else:
+                    del self._queues[key]
+                    if not self._queues:
+                        self._idle.notify_all()
@@ -1,19 +1,63 @@
+import os
+import atexit
+import asyncio
 import lark_oapi as lark
 from lark_oapi.api.im.v1 import *
-import json
+import codec
+from keyed_executor import KeyedExecutor
+from async_runner import AsyncRunner, share_sdk_async_client
+from resource_stream import ResourceStreamer
+from coalescer import Coalescer
+from replay import EventRecorder
 
+# 处理消息的线程数，以及每个会话最多排队的消息数
+# Number of threads handling messages, and the maximum number of queued messages per chat.
+WORKERS = int(os.getenv("WORKERS", "8"))
+MAX_QUEUE_PER_CHAT = int(os.getenv("MAX_QUEUE_PER_CHAT", "100"))
+# 异步模式：用协程处理消息，最多同时有 MAX_IN_FLIGHT 个回复在等待 OpenAPI 响应
+# Async mode: messages are handled by coroutines, at most MAX_IN_FLIGHT replies wait for OpenAPI at a time.
+ASYNC_MODE = os.getenv("ASYNC_MODE", "").lower() in ("1", "true", "yes")
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "100"))
+# 异步模式下让 SDK 的请求共用带连接池的 httpx client（见 async_runner.share_sdk_async_client），默认关闭
+# In async mode, let the SDK's requests share pooled httpx clients (see async_runner.share_sdk_async_client), off by
+# default.
+SHARE_SDK_CLIENT = os.getenv("SHARE_SDK_CLIENT", "").lower() in ("1", "true", "yes")
+# 把收到的事件录制到该文件，供 replay.py 回放；{pid} 会替换为进程号，多进程运行时每个进程各写一个文件
+# Record received events to this file for replay.py; {pid} is replaced by the process id, so that every
+# process writes its own file when running under supervisor.py.
+RECORD_EVENTS = os.getenv("RECORD_EVENTS", "")
+# 最多同时转发的图片、文件、音频和视频数，以及每个资源最多在内存中缓存的字节数，更大的资源写入临时文件
+# Maximum number of images, files, audio and media passed through at a time, and the bytes of a resource kept
+# in memory at most, larger resources are written to a temporary file.
+MAX_TRANSFERS = int(os.getenv("MAX_TRANSFERS", "4"))
+SPOOL_MAX_MEMORY = int(os.getenv("SPOOL_MAX_MEMORY", str(1024 * 1024)))
+# 合并群聊中连续的文本消息，只回复一次：COALESCE_WINDOW 秒内没有新消息、距第一条消息已过 COALESCE_MAX_DELAY 秒
+# 或攒够 COALESCE_MAX_BATCH 条消息时回复。COALESCE_WINDOW 为 0（默认）时不合并。
+# Merge consecutive text messages of a group chat into a single reply, sent once no new message arrived for
+# COALESCE_WINDOW seconds, COALESCE_MAX_DELAY seconds after the first message or once COALESCE_MAX_BATCH messages
+# are collected. Messages are not merged when COALESCE_WINDOW is 0, the default.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", "2"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "20"))
 
-# 注册接收消息事件，处理接收到的消息。
-# Register event handler to handle received messages.
-# https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/events/receive
-def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
-    res_content = ""
+streamer = ResourceStreamer(lark.APP_ID, lark.APP_SECRET, lark.FEISHU_DOMAIN, MAX_TRANSFERS, SPOOL_MAX_MEMORY)
+atexit.register(streamer.close)
+
+
+# 回复的消息类型和内容：文本消息回复相同的文本，图片、文件、音频和视频重新上传后原样发回。
+# 转发资源时会阻塞，异步模式下在线程中调用。
+# Message type and content of the reply: text is echoed as text, images, files, audio and media are uploaded
+# again and sent back as they are. Passing a resource through blocks, async mode calls this in a thread.
+def build_reply_content(data: P2ImMessageReceiveV1):
     if data.event.message.message_type == "text":
-        res_content = json.loads(data.event.message.content)["text"]
+        res_content = codec.loads(data.event.message.content)["text"]
     else:
-        res_content = "解析消息失败，请发送文本消息\nparse message failed, please send text message"
+        reply = streamer.reply_content(client, data.event.message)
+        if reply is not None:
+            return reply
+        res_content = "解析消息失败，请发送文本、图片、文件或视频消息\nparse message failed, please send text, image, file or media message"
 
-    content = json.dumps(
+    content = codec.dumps(
         {
             "text": "收到你发送的消息："
             + res_content
@@ -21,58 +65,150 @@ def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
             + res_content
         }
     )
+    return "text", content
+
 
+# 根据收到的消息构造回复：单聊发送新消息，群聊引用原消息回复。
+# Build the reply to a received message: a new message in p2p chats, a reply quoting the message in groups.
+def build_reply_request(data: P2ImMessageReceiveV1, msg_type, content):
     if data.event.message.chat_type == "p2p":
-        request = (
+        return (
             CreateMessageRequest.builder()
             .receive_id_type("chat_id")
             .request_body(
                 CreateMessageRequestBody.builder()
                 .receive_id(data.event.message.chat_id)
-                .msg_type("text")
+                .msg_type(msg_type)
                 .content(content)
                 .build()
             )
             .build()
         )
+    return (
+        ReplyMessageRequest.builder()
+        .message_id(data.event.message.message_id)
+        .request_body(
+            ReplyMessageRequestBody.builder()
+            .content(content)
+            .msg_type(msg_type)
+            .build()
+        )
+        .build()
+    )
+
+
+# 合并后的回复：引用最后一条消息，列出这一批的全部文本；只有一条时和单条消息的回复相同。
+# The merged reply quotes the last message and lists the text of the whole batch, a batch of one is answered
+# like a single message.
+def build_batch_reply_request(batch):
+    if len(batch) == 1:
+        return build_reply_request(batch[0], *build_reply_content(batch[0]))
+    texts = "\n".join(codec.loads(data.event.message.content)["text"] for data in batch)
+    content = codec.dumps(
+        {
+            "text": f"收到你发送的 {len(batch)} 条消息：\n"
+            + texts
+            + f"\nReceived {len(batch)} messages:\n"
+            + texts
+        }
+    )
+    return build_reply_request(batch[-1], "text", content)
+
+
+def check_response(name, response):
+    if not response.success():
+        raise Exception(
+            f"{name} failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+        )
+
+
+# 注册接收消息事件，处理接收到的消息。
+# Register event handler to handle received messages.
+# https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/events/receive
+def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
+    request = build_reply_request(data, *build_reply_content(data))
+    if isinstance(request, CreateMessageRequest):
         # 使用OpenAPI发送消息
         # Use send OpenAPI to send messages
         # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-        response = client.im.v1.message.create(request)
-
-        if not response.success():
-            raise Exception(
-                f"client.im.v1.message.create failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
-            )
+        check_response("client.im.v1.message.create", client.im.v1.message.create(request))
     else:
-        request: ReplyMessageRequest = (
-            ReplyMessageRequest.builder()
-            .message_id(data.event.message.message_id)
-            .request_body(
-                ReplyMessageRequestBody.builder()
-                .content(content)
-                .msg_type("text")
-                .build()
-            )
-            .build()
-        )
         # 使用OpenAPI回复消息
         # Reply to messages using send OpenAPI
         # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/reply
-        response: ReplyMessageResponse = client.im.v1.message.reply(request)
-        if not response.success():
-            raise Exception(
-                f"client.im.v1.message.reply failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
-            )
+        check_response("client.im.v1.message.reply", client.im.v1.message.reply(request))
+
+
+# 异步版本：在共享的事件循环上等待 OpenAPI 的响应，等待期间可以处理其它消息。
+# Async version: awaits the OpenAPI response on the shared event loop, other messages are handled meanwhile.
+async def ado_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
+    if data.event.message.message_type == "text":
+        request = build_reply_request(data, *build_reply_content(data))
+    else:
+        request = build_reply_request(data, *await asyncio.to_thread(build_reply_content, data))
+    if isinstance(request, CreateMessageRequest):
+        check_response("client.im.v1.message.acreate", await client.im.v1.message.acreate(request))
+    else:
+        check_response("client.im.v1.message.areply", await client.im.v1.message.areply(request))
+
+
+# 回复合并后的一批群聊消息
+# Reply to a merged batch of group messages.
+def reply_batch(batch) -> None:
+    request = build_batch_reply_request(batch)
+    check_response("client.im.v1.message.reply", client.im.v1.message.reply(request))
+
+
+async def areply_batch(batch) -> None:
+    request = build_batch_reply_request(batch)
+    check_response("client.im.v1.message.areply", await client.im.v1.message.areply(request))
+
 
+# 群聊中的文本消息交给 coalescer 合并，其它消息先发出该会话已合并的消息再处理，同一会话的回复保持顺序。
+# Text messages of group chats go to the coalescer, other messages first flush their chat's pending batch so
+# the replies of a chat stay in order.
+def coalesce(handler):
+    def coalesce_handler(data: P2ImMessageReceiveV1) -> None:
+        message = data.event.message
+        if message.chat_type == "group" and message.message_type == "text":
+            coalescer.add(message.chat_id, data)
+        else:
+            coalescer.flush(message.chat_id)
+            handler(data)
+
+    return coalesce_handler
+
+
+# 同一会话的消息按顺序处理，不同会话的消息并行处理，一个慢的 OpenAPI 调用不会阻塞其它会话。
+# Messages of one chat are handled in order and different chats in parallel, so one slow OpenAPI call
+# doesn't hold up the other chats.
+if ASYNC_MODE:
+    if SHARE_SDK_CLIENT:
+        share_sdk_async_client(MAX_IN_FLIGHT)
+    executor = AsyncRunner(MAX_IN_FLIGHT)
+    message_handler = executor.wrap(ado_p2_im_message_receive_v1, key=lambda data: data.event.message.chat_id)
+    batch_handler = executor.wrap(areply_batch, key=lambda batch: batch[-1].event.message.chat_id)
+else:
+    executor = KeyedExecutor(WORKERS, MAX_QUEUE_PER_CHAT)
+    message_handler = executor.wrap(do_p2_im_message_receive_v1, key=lambda data: data.event.message.chat_id)
+    batch_handler = executor.wrap(reply_batch, key=lambda batch: batch[-1].event.message.chat_id)
+coalescer = None
+if COALESCE_WINDOW > 0:
+    coalescer = Coalescer(
+        lambda chat_id, batch: batch_handler(batch), COALESCE_WINDOW, COALESCE_MAX_DELAY, COALESCE_MAX_BATCH
+    )
+    message_handler = coalesce(message_handler)
 
 # 注册事件回调
 # Register event handler.
 event_handler = (
     lark.EventDispatcherHandler.builder("", "")
-    .register_p2_im_message_receive_v1(do_p2_im_message_receive_v1)
+    .register_p2_im_message_receive_v1(message_handler)
     .build()
 )
+if RECORD_EVENTS:
+    recorder = EventRecorder(RECORD_EVENTS.format(pid=os.getpid())).install(event_handler)
+    atexit.register(recorder.close)
 
 
 # 创建 LarkClient 对象，用于请求OpenAPI, 并创建 LarkWSClient 对象，用于使用长连接接收事件。
@@ -86,6 +222,15 @@ wsClient = lark.ws.Client(
 )
 
 
+# 供 supervisor.py 汇总的统计信息
+# Stats aggregated by supervisor.py.
+def stats():
+    stats = {**executor.stats(), "transfers": streamer.stats()}
+    if coalescer is not None:
+        stats["coalescer"] = coalescer.stats()
+    return stats
+
+
 def main():
     #  启动长连接，并注册事件处理器。
     #  Start long connection and register event handler.
@@ -0,0 +1,290 @@
+import io
+import mmap
+import tempfile
+import threading
+from lark_oapi import FEISHU_DOMAIN
+from lark_oapi.api.im.v1 import *
+from lark_oapi.core.model import Config
+from lark_oapi.core.token import TokenManager
+import codec
+from transport import HttpTransport
+
+# 每次从响应中读取的字节数
+# Bytes read from the response at a time.
+CHUNK_SIZE = 64 * 1024
+# 开放平台上传接口的大小上限：图片 10MB，文件 30MB
+# Upload limits of the open platform: 10MB for images, 30MB for files.
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+MAX_FILE_SIZE = 30 * 1024 * 1024
+# 文件扩展名 -> 上传文件接口的 file_type，其它扩展名使用 stream
+# file extension -> file_type of the upload file API, other extensions use stream
+FILE_TYPES = {
+    "pdf": "pdf",
+    "doc": "doc",
+    "docx": "doc",
+    "xls": "xls",
+    "xlsx": "xls",
+    "ppt": "ppt",
+    "pptx": "ppt",
+    "mp4": "mp4",
+    "opus": "opus",
+}
+
+
+# 把消息中的图片、文件、音频和视频转发回去：分块下载消息资源，写入 _Spool，再从中上传。
+# 不超过 spool_max_memory 的资源留在内存中，更大的资源写入临时文件并通过 mmap 上传，
+# 所以每个资源占用的内存不超过 spool_max_memory + CHUNK_SIZE，与文件大小无关；
+# 最多 max_transfers 个资源同时传输，其余的排队等待。
+# Passes images, files, audio and media of a message back: the message resource is downloaded in chunks into a
+# _Spool and uploaded from there. Resources up to spool_max_memory stay in memory, larger ones go to
+# a temporary file that is uploaded through mmap, so a resource takes at most spool_max_memory + CHUNK_SIZE of memory
+# whatever its size. At most max_transfers resources are transferred at a time, the others wait.
+# 下载走 transport.py 中带连接池的 requests 会话，app_id、app_secret 和 domain 由调用方传入，用于获取 tenant_access_token。
+# Downloads go through the pooled requests session of transport.py, app_id, app_secret and domain are passed in by
+# the caller to get the tenant_access_token.
+class ResourceStreamer(object):
+    def __init__(self, app_id, app_secret, domain=FEISHU_DOMAIN, max_transfers=4, spool_max_memory=1024 * 1024):
+        self.max_transfers = max_transfers
+        self.spool_max_memory = spool_max_memory
+        self._config = Config()
+        self._config.app_id = app_id
+        self._config.app_secret = app_secret
+        self._config.domain = domain
+        # 分块读取响应需要 requests 的 stream=True，所以不使用 http2；每个传输槽位一个连接
+        # reading the response in chunks needs requests' stream=True, so http2 is not used; one connection per slot
+        self._transport = HttpTransport(pool_size=max_transfers, http2=False)
+        self._slots = threading.BoundedSemaphore(max_transfers)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.transferred = 0
+        self.failed = 0
+        self.spilled = 0
+        self.bytes = 0
+
+    def reply_content(self, client, message):
+        # 返回 (msg_type, content)，不支持的消息类型返回 None
+        # returns (msg_type, content), None for message types that can't be passed through
+        content = codec.loads(message.content)
+        if message.message_type == "image":
+            image_key = self.pass_through(client, message.message_id, content["image_key"], "image")
+            return "image", codec.dumps({"image_key": image_key})
+        if message.message_type == "file":
+            file_key = self.pass_through(client, message.message_id, content["file_key"], "file", content.get("file_name"))
+            return "file", codec.dumps({"file_key": file_key})
+        if message.message_type == "audio":
+            file_key = self.pass_through(
+                client, message.message_id, content["file_key"], "file", "audio.opus", content.get("duration")
+            )
+            return "audio", codec.dumps({"file_key": file_key})
+        if message.message_type == "media":
+            # 视频消息需要同时转发封面图片
+            # a media message needs its cover image passed through as well
+            file_key = self.pass_through(
+                client, message.message_id, content["file_key"], "file", content.get("file_name") or "media.mp4",
+                content.get("duration"),
+            )
+            image_key = self.pass_through(client, message.message_id, content["image_key"], "image")
+            return "media", codec.dumps({"file_key": file_key, "image_key": image_key})
+        return None
+
+    def pass_through(self, client, message_id, resource_key, resource_type, file_name=None, duration=None):
+        # 下载消息中的一个资源并重新上传，返回上传得到的 image_key 或 file_key
+        # download one resource of a message and upload it again, returns the new image_key or file_key
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+        try:
+            with _Spool(self.spool_max_memory) as spool:
+                size = self._download(message_id, resource_key, resource_type, spool)
+                with spool.upload(file_name or resource_key) as upload:
+                    if resource_type == "image":
+                        key = _upload_image(client, upload)
+                    else:
+                        key = _upload_file(client, upload, file_name or resource_key, duration)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+        with self._lock:
+            self.transferred += 1
+            self.bytes += size
+            if size > self.spool_max_memory:
+                self.spilled += 1
+        return key
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_transfers": self.max_transfers,
+                "transferred": self.transferred,
+                "failed": self.failed,
+                "spilled": self.spilled,
+                "bytes": self.bytes,
+            }
+
+    # 获取消息中的资源文件。SDK 的 message_resource.get 会把整个文件读入内存，这里分块读取响应。
+    # Get the resource of a message. The SDK's message_resource.get reads the whole file into memory,
+    # the response is read in chunks here instead.
+    # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message-resource/get
+    def _download(self, message_id, resource_key, resource_type, spool):
+        url = f"{self._config.domain}/open-apis/im/v1/messages/{message_id}/resources/{resource_key}"
+        headers = {"Authorization": f"Bearer {TokenManager.get_self_tenant_token(self._config)}"}
+        limit = MAX_IMAGE_SIZE if resource_type == "image" else MAX_FILE_SIZE
+        with self._transport.get(url, params={"type": resource_type}, headers=headers, stream=True) as response:
+            if not 200 <= response.status_code < 300:
+                try:
+                    error = response.json()
+                except ValueError:
+                    error = {}
+                raise Exception(
+                    f"get message resource failed, status: {response.status_code}, code: {error.get('code')}, "
+                    f"msg: {error.get('msg')}, log_id: {response.headers.get('X-Tt-Logid')}"
+                )
+            size = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise Exception(f"resource {resource_key} is larger than {limit} bytes")
+                spool.write(chunk)
+        return size
+
+    def close(self):
+        self._transport.close()
+
+
+# 上传图片
+# Upload an image.
+# https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/image/create
+def _upload_image(client, upload):
+    request = (
+        CreateImageRequest.builder()
+        .request_body(CreateImageRequestBody.builder().image_type("message").image(upload).build())
+        .build()
+    )
+    response = client.im.v1.image.create(request)
+    _check_response("client.im.v1.image.create", response)
+    return response.data.image_key
+
+
+# 上传文件
+# Upload a file.
+# https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/file/create
+def _upload_file(client, upload, file_name, duration):
+    extension = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    body = (
+        CreateFileRequestBody.builder()
+        .file_type(FILE_TYPES.get(extension, "stream"))
+        .file_name(file_name)
+        .file(upload)
+    )
+    if duration is not None:
+        body.duration(int(duration))
+    request = CreateFileRequest.builder().request_body(body.build()).build()
+    response = client.im.v1.file.create(request)
+    _check_response("client.im.v1.file.create", response)
+    return response.data.file_key
+
+
+def _check_response(name, response):
+    if not response.success():
+        raise Exception(
+            f"{name} failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+        )
+
+
+class _Spool(object):
+    # 写入的数据不超过 max_size 时留在内存中的 BytesIO，超过后连同已写入的数据转入临时文件
+    # Data written stays in a BytesIO in memory up to max_size, past it everything moves to a temporary file.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    def write(self, data):
+        if self._file is None and self.size + len(data) > self.max_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._buffer if self._file is None else self._file).write(data)
+        self.size += len(data)
+
+    def upload(self, name):
+        # 仍在内存中的直接使用其 buffer，已写入磁盘的通过 mmap 读取，两种情况都不复制数据；上传完成前不能再写入
+        # data still in memory is read from its buffer, data on disk through mmap, neither copies it; nothing may be
+        # written until the upload is closed
+        if self._file is not None:
+            self._file.flush()
+            return _Upload(mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ), name)
+        return _Upload(self._buffer.getbuffer(), name)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._buffer = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Upload(io.RawIOBase):
+    # 只读的上传数据。SDK 按 multipart 分块读取它：requests_toolbelt 通过 len() 和 tell() 得到剩余长度，
+    # httpx 通过 seek() 和 tell()。
+    # Read-only upload data. The SDK reads it in chunks for the multipart body: requests_toolbelt gets the remaining
+    # length through len() and tell(), httpx through seek() and tell().
+    def __init__(self, buffer, name):
+        super().__init__()
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._position = 0
+        self.name = name
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._position)
+        b[:n] = self._view[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = len(self._view) + offset
+        self._position = max(0, min(self._position, len(self._view)))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if isinstance(self._buffer, mmap.mmap):
+                self._buffer.close()
+            else:
+                self._buffer.release()
+        super().close()
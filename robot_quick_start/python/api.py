@@ -1,7 +1,14 @@
 #! /usr/bin/env python3.8
 import os
+import time
 import logging
-import requests
+import threading
+import codec
+import metrics
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from ratelimit import AimdRateLimiter
+from transport import get_transport
 
 APP_ID = os.getenv("APP_ID")
 APP_SECRET = os.getenv("APP_SECRET")
@@ -9,31 +16,101 @@ APP_SECRET = os.getenv("APP_SECRET")
 # const
 TENANT_ACCESS_TOKEN_URI = "/open-apis/auth/v3/tenant_access_token/internal"
 MESSAGE_URI = "/open-apis/im/v1/messages"
+# refresh tenant_access_token this many seconds before it expires
+TOKEN_REFRESH_AHEAD = 300
+# error codes returned by open api when the access token is invalid or expired
+TOKEN_INVALID_CODES = (99991661, 99991663, 99991677)
+# error codes returned by open api when the app or the receiver hits the frequency limit
+RATE_LIMIT_CODES = (99991400, 230020)
+# default message send rate per app, see https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
+MESSAGE_RATE_LIMIT = 50
+
+# result of one message sent by MessageApiClient.send_many, error is None on success
+SendResult = namedtuple(
+    "SendResult", ["receive_id_type", "receive_id", "message_id", "error", "attempts"]
+)
 
 
 class MessageApiClient(object):
-    def __init__(self, app_id, app_secret, lark_host):
+    def __init__(self, app_id, app_secret, lark_host, transport=None):
         self._app_id = app_id
         self._app_secret = app_secret
         self._lark_host = lark_host
-        self._tenant_access_token = ""
+        self._transport = transport or get_transport()
+        self._token_manager = TenantAccessTokenManager(
+            app_id, app_secret, lark_host, transport=self._transport
+        )
 
     @property
     def tenant_access_token(self):
-        return self._tenant_access_token
+        return self._token_manager.token
+
+    @property
+    def token_manager(self):
+        return self._token_manager
+
+    @property
+    def transport(self):
+        return self._transport
 
     def send_text_with_open_id(self, open_id, content):
         self.send("open_id", open_id, "text", content)
 
     def send(self, receive_id_type, receive_id, msg_type, content):
         # send message to user, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-        self._authorize_tenant_access_token()
+        start = metrics.STAGE_SEND.start()
+        token = self._token_manager.get()
+        try:
+            return self._send(token, receive_id_type, receive_id, msg_type, content)
+        except LarkException as e:
+            if e.code not in TOKEN_INVALID_CODES:
+                raise
+            # token was revoked or expired earlier than announced, refresh and retry once
+            self._token_manager.invalidate(token)
+            return self._send(self._token_manager.get(), receive_id_type, receive_id, msg_type, content)
+        finally:
+            metrics.STAGE_SEND.observe_since(start)
+
+    def send_many(self, messages, max_workers=10, rate=MESSAGE_RATE_LIMIT, max_retries=3):
+        # send (receive_id_type, receive_id, msg_type, content) tuples concurrently and yield a
+        # SendResult for each of them in completion order. messages may be a lazy iterable, at most
+        # 2 * max_workers of them are held in memory at any time.
+        limiter = AimdRateLimiter(rate)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+            for message in messages:
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(self._send_with_limiter, limiter, max_retries, *message))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def _send_with_limiter(self, limiter, max_retries, receive_id_type, receive_id, msg_type, content):
+        attempts = 0
+        while True:
+            limiter.acquire()
+            attempts += 1
+            try:
+                data = self.send(receive_id_type, receive_id, msg_type, content)
+            except Exception as e:
+                if not _is_rate_limited(e) or attempts > max_retries:
+                    return SendResult(receive_id_type, receive_id, None, e, attempts)
+                limiter.on_throttle()
+                continue
+            limiter.on_success()
+            return SendResult(receive_id_type, receive_id, data.get("message_id"), None, attempts)
+
+    def _send(self, token, receive_id_type, receive_id, msg_type, content):
         url = "{}{}?receive_id_type={}".format(
             self._lark_host, MESSAGE_URI, receive_id_type
         )
         headers = {
             "Content-Type": "application/json",
-            "Authorization": "Bearer " + self.tenant_access_token,
+            "Authorization": "Bearer " + token,
         }
 
         req_body = {
@@ -41,27 +118,126 @@ class MessageApiClient(object):
             "content": content,
             "msg_type": msg_type,
         }
-        resp = requests.post(url=url, headers=headers, json=req_body)
-        MessageApiClient._check_error_response(resp)
+        resp = self._transport.post(url=url, headers=headers, data=codec.dumps_bytes(req_body))
+        return MessageApiClient._check_error_response(resp).get("data") or {}
 
     def _authorize_tenant_access_token(self):
-        # get tenant_access_token and set, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/auth-v3/auth/tenant_access_token_internal
-        url = "{}{}".format(self._lark_host, TENANT_ACCESS_TOKEN_URI)
-        req_body = {"app_id": self._app_id, "app_secret": self._app_secret}
-        response = requests.post(url, req_body)
-        MessageApiClient._check_error_response(response)
-        self._tenant_access_token = response.json().get("tenant_access_token")
+        # force a new tenant_access_token regardless of the cached one
+        self._token_manager.refresh()
 
     @staticmethod
     def _check_error_response(resp):
         # check if the response contains error information
         if resp.status_code != 200:
+            metrics.OPEN_API_ERRORS.inc(resp.status_code, _error_code(resp))
             resp.raise_for_status()
-        response_dict = resp.json()
+        response_dict = codec.loads(resp.content)
         code = response_dict.get("code", -1)
         if code != 0:
+            metrics.OPEN_API_ERRORS.inc(resp.status_code, code)
             logging.error(response_dict)
             raise LarkException(code=code, msg=response_dict.get("msg"))
+        return response_dict
+
+
+class TenantAccessTokenManager(object):
+    # cache tenant_access_token until it expires, refresh it in the background shortly before
+    # expiry, and make sure only one refresh request is in flight at a time
+    def __init__(self, app_id, app_secret, lark_host, refresh_ahead=TOKEN_REFRESH_AHEAD, transport=None):
+        self._app_id = app_id
+        self._app_secret = app_secret
+        self._lark_host = lark_host
+        self._transport = transport or get_transport()
+        self._refresh_ahead = refresh_ahead
+        self._token = ""
+        self._expire_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.refresh_count = 0
+
+    @property
+    def token(self):
+        return self._token
+
+    def get(self):
+        # return a usable token, only block when there is none cached
+        token, now = self._token, time.monotonic()
+        if token and now < self._expire_at:
+            if now >= self._refresh_at:
+                self._refresh_in_background()
+            return token
+        return self._refresh_if_stale(token)
+
+    def invalidate(self, token):
+        # drop the cached token, unless another thread has already replaced it
+        with self._lock:
+            if self._token == token:
+                self._token = ""
+                self._expire_at = 0.0
+                self._refresh_at = 0.0
+
+    def refresh(self):
+        with self._lock:
+            self._fetch()
+            return self._token
+
+    def _refresh_if_stale(self, stale_token):
+        with self._lock:
+            # another thread may have refreshed the token while we waited for the lock
+            if self._token and self._token != stale_token and time.monotonic() < self._expire_at:
+                return self._token
+            self._fetch()
+            return self._token
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                if time.monotonic() < self._refresh_at:
+                    return
+                self._fetch()
+        except Exception as e:
+            # cached token is still valid, the next get() will try again
+            logging.warning("refresh tenant_access_token failed: %s", e)
+        finally:
+            self._refreshing = False
+
+    def _fetch(self):
+        # get tenant_access_token, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/auth-v3/auth/tenant_access_token_internal
+        url = "{}{}".format(self._lark_host, TENANT_ACCESS_TOKEN_URI)
+        req_body = {"app_id": self._app_id, "app_secret": self._app_secret}
+        response = self._transport.post(url, req_body)
+        response_dict = MessageApiClient._check_error_response(response)
+        self._token = response_dict.get("tenant_access_token")
+        # expire is the remaining lifetime in seconds, never spend more than half of it refreshing early
+        expire = int(response_dict.get("expire", 0))
+        now = time.monotonic()
+        self._expire_at = now + expire
+        self._refresh_at = now + max(expire - self._refresh_ahead, expire / 2)
+        self.refresh_count += 1
+        metrics.TOKEN_REFRESHES.inc()
+
+
+def _error_code(resp):
+    # lark error code in the body of a non 200 response, if there is one
+    try:
+        return codec.loads(resp.content).get("code", "")
+    except (ValueError, AttributeError):
+        return ""
+
+
+def _is_rate_limited(ex):
+    if isinstance(ex, LarkException):
+        return ex.code in RATE_LIMIT_CODES
+    response = getattr(ex, "response", None)
+    return response is not None and response.status_code == 429
 
 
 class LarkException(Exception):
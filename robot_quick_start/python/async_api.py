@@ -0,0 +1,164 @@
+#! /usr/bin/env python3.8
+# asyncio version of api.MessageApiClient, sends open api requests with httpx.AsyncClient
+import time
+import asyncio
+import logging
+import httpx
+import codec
+import metrics
+from api import (
+    MESSAGE_URI,
+    TENANT_ACCESS_TOKEN_URI,
+    TOKEN_REFRESH_AHEAD,
+    TOKEN_INVALID_CODES,
+    MessageApiClient,
+    LarkException,
+)
+from transport import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_HTTP2,
+)
+
+
+class AsyncMessageApiClient(object):
+    def __init__(self, app_id, app_secret, lark_host, http_client=None, max_connections=DEFAULT_POOL_SIZE):
+        self._app_id = app_id
+        self._app_secret = app_secret
+        self._lark_host = lark_host
+        self._http_client = http_client or httpx.AsyncClient(
+            http2=DEFAULT_HTTP2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT),
+        )
+        self._token_manager = AsyncTenantAccessTokenManager(
+            app_id, app_secret, lark_host, self._http_client
+        )
+
+    @property
+    def tenant_access_token(self):
+        return self._token_manager.token
+
+    @property
+    def token_manager(self):
+        return self._token_manager
+
+    async def send_text_with_open_id(self, open_id, content):
+        return await self.send("open_id", open_id, "text", content)
+
+    async def send(self, receive_id_type, receive_id, msg_type, content):
+        # send message to user, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
+        start = metrics.STAGE_SEND.start()
+        token = await self._token_manager.get()
+        try:
+            return await self._send(token, receive_id_type, receive_id, msg_type, content)
+        except LarkException as e:
+            if e.code not in TOKEN_INVALID_CODES:
+                raise
+            # token was revoked or expired earlier than announced, refresh and retry once
+            self._token_manager.invalidate(token)
+            token = await self._token_manager.get()
+            return await self._send(token, receive_id_type, receive_id, msg_type, content)
+        finally:
+            metrics.STAGE_SEND.observe_since(start)
+
+    async def aclose(self):
+        await self._http_client.aclose()
+
+    async def _send(self, token, receive_id_type, receive_id, msg_type, content):
+        url = "{}{}".format(self._lark_host, MESSAGE_URI)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + token,
+        }
+        req_body = {
+            "receive_id": receive_id,
+            "content": content,
+            "msg_type": msg_type,
+        }
+        resp = await self._http_client.post(
+            url,
+            params={"receive_id_type": receive_id_type},
+            headers=headers,
+            content=codec.dumps_bytes(req_body),
+        )
+        return MessageApiClient._check_error_response(resp).get("data") or {}
+
+
+class AsyncTenantAccessTokenManager(object):
+    # asyncio version of api.TenantAccessTokenManager, all coroutines sharing the manager
+    # wait on the same refresh instead of each requesting a token
+    def __init__(self, app_id, app_secret, lark_host, http_client, refresh_ahead=TOKEN_REFRESH_AHEAD):
+        self._app_id = app_id
+        self._app_secret = app_secret
+        self._lark_host = lark_host
+        self._http_client = http_client
+        self._refresh_ahead = refresh_ahead
+        self._token = ""
+        self._expire_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = None
+        self._background_task = None
+        self.refresh_count = 0
+
+    @property
+    def token(self):
+        return self._token
+
+    async def get(self):
+        # return a usable token, only wait when there is none cached
+        token, now = self._token, time.monotonic()
+        if token and now < self._expire_at:
+            if now >= self._refresh_at and self._background_task is None:
+                self._background_task = asyncio.ensure_future(self._background_refresh())
+            return token
+        async with self._get_lock():
+            # another coroutine may have refreshed the token while we waited for the lock
+            if self._token and self._token != token and time.monotonic() < self._expire_at:
+                return self._token
+            await self._fetch()
+            return self._token
+
+    def invalidate(self, token):
+        if self._token == token:
+            self._token = ""
+            self._expire_at = 0.0
+            self._refresh_at = 0.0
+
+    async def refresh(self):
+        async with self._get_lock():
+            await self._fetch()
+            return self._token
+
+    def _get_lock(self):
+        # created lazily so that the lock belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _background_refresh(self):
+        try:
+            async with self._get_lock():
+                if time.monotonic() >= self._refresh_at:
+                    await self._fetch()
+        except Exception as e:
+            # cached token is still valid, the next get() will try again
+            logging.warning("refresh tenant_access_token failed: %s", e)
+        finally:
+            self._background_task = None
+
+    async def _fetch(self):
+        # get tenant_access_token, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/auth-v3/auth/tenant_access_token_internal
+        url = "{}{}".format(self._lark_host, TENANT_ACCESS_TOKEN_URI)
+        req_body = {"app_id": self._app_id, "app_secret": self._app_secret}
+        response = await self._http_client.post(url, data=req_body)
+        response_dict = MessageApiClient._check_error_response(response)
+        self._token = response_dict.get("tenant_access_token")
+        # expire is the remaining lifetime in seconds, never spend more than half of it refreshing early
+        expire = int(response_dict.get("expire", 0))
+        now = time.monotonic()
+        self._expire_at = now + expire
+        self._refresh_at = now + max(expire - self._refresh_ahead, expire / 2)
+        self.refresh_count += 1
+        metrics.TOKEN_REFRESHES.inc()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3.8
+# asyncio version of event.EventManager for ASGI servers
+import inspect
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from event import EventManager
+
+
+class AsyncEventManager(EventManager):
+    # handlers registered here may be coroutines or plain functions, plain functions run in a
+    # thread pool so they don't block the event loop. middlewares must be coroutines:
+    # async def middleware(event, call_next): return await call_next(event)
+
+    async def get_handler_with_event(self, request, token, encrypt_key):
+        body = await request.body()
+        return self.parse_event(request.headers, body, token, encrypt_key)
+
+    @staticmethod
+    async def fallback_handler(event):
+        return JSONResponse({})
+
+    async def is_duplicate(self, event):
+        # coroutine version of EventManager.is_duplicate, blocking stores such as sqlite run in the thread pool
+        if self.dedup_store is not None and self.dedup_store.blocking:
+            return await run_in_threadpool(super(AsyncEventManager, self).is_duplicate, event)
+        return super(AsyncEventManager, self).is_duplicate(event)
+
+    async def forget(self, event):
+        if self.dedup_store is not None and self.dedup_store.blocking:
+            await run_in_threadpool(super(AsyncEventManager, self).forget, event)
+        else:
+            super(AsyncEventManager, self).forget(event)
+
+    @staticmethod
+    def _build_dispatch(handlers):
+        handlers = tuple(AsyncEventManager._as_coroutine(handler) for handler in handlers)
+        if len(handlers) == 1:
+            return handlers[0]
+
+        async def dispatch(event):
+            response = None
+            for handler in handlers:
+                result = await handler(event)
+                if response is None:
+                    response = result
+            return response
+
+        return dispatch
+
+    @staticmethod
+    def _as_coroutine(handler):
+        if inspect.iscoroutinefunction(handler):
+            return handler
+
+        async def run(event):
+            return await run_in_threadpool(handler, event)
+
+        return run
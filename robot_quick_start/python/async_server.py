@@ -0,0 +1,113 @@
+#!/usr/bin/env python3.8
+# asyncio version of server.py, run with: python3 async_server.py
+# outbound open api calls don't block a worker, so one process can serve many concurrent callbacks.
+
+import os
+import logging
+import contextlib
+import httpx
+import uvicorn
+import metrics
+from async_api import AsyncMessageApiClient
+from async_event import AsyncEventManager
+from dedup import create_dedup_store
+from event import MessageReceiveEvent, UrlVerificationEvent, InvalidEventException
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from dotenv import load_dotenv, find_dotenv
+
+# load env parameters form file named .env
+load_dotenv(find_dotenv())
+
+# load from env
+APP_ID = os.getenv("APP_ID")
+APP_SECRET = os.getenv("APP_SECRET")
+VERIFICATION_TOKEN = os.getenv("VERIFICATION_TOKEN")
+ENCRYPT_KEY = os.getenv("ENCRYPT_KEY")
+LARK_HOST = os.getenv("LARK_HOST")
+# skip events redelivered by lark: "memory" for one process, "sqlite" to share between worker processes
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "event_dedup.db")
+
+# init service
+message_api_client = AsyncMessageApiClient(APP_ID, APP_SECRET, LARK_HOST)
+event_manager = AsyncEventManager(create_dedup_store(DEDUP_BACKEND, DEDUP_SQLITE_PATH))
+
+
+@event_manager.register("url_verification")
+async def request_url_verify_handler(req_data: UrlVerificationEvent):
+    # url verification, just need return challenge
+    if req_data.event.token != VERIFICATION_TOKEN:
+        raise Exception("VERIFICATION_TOKEN is invalid")
+    return JSONResponse({"challenge": req_data.event.challenge})
+
+
+@event_manager.register("im.message.receive_v1")
+async def message_receive_event_handler(req_data: MessageReceiveEvent):
+    sender_id = req_data.event.sender.sender_id
+    message = req_data.event.message
+    if message.message_type != "text":
+        logging.warning("Other types of messages have not been processed yet")
+        return JSONResponse({})
+        # get open_id and text_content
+    open_id = sender_id.open_id
+    text_content = message.content
+    # echo text message
+    await message_api_client.send_text_with_open_id(open_id, text_content)
+    return JSONResponse({})
+
+
+async def msg_error_handler(request, ex):
+    # callers are not authenticated, the details only go to the log
+    if isinstance(ex, InvalidEventException):
+        logging.warning(ex)
+        return JSONResponse({"message": "invalid event"}, status_code=400)
+    logging.error(ex, exc_info=ex)
+    status_code = ex.response.status_code if isinstance(ex, httpx.HTTPStatusError) else 500
+    return JSONResponse({"message": "internal error"}, status_code=status_code)
+
+
+async def callback_event_handler(request):
+    # init callback instance and handle
+    event_handler, event = await event_manager.get_handler_with_event(
+        request, VERIFICATION_TOKEN, ENCRYPT_KEY
+    )
+    if await event_manager.is_duplicate(event):
+        return JSONResponse({})
+
+    start = metrics.STAGE_HANDLER.start()
+    try:
+        return await event_handler(event)
+    except Exception:
+        # the event was not handled, let lark's redelivery through
+        await event_manager.forget(event)
+        raise
+    finally:
+        metrics.STAGE_HANDLER.observe_since(start)
+
+
+async def metrics_handler(request):
+    # prometheus scrape endpoint
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # close kept-alive open api connections on shutdown
+    await message_api_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/", callback_event_handler, methods=["POST"]),
+        Route("/metrics", metrics_handler, methods=["GET"]),
+    ],
+    exception_handlers={Exception: msg_error_handler},
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=3000)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3.8
+import queue
+import logging
+import threading
+import time
+
+_STOP = object()
+
+
+class BoundedExecutor(object):
+    # fixed pool of worker threads fed by a bounded queue. submit() never blocks: when the queue
+    # is full or the executor is shutting down it returns False, so the caller can shed load.
+    def __init__(self, workers=8, max_queue=100, name="event-worker"):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._accepting = True
+        self._lock = threading.Lock()
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._threads = [
+            threading.Thread(target=self._run, name="{}-{}".format(name, i), daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, fn, *args):
+        if self._accepting:
+            try:
+                self._queue.put_nowait((fn, args))
+                self._incr("submitted")
+                return True
+            except queue.Full:
+                pass
+        self._incr("rejected")
+        return False
+
+    def shutdown(self, timeout=30):
+        # stop accepting work, let the workers drain what is queued, then stop them
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            dropped += 1
+        if dropped:
+            logging.warning("shutdown timed out, %d queued events dropped", dropped)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0.1))
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            fn, args = item
+            try:
+                fn(*args)
+                self._incr("completed")
+            except Exception as e:
+                self._incr("failed")
+                logging.exception("background handler failed: %s", e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3.8
+# compare event decryption before and after caching the derived key and decrypting into a reused buffer.
+# usage: python3 bench_decrypt.py
+import base64
+import hashlib
+import timeit
+from Crypto.Cipher import AES
+from decrypt import AESCipher
+from fake_events import encrypt, make_payload
+
+ENCRYPT_KEY = "bench-encrypt-key"
+SIZES = (1024, 16 * 1024, 256 * 1024, 1024 * 1024)
+
+
+class LegacyAESCipher(object):
+    # AESCipher as it was before, kept here as the baseline
+    def __init__(self, key):
+        self.key = hashlib.sha256(key.encode("utf8")).digest()
+
+    @staticmethod
+    def _unpad(s):
+        return s[: -ord(s[len(s) - 1 :])]
+
+    def decrypt_string(self, enc):
+        enc = base64.b64decode(enc)
+        iv = enc[: AES.block_size]
+        cipher = AES.new(self.key, AES.MODE_CBC, iv)
+        return self._unpad(cipher.decrypt(enc[AES.block_size :])).decode("utf8")
+
+
+def main():
+    print("{:>8} {:>14} {:>14} {:>8}".format("size", "before us/op", "after us/op", "speedup"))
+    for size in SIZES:
+        plain = make_payload(size)
+        enc = encrypt(ENCRYPT_KEY, plain)
+        assert AESCipher.for_key(ENCRYPT_KEY).decrypt_string(enc) == plain
+        number = max(10, 20 * 1024 * 1024 // size)
+        before = min(
+            timeit.repeat(lambda: LegacyAESCipher(ENCRYPT_KEY).decrypt_string(enc), number=number, repeat=5)
+        )
+        after = min(
+            timeit.repeat(lambda: AESCipher.for_key(ENCRYPT_KEY).decrypt_string(enc), number=number, repeat=5)
+        )
+        print(
+            "{:>8} {:>14.1f} {:>14.1f} {:>7.2f}x".format(
+                size, before / number * 1e6, after / number * 1e6, before / after
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3.8
+# load test: CPU spent on a flood of forged callbacks, with the signature checked after parsing and
+# decryption (as before) and on the raw body first (EventManager.parse_event). both forged signatures
+# and requests without signature headers are measured.
+# usage: python3 bench_invalid_flood.py --requests 5000 --size 4096
+import json
+import time
+import argparse
+from fake_events import encrypt, make_payload
+from event import EventManager, MessageReceiveEvent, InvalidEventException
+
+TOKEN = "bench-verification-token"
+ENCRYPT_KEY = "bench-encrypt-key"
+
+
+def legacy_parse(headers, body):
+    # intake order before: parse, decrypt, build the event and only then check the signature
+    dict_data = json.loads(body)
+    dict_data = EventManager._decrypt_data(ENCRYPT_KEY, dict_data)
+    return MessageReceiveEvent(dict_data, TOKEN, ENCRYPT_KEY, headers, body)
+
+
+event_manager = EventManager()
+event_manager.register_handler_with_event_type("im.message.receive_v1", lambda event: None)
+
+
+def current_parse(headers, body):
+    return event_manager.parse_event(headers, body, TOKEN, ENCRYPT_KEY)
+
+
+def flood(parse, requests):
+    rejected = 0
+    start = time.process_time()
+    for headers, body in requests:
+        try:
+            parse(headers, body)
+        except InvalidEventException:
+            rejected += 1
+    return time.process_time() - start, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=4096, help="plaintext event size in bytes")
+    args = parser.parse_args()
+
+    event = json.loads(make_payload(args.size))
+    event["header"]["token"] = TOKEN
+    body = json.dumps({"encrypt": encrypt(ENCRYPT_KEY, json.dumps(event))}).encode("utf-8")
+    floods = (
+        (
+            "forged",
+            {
+                "X-Lark-Request-Timestamp": str(int(time.time())),
+                "X-Lark-Request-Nonce": "forged",
+                "X-Lark-Signature": "0" * 64,
+            },
+        ),
+        ("unsigned", {}),
+    )
+
+    for flood_name, headers in floods:
+        requests = [(headers, body)] * args.requests
+        print("{} {} requests, {} bytes each".format(args.requests, flood_name, len(body)))
+        results = {}
+        for name, parse in (("before", legacy_parse), ("after", current_parse)):
+            cpu, rejected = flood(parse, requests)
+            results[name] = cpu
+            print(
+                "{:<6} cpu {:>7.3f}s  {:>8.1f} us/request  {:>9.0f} requests/cpu-second  rejected {}".format(
+                    name, cpu, cpu / args.requests * 1e6, args.requests / cpu, rejected
+                )
+            )
+        print("cpu saved: {:.0%}".format(1 - results["after"] / results["before"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.8
+# overhead of the stage histograms in metrics.py at several sampling rates. the cost of one instrumented stage
+# is measured on its own and compared with the time of a callback through flask (signature, parse, decrypt,
+# event and an empty handler, no open api call), whole request timings are too noisy to show a 1% difference.
+# usage: python3 bench_metrics.py --requests 5000 --size 2048
+import time
+import argparse
+import metrics
+from flask import Flask, jsonify
+from event import EventManager
+from loadgen import build_callback
+
+TOKEN = "bench-verification-token"
+ENCRYPT_KEY = "bench-encrypt-key"
+# signature, parse, decrypt, dict_2_obj, handler and send
+STAGES = 6
+
+
+def run(client, requests):
+    start = time.perf_counter()
+    for headers, body in requests:
+        client.post("/", data=body, headers=headers)
+    return (time.perf_counter() - start) / len(requests)
+
+
+def stage_cost(histogram, calls=200000):
+    # minus the cost of the loop itself
+    start = time.perf_counter()
+    for _ in range(calls):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(calls):
+        histogram.observe_since(histogram.start())
+    return (time.perf_counter() - start - empty) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=2048, help="message text size in bytes")
+    args = parser.parse_args()
+
+    event_manager = EventManager()
+    event_manager.register_handler_with_event_type("im.message.receive_v1", lambda event: jsonify())
+    app = Flask(__name__)
+
+    @app.route("/", methods=["POST"])
+    def callback():
+        dispatch, event = event_manager.get_handler_with_event(TOKEN, ENCRYPT_KEY)
+        return dispatch(event)
+
+    requests = [build_callback(TOKEN, ENCRYPT_KEY, "x" * args.size) for _ in range(args.requests)]
+    metrics.registry.set_sample_rate(0)
+    request_seconds = min(run(app.test_client(), requests) for _ in range(3))
+    print("request without metrics {:>7.2f} us".format(request_seconds * 1e6))
+
+    histogram = metrics.Histogram()
+    for rate in (1, 0.1, 0.01):
+        histogram.set_sample_rate(rate)
+        seconds = min(stage_cost(histogram) for _ in range(3))
+        print(
+            "sample rate {:<5} {:>6.3f} us/stage  overhead {:.2%} of a request".format(
+                rate, seconds * 1e6, seconds * STAGES / request_seconds
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3.8
+# compare the eager Obj conversion used before with the lazy view in utils.py on large event payloads.
+# each run wraps the payload and reads the fields message_receive_event_handler uses.
+# usage: python3 bench_obj.py
+import json
+import timeit
+import tracemalloc
+from utils import dict_2_obj
+
+MENTION_COUNTS = (0, 100, 1000)
+
+
+class LegacyObj(dict):
+    # Obj as it was before, kept here as the baseline
+    def __init__(self, d):
+        for a, b in d.items():
+            if isinstance(b, (list, tuple)):
+                setattr(self, a, [LegacyObj(x) if isinstance(x, dict) else x for x in b])
+            else:
+                setattr(self, a, LegacyObj(b) if isinstance(b, dict) else b)
+
+
+def make_event(mentions):
+    return {
+        "sender": {
+            "sender_id": {"union_id": "on_8ed6aa67826108097d9ee143816345", "user_id": "e33ggbyz", "open_id": "ou_84aad35d084aa403a838cf73ee18467"},
+            "sender_type": "user",
+            "tenant_key": "736588c9260f175e",
+        },
+        "message": {
+            "message_id": "om_5ce6d572455d361153b7cb51da133945",
+            "root_id": "om_5ce6d572455d361153b7cb5xxfsdfsdfdsf",
+            "parent_id": "om_5ce6d572455d361153b7cb5xxfsdfsdfdsf",
+            "create_time": "1609073151345",
+            "chat_id": "oc_5ce6d572455d361153b7xx51da133945",
+            "chat_type": "group",
+            "message_type": "text",
+            "content": json.dumps({"text": "@_user_1 hello " * 20}),
+            "mentions": [
+                {
+                    "key": "@_user_{}".format(i),
+                    "id": {"union_id": "on_{}".format(i), "user_id": "u{}".format(i), "open_id": "ou_{}".format(i)},
+                    "name": "Tom {}".format(i),
+                    "tenant_key": "736588c9260f175e",
+                }
+                for i in range(mentions)
+            ],
+        },
+    }
+
+
+def handle(wrap, event):
+    obj = wrap(event)
+    return obj.sender.sender_id.open_id, obj.message.message_type, obj.message.content
+
+
+def peak_bytes(wrap, event):
+    tracemalloc.start()
+    handle(wrap, event)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format("mentions", "before us", "after us", "before bytes", "after bytes"))
+    for mentions in MENTION_COUNTS:
+        event = make_event(mentions)
+        assert handle(LegacyObj, event) == handle(dict_2_obj, event)
+        number = 20000 // (mentions + 10) + 10
+        before = min(timeit.repeat(lambda: handle(LegacyObj, event), number=number, repeat=5)) / number
+        after = min(timeit.repeat(lambda: handle(dict_2_obj, event), number=number, repeat=5)) / number
+        print(
+            "{:>8} {:>12.2f} {:>12.2f} {:>12} {:>12}".format(
+                mentions, before * 1e6, after * 1e6, peak_bytes(LegacyObj, event), peak_bytes(dict_2_obj, event)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3.8
+# load test: the flask development server (python3 server.py) against gunicorn with gunicorn.conf.py.
+# both run against the local stand-in open api with --latency seconds added to every open api call.
+# usage: python3 bench_server.py --requests 2000 --concurrency 32 --latency 0.05
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import subprocess
+from contextlib import contextmanager
+from fake_open_api import FakeOpenApiServer
+from loadgen import run_load
+
+TOKEN = "bench-verification-token"
+SERVERS = (
+    ("dev", [sys.executable, "server.py"]),
+    ("gunicorn", [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:create_app()"]),
+)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start on port {}".format(port))
+
+
+@contextmanager
+def running_server(command, env, port):
+    # the dev server's reloader forks a child, so the whole process group is stopped
+    process = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        wait_for_port(port)
+        yield "http://127.0.0.1:{}/".format(port)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+        # let the port be released before the next server binds it
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every open api call")
+    parser.add_argument("--port", type=int, default=3100)
+    args = parser.parse_args()
+
+    with FakeOpenApiServer(latency=args.latency) as fake:
+        env = dict(
+            os.environ,
+            APP_ID="cli_bench",
+            APP_SECRET="secret",
+            VERIFICATION_TOKEN=TOKEN,
+            ENCRYPT_KEY="",
+            LARK_HOST=fake.url,
+            PORT=str(args.port),
+        )
+        for name, command in SERVERS:
+            with running_server(command, env, args.port) as url:
+                # warm up connections and the token before measuring
+                run_load(url, 50, 5, TOKEN)
+                result = run_load(url, args.requests, args.concurrency, TOKEN)
+                print("{:<9} {}".format(name, result.summary()))
+
+
+if __name__ == "__main__":
+    main()
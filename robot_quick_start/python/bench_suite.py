@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.8
+# webhook benchmark suite: runs server.py under gunicorn against the local stand-in open api and posts signed
+# im.message.receive_v1 callbacks in a few fixed scenarios. results can be saved as a baseline and later runs
+# compared against it, so a change can be checked before it is merged.
+# usage: python3 bench_suite.py --save baseline.json
+#        python3 bench_suite.py --compare baseline.json
+import os
+import sys
+import json
+import argparse
+from fake_open_api import FakeOpenApiServer
+from loadgen import run_load
+from bench_server import running_server
+
+TOKEN = "bench-verification-token"
+ENCRYPT_KEY = "bench-encrypt-key"
+SERVERS = {
+    "dev": [sys.executable, "server.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:create_app()"],
+}
+# name, encrypt key of the app, stand-in open api settings
+SCENARIOS = (
+    ("plain", "", {}),
+    ("encrypted", ENCRYPT_KEY, {}),
+    ("api-errors", "", {"error_rate": 0.05}),
+    ("rate-limited", "", {"message_qps": 50}),
+)
+
+
+def run_scenario(command, port, latency, encrypt_key, fake_options, requests, concurrency):
+    with FakeOpenApiServer(latency=latency, **fake_options) as fake:
+        env = dict(
+            os.environ,
+            APP_ID="cli_bench",
+            APP_SECRET="secret",
+            VERIFICATION_TOKEN=TOKEN,
+            ENCRYPT_KEY=encrypt_key,
+            LARK_HOST=fake.url,
+            PORT=str(port),
+        )
+        with running_server(command, env, port) as url:
+            # warm up connections and the token before measuring
+            run_load(url, 50, 5, TOKEN, encrypt_key)
+            return run_load(url, requests, concurrency, TOKEN, encrypt_key)
+
+
+def to_dict(result):
+    return {
+        "throughput": result.throughput,
+        "p50": result.percentile(50),
+        "p95": result.percentile(95),
+        "p99": result.percentile(99),
+        "errors": result.errors,
+    }
+
+
+def compare(current, baseline):
+    # relative change of every metric, positive throughput and negative latency are improvements
+    parts = []
+    for key in ("throughput", "p50", "p95", "p99"):
+        if baseline.get(key):
+            parts.append("{} {:+.0%}".format(key, current[key] / baseline[key] - 1))
+    return "  ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every open api call")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="gunicorn")
+    parser.add_argument("--scenario", action="append", help="run only these scenarios")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare the results with a file written by --save")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = {}
+    for name, encrypt_key, fake_options in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        result = run_scenario(
+            SERVERS[args.server], args.port, args.latency, encrypt_key, fake_options, args.requests, args.concurrency
+        )
+        results[name] = to_dict(result)
+        line = "{:<13} {}".format(name, result.summary())
+        if name in baseline:
+            line += "\n{:<13} vs baseline: {}".format("", compare(results[name], baseline[name]))
+        print(line)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
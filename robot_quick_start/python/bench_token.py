@@ -0,0 +1,48 @@
+#!/usr/bin/env python3.8
+# compare the send rate of MessageApiClient with and without the tenant_access_token cache.
+# usage: python3 bench_token.py --messages 500 --threads 8 --latency 0.005
+import time
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from api import MessageApiClient
+from transport import HttpTransport
+from fake_open_api import FakeOpenApiServer
+
+
+def run(client, messages, threads, authorize_every_send):
+    content = json.dumps({"text": "hello"})
+
+    def send_one(i):
+        if authorize_every_send:
+            # behaviour before the token cache: one auth round trip per message
+            client._authorize_tenant_access_token()
+        client.send("open_id", "ou_{}".format(i), "text", content)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(send_one, range(messages)))
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    with FakeOpenApiServer(latency=args.latency) as fake:
+        for name, authorize_every_send in (("before", True), ("after", False)):
+            fake.counters = {"token": 0, "message": 0}
+            client = MessageApiClient("cli_bench", "secret", fake.url, transport=HttpTransport(pool_size=args.threads))
+            rate = run(client, args.messages, args.threads, authorize_every_send)
+            print(
+                "{:<6} {:>8.1f} msg/s  token requests: {:>5}  message requests: {:>5}  transport: {}".format(
+                    name, rate, fake.counters["token"], fake.counters["message"], client.transport.stats.to_dict()
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3.8
 import hashlib
-import base64
+import binascii
+import threading
+import functools
 from Crypto.Cipher import AES
 
+# const
+# decrypt payloads at least this large into a reused per-thread buffer
+BUFFER_THRESHOLD = 64 * 1024
+
 
 class AESCipher(object):
     def __init__(self, key):
         self.bs = AES.block_size
-        self.key = hashlib.sha256(AESCipher.str_to_bytes(key)).digest()
+        self.key = AESCipher._derive_key(AESCipher.str_to_bytes(key))
+        self._local = threading.local()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def for_key(key):
+        # cipher instances are reusable, share one per encrypt_key instead of deriving the key per request
+        return AESCipher(key)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def _derive_key(key):
+        return hashlib.sha256(key).digest()
 
     @staticmethod
     def str_to_bytes(data):
@@ -18,7 +36,17 @@ class AESCipher(object):
 
     @staticmethod
     def _unpad(s):
-        return s[: -ord(s[len(s) - 1 :])]
+        return s[: len(s) - AESCipher._pad_length(s)]
+
+    @staticmethod
+    def _pad_length(s):
+        # validate PKCS#7 padding and return its length
+        if len(s) == 0 or len(s) % AES.block_size != 0:
+            raise ValueError("invalid encrypted data length")
+        pad = s[-1]
+        if pad < 1 or pad > AES.block_size or s[-pad:] != _PADDINGS[pad]:
+            raise ValueError("invalid padding")
+        return pad
 
     def decrypt(self, enc):
         iv = enc[: AES.block_size]
@@ -26,5 +54,54 @@ class AESCipher(object):
         return self._unpad(cipher.decrypt(enc[AES.block_size :]))
 
     def decrypt_string(self, enc):
-        enc = base64.b64decode(enc)
-        return self.decrypt(enc).decode("utf8")
+        plain = self.decrypt_bytes(enc)
+        try:
+            return str(plain, "utf8")
+        finally:
+            if isinstance(plain, memoryview):
+                plain.release()
+
+    def decrypt_bytes(self, enc):
+        # decrypt base64 encoded data to a bytes-like object. large payloads are returned as a
+        # memoryview of a per-thread buffer, which is only valid until the next call on this thread
+        raw = self._b64decode(enc)
+        if len(raw) < BUFFER_THRESHOLD:
+            # small payloads: a fresh output is cheaper than the buffer bookkeeping
+            cipher = AES.new(self.key, AES.MODE_CBC, raw[: AES.block_size])
+            plain = cipher.decrypt(raw[AES.block_size :])
+            return plain[: len(plain) - self._pad_length(plain)]
+        return self._decrypt_into_buffer(raw)
+
+    def decrypt_view(self, enc):
+        # decrypt base64 encoded data into a per-thread buffer and return a memoryview of the
+        # plaintext. the view is only valid until the next call on this thread, release it when done.
+        return self._decrypt_into_buffer(self._b64decode(enc))
+
+    @staticmethod
+    def _b64decode(enc):
+        try:
+            raw = binascii.a2b_base64(enc)
+        except binascii.Error as e:
+            raise ValueError("invalid base64 data: {}".format(e))
+        if len(raw) < 2 * AES.block_size:
+            raise ValueError("invalid encrypted data length")
+        return raw
+
+    def _decrypt_into_buffer(self, raw):
+        size = len(raw) - AES.block_size
+        buf = getattr(self._local, "buf", None)
+        if buf is None or len(buf) < size:
+            buf = self._local.buf = bytearray(size)
+        out = memoryview(buf)[:size]
+        # the iv is copied, pycryptodome is slower with memoryview arguments for small inputs
+        cipher = AES.new(self.key, AES.MODE_CBC, raw[: AES.block_size])
+        with memoryview(raw) as view:
+            cipher.decrypt(view[AES.block_size :], output=out)
+        try:
+            plain = out[: size - self._pad_length(out)]
+        finally:
+            out.release()
+        return plain
+
+
+_PADDINGS = [bytes([i]) * i for i in range(AES.block_size + 1)]
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.8
+# stores of recently handled event_ids, used to drop events that lark delivers more than once.
+# lark retries a callback after 15s, 5m, 1h and 6h, so ids are kept a bit longer than that by default.
+import abc
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# const
+DEFAULT_TTL = 8 * 60 * 60
+DEFAULT_MAX_SIZE = 100000
+
+
+class DedupStore(abc.ABC):
+    # base class, subclasses implement _add which records the id and tells whether it is new, and forget
+    # blocking stores wait on file io, async callers run them in a thread pool instead of on the event loop
+    blocking = False
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def seen(self, event_id):
+        # record event_id, return True if it was already recorded and has not expired
+        added = self._add(event_id, time.time())
+        with self._counter_lock:
+            if added:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return not added
+
+    @abc.abstractmethod
+    def forget(self, event_id):
+        # remove event_id so that a redelivery is handled again, e.g. after the handler failed
+        pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    @abc.abstractmethod
+    def _add(self, event_id, now):
+        pass
+
+
+class MemoryDedupStore(DedupStore):
+    # in-process LRU bounded to max_size ids, each id expires ttl seconds after it was added
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        super(MemoryDedupStore, self).__init__(ttl)
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def forget(self, event_id):
+        with self._lock:
+            self._items.pop(event_id, None)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _add(self, event_id, now):
+        with self._lock:
+            expire_at = self._items.get(event_id)
+            if expire_at is not None and expire_at > now:
+                self._items.move_to_end(event_id)
+                return False
+            self._items[event_id] = now + self.ttl
+            self._items.move_to_end(event_id)
+            # oldest entries are at the front, drop the expired ones and anything over the size limit
+            while self._items:
+                oldest_id, oldest_expire_at = next(iter(self._items.items()))
+                if len(self._items) <= self.max_size and oldest_expire_at > now:
+                    break
+                del self._items[oldest_id]
+            return True
+
+
+class SqliteDedupStore(DedupStore):
+    # dedup store in a sqlite file, shared by all worker processes on the same host
+    blocking = True
+
+    def __init__(self, path, ttl=DEFAULT_TTL, purge_every=1000):
+        super(SqliteDedupStore, self).__init__(ttl)
+        self.path = path
+        self._purge_every = purge_every
+        self._inserts = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS event_dedup (event_id TEXT PRIMARY KEY, expire_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_event_dedup_expire_at ON event_dedup (expire_at)")
+
+    def forget(self, event_id):
+        self._conn().execute("DELETE FROM event_dedup WHERE event_id = ?", (event_id,))
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _add(self, event_id, now):
+        conn = self._conn()
+        # insert the id, or take over a row that has already expired
+        cursor = conn.execute(
+            "INSERT INTO event_dedup (event_id, expire_at) VALUES (?, ?) "
+            "ON CONFLICT (event_id) DO UPDATE SET expire_at = excluded.expire_at "
+            "WHERE event_dedup.expire_at <= ?",
+            (event_id, now + self.ttl, now),
+        )
+        added = cursor.rowcount == 1
+        if added:
+            self._inserts += 1
+            if self._inserts % self._purge_every == 0:
+                conn.execute("DELETE FROM event_dedup WHERE expire_at <= ?", (now,))
+        return added
+
+
+def create_dedup_store(backend, sqlite_path):
+    # store for the DEDUP_BACKEND setting: "memory", "sqlite", anything else turns dedup off
+    if backend == "sqlite":
+        return SqliteDedupStore(sqlite_path)
+    if backend == "memory":
+        return MemoryDedupStore()
+    return None
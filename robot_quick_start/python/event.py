@@ -1,40 +1,47 @@
 #!/usr/bin/env python3.8
 
-import json
 import abc
+import hmac
+import time
 import hashlib
+import functools
 import typing as t
+import codec
+import metrics
 from utils import dict_2_obj
 from flask import request, jsonify
 from decrypt import AESCipher
 
+# const
+# reject signed requests whose X-Lark-Request-Timestamp is further than this many seconds from now, 0 disables the check
+SIGNATURE_MAX_AGE = 300
+# lark signs every callback except url verification, whose body is a small {"challenge", "token", "type"} object
+# (encrypted when ENCRYPT_KEY is set). unsigned requests larger than this are rejected before parsing and decryption
+URL_VERIFICATION_MAX_SIZE = 1024
+
 
 class Event(object):
     callback_handler = None
 
     # event base
-    def __init__(self, dict_data, token, encrypt_key):
-        # event check and init
+    def __init__(self, dict_data, token, encrypt_key, headers=None, body=None, signature_verified=False):
+        # event check and init, headers and body default to the current flask request.
+        # signature_verified skips the signature check when the caller has already done it on the raw body.
         header = dict_data.get("header")
         event = dict_data.get("event")
         if header is None or event is None:
             raise InvalidEventException("request is not callback event(v2)")
         self.header = dict_2_obj(header)
         self.event = dict_2_obj(event)
-        self._validate(token, encrypt_key)
+        if headers is None:
+            headers, body = request.headers, request.data
+        self._validate(token, encrypt_key, headers, body, signature_verified)
 
-    def _validate(self, token, encrypt_key):
-        if self.header.token != token:
+    def _validate(self, token, encrypt_key, headers, body, signature_verified=False):
+        if not hmac.compare_digest(str(self.header.token).encode("utf-8"), str(token).encode("utf-8")):
             raise InvalidEventException("invalid token")
-        timestamp = request.headers.get("X-Lark-Request-Timestamp")
-        nonce = request.headers.get("X-Lark-Request-Nonce")
-        signature = request.headers.get("X-Lark-Signature")
-        body = request.data
-        bytes_b1 = (timestamp + nonce + encrypt_key).encode("utf-8")
-        bytes_b = bytes_b1 + body
-        h = hashlib.sha256(bytes_b)
-        if signature != h.hexdigest():
-            raise InvalidEventException("invalid signature in event")
+        if not signature_verified and not verify_signature(headers, body, encrypt_key):
+            raise InvalidEventException("missing signature in event")
 
     @abc.abstractmethod
     def event_type(self):
@@ -61,11 +68,17 @@ class UrlVerificationEvent(Event):
 
 
 class EventManager(object):
-    event_callback_map = dict()
     event_type_map = dict()
     _event_list = [MessageReceiveEvent, UrlVerificationEvent]
 
-    def __init__(self):
+    def __init__(self, dedup_store=None):
+        # dedup_store is a dedup.DedupStore, events whose event_id it has seen are skipped
+        self.dedup_store = dedup_store
+        # event_type -> handlers, in registration order
+        self.event_callback_map = dict()
+        self._middlewares = []
+        # event_type -> middleware chain and handlers compiled into one callable
+        self._dispatch_map = dict()
         for event in EventManager._event_list:
             EventManager.event_type_map[event.event_type()] = event
 
@@ -76,31 +89,109 @@ class EventManager(object):
 
         return decorator
 
-    @staticmethod
-    def register_handler_with_event_type(event_type, handler):
-        EventManager.event_callback_map[event_type] = handler
-
-    @staticmethod
-    def get_handler_with_event(token, encrypt_key):
-        dict_data = json.loads(request.data)
+    def register_handler_with_event_type(self, event_type, handler):
+        # several handlers may listen to one event type, the response is the first one that isn't None
+        self.event_callback_map.setdefault(event_type, []).append(handler)
+        self._compile(event_type)
+
+    def middleware(self, f: t.Callable) -> t.Callable:
+        # register f(event, call_next) -> response around every handler, in registration order
+        self._middlewares.append(f)
+        for event_type in self.event_callback_map:
+            self._compile(event_type)
+        return f
+
+    def get_handler_with_event(self, token, encrypt_key):
+        return self.parse_event(request.headers, request.data, token, encrypt_key)
+
+    def parse_event(self, headers, body, token, encrypt_key):
+        # build the event from raw request headers and body, and look up its handler.
+        # the signature is checked on the raw body first, so forged requests are rejected
+        # before paying for json parsing and decryption. unsigned requests can only be url
+        # verification and go through the minimal path: a small body that must turn out to be one.
+        start = metrics.STAGE_SIGNATURE.start()
+        signed = verify_signature(headers, body, encrypt_key)
+        metrics.STAGE_SIGNATURE.observe_since(start)
+        if not signed and len(body) > URL_VERIFICATION_MAX_SIZE:
+            raise InvalidEventException("missing signature in event")
+        start = metrics.STAGE_PARSE.start()
+        try:
+            dict_data = codec.loads(body)
+        except ValueError:
+            raise InvalidEventException("request body is not json") from None
+        metrics.STAGE_PARSE.observe_since(start)
+        if not isinstance(dict_data, dict):
+            raise InvalidEventException("request body is not json")
+        start = metrics.STAGE_DECRYPT.start()
         dict_data = EventManager._decrypt_data(encrypt_key, dict_data)
+        metrics.STAGE_DECRYPT.observe_since(start)
         callback_type = dict_data.get("type")
         # only verification data has callback_type, else is event
         if callback_type == "url_verification":
+            # url verification requests are not signed, the handler checks their token
             event = UrlVerificationEvent(dict_data)
-            return EventManager.event_callback_map.get(event.event_type()), event
+            return self._dispatch_map.get(event.event_type(), self.fallback_handler), event
+        if not signed:
+            raise InvalidEventException("missing signature in event")
 
         # only handle event v2
         schema = dict_data.get("schema")
-        if schema is None:
+        header = dict_data.get("header")
+        if schema is None or header is None:
             raise InvalidEventException("request is not callback event(v2)")
 
-        # get event_type
-        event_type = dict_data.get("header").get("event_type")
+        # get event_type and its handler
+        event_type = header.get("event_type")
+        dispatch = self._dispatch_map.get(event_type)
+        if dispatch is None:
+            # nobody listens to this event type, acknowledge it without building the event
+            return self.fallback_handler, None
         # build event
-        event = EventManager.event_type_map.get(event_type)(dict_data, token, encrypt_key)
-        # get handler
-        return EventManager.event_callback_map.get(event_type), event
+        start = metrics.STAGE_DICT_2_OBJ.start()
+        event = EventManager.event_type_map.get(event_type, Event)(
+            dict_data, token, encrypt_key, headers, body, signature_verified=True
+        )
+        metrics.STAGE_DICT_2_OBJ.observe_since(start)
+        return dispatch, event
+
+    @staticmethod
+    def fallback_handler(event):
+        # response for event types without handlers
+        return jsonify()
+
+    def is_duplicate(self, event):
+        # check and record the event_id, call only after the event has been validated
+        if self.dedup_store is None or event is None or isinstance(event, UrlVerificationEvent):
+            return False
+        return self.dedup_store.seen(event.header.event_id)
+
+    def forget(self, event):
+        # allow a redelivery of event to be handled again
+        if self.dedup_store is None or event is None or isinstance(event, UrlVerificationEvent):
+            return
+        self.dedup_store.forget(event.header.event_id)
+
+    def _compile(self, event_type):
+        # done once per registration, dispatching an event is then a single call
+        call = self._build_dispatch(tuple(self.event_callback_map[event_type]))
+        for middleware in reversed(self._middlewares):
+            call = functools.partial(middleware, call_next=call)
+        self._dispatch_map[event_type] = call
+
+    @staticmethod
+    def _build_dispatch(handlers):
+        if len(handlers) == 1:
+            return handlers[0]
+
+        def dispatch(event):
+            response = None
+            for handler in handlers:
+                result = handler(event)
+                if response is None:
+                    response = result
+            return response
+
+        return dispatch
 
     @staticmethod
     def _decrypt_data(encrypt_key, data):
@@ -110,9 +201,42 @@ class EventManager(object):
             return data
         if encrypt_key == "":
             raise Exception("ENCRYPT_KEY is necessary")
-        cipher = AESCipher(encrypt_key)
-
-        return json.loads(cipher.decrypt_string(encrypt_data))
+        cipher = AESCipher.for_key(encrypt_key)
+        # every failure, bad base64, bad padding or plaintext that isn't json, raises the same error: telling
+        # them apart would be a padding oracle for decrypting captured callbacks
+        try:
+            plain = cipher.decrypt_bytes(encrypt_data)
+        except Exception:
+            raise InvalidEventException("invalid event") from None
+        try:
+            return codec.loads(plain)
+        except Exception:
+            raise InvalidEventException("invalid event") from None
+        finally:
+            if isinstance(plain, memoryview):
+                plain.release()
+
+
+def verify_signature(headers, body, encrypt_key, max_age=SIGNATURE_MAX_AGE):
+    # check X-Lark-Signature against the raw body. returns False when the request carries no
+    # signature, raises InvalidEventException when the signature is wrong or too old.
+    timestamp = headers.get("X-Lark-Request-Timestamp")
+    nonce = headers.get("X-Lark-Request-Nonce")
+    signature = headers.get("X-Lark-Signature")
+    if not (timestamp and nonce and signature):
+        return False
+    if max_age:
+        try:
+            age = abs(time.time() - int(timestamp))
+        except ValueError:
+            raise InvalidEventException("invalid timestamp in event")
+        if age > max_age:
+            raise InvalidEventException("expired timestamp in event")
+    h = hashlib.sha256((timestamp + nonce + (encrypt_key or "")).encode("utf-8"))
+    h.update(body)
+    if not hmac.compare_digest(h.hexdigest().encode("utf-8"), signature.encode("utf-8", "replace")):
+        raise InvalidEventException("invalid signature in event")
+    return True
 
 
 class InvalidEventException(Exception):
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3.8
+# builds the callbacks lark sends, shared by the benchmark and load test scripts in this directory.
+import os
+import json
+import base64
+import hashlib
+from Crypto.Cipher import AES
+
+
+def encrypt(key, plain):
+    # same scheme lark uses for encrypted events: sha256 key, random iv, AES-256-CBC, PKCS#7, base64
+    data = plain.encode("utf8")
+    pad = AES.block_size - len(data) % AES.block_size
+    data += bytes([pad]) * pad
+    iv = os.urandom(AES.block_size)
+    cipher = AES.new(hashlib.sha256(key.encode("utf8")).digest(), AES.MODE_CBC, iv)
+    return base64.b64encode(iv + cipher.encrypt(data)).decode("utf8")
+
+
+def make_payload(size):
+    # an im.message.receive_v1 event padded to about size bytes of json
+    event = {
+        "schema": "2.0",
+        "header": {"event_id": "5e3702a84e847582be8db7fb73283c02", "event_type": "im.message.receive_v1"},
+        "event": {"message": {"message_type": "text", "content": ""}},
+    }
+    filler = size - len(json.dumps(event))
+    event["event"]["message"]["content"] = "x" * max(filler, 0)
+    return json.dumps(event)
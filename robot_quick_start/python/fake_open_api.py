@@ -0,0 +1,266 @@
+#!/usr/bin/env python3.8
+# local stand-in for the Feishu open api, used by the benchmark scripts in this directory.
+# it is not a complete implementation, only the endpoints called by this sample and the web app samples are
+# served: tenant/app access tokens, im messages, authen v1 (web_app_with_auth) and the jssdk ticket
+# (web_app_with_jssdk).
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from urllib import parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# const
+TENANT_ACCESS_TOKEN_URI = "/open-apis/auth/v3/tenant_access_token/internal"
+APP_ACCESS_TOKEN_URI = "/open-apis/auth/v3/app_access_token/internal"
+MESSAGE_URI = "/open-apis/im/v1/messages"
+AUTH_URI = "/open-apis/authen/v1/index"
+USER_ACCESS_TOKEN_URI = "/open-apis/authen/v1/access_token"
+USER_INFO_URI = "/open-apis/authen/v1/user_info"
+JSAPI_TICKET_URI = "/open-apis/jssdk/ticket/get"
+# error codes answered by the real open api
+INVALID_TOKEN_CODE = 99991663
+RATE_LIMIT_CODE = 99991400
+INJECTED_ERROR_CODE = 99991672
+
+
+class FakeOpenApiServer(object):
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        latency_jitter=0.0,
+        token_expire=7200,
+        message_qps=None,
+        error_rate=0.0,
+        error_status=500,
+    ):
+        # every response waits latency + uniform(0, latency_jitter) seconds
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.token_expire = token_expire
+        # reject message requests above this rate with http 429, None means unlimited
+        self.message_qps = message_qps
+        # answer this fraction of requests (tokens excluded) with an error response of error_status
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._window = (0, 0)
+        self.counters = {"token": 0, "message": 0}
+        self._counter_lock = threading.Lock()
+        # token -> kind: tenant, app or user
+        self._tokens = {}
+        # message uuid -> message_id, a repeated uuid gets the first message back like the real api
+        self._message_uuids = {}
+        self._routes = {
+            ("POST", TENANT_ACCESS_TOKEN_URI): self._tenant_access_token,
+            ("POST", APP_ACCESS_TOKEN_URI): self._app_access_token,
+            ("POST", MESSAGE_URI): self._message,
+            ("GET", AUTH_URI): self._authorize,
+            ("POST", USER_ACCESS_TOKEN_URI): self._user_access_token,
+            ("GET", USER_INFO_URI): self._user_info,
+            ("POST", JSAPI_TICKET_URI): self._jsapi_ticket,
+        }
+        self._httpd = _HttpServer((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def incr(self, name):
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def over_rate_limit(self):
+        if not self.message_qps:
+            return False
+        second = int(time.monotonic())
+        with self._counter_lock:
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            self._window = (start, count + 1)
+        return count >= self.message_qps
+
+    def inject_error(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def issue_token(self, kind="tenant"):
+        token = "{}-{}".format(kind[0], uuid.uuid4().hex)
+        self._tokens[token] = kind
+        return token
+
+    def is_valid_token(self, token, kind="tenant"):
+        return self._tokens.get(token) == kind
+
+    def handle(self, method, path, query, headers, body):
+        # returns (status, json body, extra headers)
+        route = self._routes.get((method, path))
+        if route is None:
+            return 404, {"code": 404, "msg": "not found"}, {}
+        delay = self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        return route(query, headers, body)
+
+    def _tenant_access_token(self, query, headers, body):
+        self.incr("token")
+        token = self.issue_token("tenant")
+        return 200, {"code": 0, "msg": "ok", "tenant_access_token": token, "expire": self.token_expire}, {}
+
+    def _app_access_token(self, query, headers, body):
+        self.incr("app_token")
+        token = self.issue_token("app")
+        return 200, {"code": 0, "msg": "ok", "app_access_token": token, "expire": self.token_expire}, {}
+
+    def _message(self, query, headers, body):
+        self.incr("message")
+        if self.over_rate_limit():
+            self.incr("rate_limited")
+            return 429, {"code": RATE_LIMIT_CODE, "msg": "request trigger frequency limit"}, {}
+        error = self._check(headers, "tenant")
+        if error:
+            return error
+        message_uuid = json.loads(body).get("uuid") if body else None
+        with self._counter_lock:
+            message_id = self._message_uuids.get(message_uuid) if message_uuid else None
+            if message_id is None:
+                message_id = "om_" + uuid.uuid4().hex
+                if message_uuid:
+                    self._message_uuids[message_uuid] = message_id
+            else:
+                self.counters["deduplicated"] = self.counters.get("deduplicated", 0) + 1
+        return 200, {"code": 0, "msg": "success", "data": {"message_id": message_id}}, {}
+
+    def _authorize(self, query, headers, body):
+        # the login page: redirect straight back with an authorization code
+        self.incr("authorize")
+        redirect_uri = query.get("redirect_uri", [""])[0]
+        location = "{}?{}".format(redirect_uri, parse.urlencode({"code": uuid.uuid4().hex}))
+        return 302, {}, {"Location": location}
+
+    def _user_access_token(self, query, headers, body):
+        self.incr("user_token")
+        error = self._check(headers, "app")
+        if error:
+            return error
+        data = {
+            "access_token": self.issue_token("user"),
+            "refresh_token": "ur-" + uuid.uuid4().hex,
+            "token_type": "Bearer",
+            "expires_in": self.token_expire,
+            "open_id": "ou_fake",
+        }
+        return 200, {"code": 0, "msg": "success", "data": data}, {}
+
+    def _user_info(self, query, headers, body):
+        self.incr("user_info")
+        error = self._check(headers, "user")
+        if error:
+            return error
+        data = {"name": "Fake User", "en_name": "Fake User", "open_id": "ou_fake", "avatar_url": ""}
+        return 200, {"code": 0, "msg": "success", "data": data}, {}
+
+    def _jsapi_ticket(self, query, headers, body):
+        self.incr("ticket")
+        error = self._check(headers, "tenant")
+        if error:
+            return error
+        return 200, {"code": 0, "msg": "ok", "data": {"ticket": uuid.uuid4().hex, "expire_in": 7200}}, {}
+
+    def _check(self, headers, kind):
+        # error injection first, then the bearer token
+        if self.inject_error():
+            self.incr("injected_error")
+            return self.error_status, {"code": INJECTED_ERROR_CODE, "msg": "injected error"}, {}
+        token = headers.get("Authorization", "")[len("Bearer "):]
+        if not self.is_valid_token(token, kind):
+            return 200, {"code": INVALID_TOKEN_CODE, "msg": "Invalid access token for authorization."}, {}
+        return None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # listen backlog, the default of 5 drops connections when many clients connect at once
+    request_queue_size = 128
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # write headers and body in one segment, otherwise delayed ACK stalls kept-alive connections
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def _dispatch(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            path, _, query = self.path.partition("?")
+            status, reply, headers = server.handle(method, path, parse.parse_qs(query), self.headers, body)
+            self._reply(reply, status, headers)
+
+        def _reply(self, body, status=200, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            data = json.dumps(body).encode("utf-8")
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a local stand-in for the Feishu open api")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--token-expire", type=int, default=7200, help="token lifetime in seconds")
+    parser.add_argument("--message-qps", type=int, default=None, help="answer 429 above this message rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="http status of injected errors")
+    args = parser.parse_args()
+    fake = FakeOpenApiServer(
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        token_expire=args.token_expire,
+        message_qps=args.message_qps,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print("fake open api listening on {}".format(fake.url))
+    fake.serve_forever()
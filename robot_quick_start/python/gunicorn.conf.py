@@ -0,0 +1,31 @@
+# gunicorn settings for running server.py in production:
+#   gunicorn -c gunicorn.conf.py "server:create_app()"
+# every value can be overridden with the environment variable next to it.
+import os
+import multiprocessing
+
+bind = "0.0.0.0:{}".format(os.getenv("PORT", "3000"))
+# one preforked worker process per core, each with a pool of threads so that a worker
+# blocked on an open api call still accepts other callbacks
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WORKER_THREADS", "32"))
+# the memory dedup store is per process, a redelivered event may land on another worker: share handled
+# event ids through sqlite unless DEDUP_BACKEND says otherwise. set before server.py is loaded in the workers
+if workers > 1:
+    os.environ.setdefault("DEDUP_BACKEND", "sqlite")
+# seconds an idle keep-alive connection stays open
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+# a worker silent for this many seconds is killed and restarted
+timeout = int(os.getenv("WORKER_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# the app is loaded in each worker after fork, so http pools and tokens are never shared between processes
+preload_app = False
+accesslog = os.getenv("ACCESS_LOG")
+
+
+def post_worker_init(worker):
+    # runs in the worker after the app has been loaded
+    import server
+
+    server.warm_up()
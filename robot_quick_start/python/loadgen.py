@@ -0,0 +1,153 @@
+#!/usr/bin/env python3.8
+# load generator: posts signed im.message.receive_v1 callbacks to the webhook and reports
+# throughput and latency percentiles.
+# usage: python3 loadgen.py --url http://127.0.0.1:3000/ --requests 2000 --concurrency 16
+import os
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+import codec
+from fake_events import encrypt
+
+DEFAULT_TOKEN = os.getenv("VERIFICATION_TOKEN", "")
+DEFAULT_ENCRYPT_KEY = os.getenv("ENCRYPT_KEY", "")
+
+
+def build_callback(token, encrypt_key="", text="hello"):
+    # returns (headers, body) of a callback signed the way lark signs it
+    event = {
+        "schema": "2.0",
+        "header": {
+            "event_id": uuid.uuid4().hex,
+            "token": token,
+            "create_time": str(int(time.time() * 1000)),
+            "event_type": "im.message.receive_v1",
+            "tenant_key": "tenant_loadgen",
+            "app_id": "cli_loadgen",
+        },
+        "event": {
+            "sender": {
+                "sender_id": {"open_id": "ou_" + uuid.uuid4().hex[:24]},
+                "sender_type": "user",
+            },
+            "message": {
+                "message_id": "om_" + uuid.uuid4().hex,
+                "chat_id": "oc_loadgen",
+                "chat_type": "p2p",
+                "message_type": "text",
+                "content": codec.dumps({"text": text}),
+            },
+        },
+    }
+    body = codec.dumps_bytes(event)
+    if encrypt_key:
+        body = codec.dumps_bytes({"encrypt": encrypt(encrypt_key, body.decode("utf-8"))})
+    timestamp, nonce = str(int(time.time())), uuid.uuid4().hex
+    signature = hashlib.sha256((timestamp + nonce + encrypt_key).encode("utf-8") + body).hexdigest()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Lark-Request-Timestamp": timestamp,
+        "X-Lark-Request-Nonce": nonce,
+        "X-Lark-Signature": signature,
+    }
+    return headers, body
+
+
+class LoadResult(object):
+    def __init__(self, latencies, errors, elapsed, status_codes):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.status_codes = status_codes
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(round(p / 100.0 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+    def summary(self):
+        return "{:>8.1f} req/s  p50 {:>7.1f}ms  p95 {:>7.1f}ms  p99 {:>7.1f}ms  errors {}  status {}".format(
+            self.throughput,
+            self.percentile(50) * 1000,
+            self.percentile(95) * 1000,
+            self.percentile(99) * 1000,
+            self.errors,
+            dict(sorted(self.status_codes.items())),
+        )
+
+
+def run_load(url, requests=1000, concurrency=16, token=DEFAULT_TOKEN, encrypt_key=DEFAULT_ENCRYPT_KEY, make_request=None):
+    # send `requests` callbacks from `concurrency` threads, each keeping its own connection alive.
+    # requests are built before the clock starts so signing and encryption don't count.
+    make_request = make_request or (lambda: build_callback(token, encrypt_key))
+    prepared = [make_request() for _ in range(requests)]
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    lock = threading.Lock()
+    latencies, status_codes = [], {}
+    errors = [0]
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        local_latencies, local_status, local_errors = [], {}, 0
+        for headers, body in chunk:
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            local_status[resp.status] = local_status.get(resp.status, 0) + 1
+            if resp.status >= 400:
+                local_errors += 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_status.items():
+                status_codes[status] = status_codes.get(status, 0) + count
+            errors[0] += local_errors
+
+    threads = [
+        threading.Thread(target=worker, args=(prepared[i::concurrency],), daemon=True)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return LoadResult(latencies, errors[0], time.perf_counter() - start, status_codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="post signed message callbacks to a webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:3000/")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--encrypt-key", default=DEFAULT_ENCRYPT_KEY)
+    args = parser.parse_args()
+    result = run_load(args.url, args.requests, args.concurrency, args.token, args.encrypt_key)
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
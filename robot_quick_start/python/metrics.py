@@ -0,0 +1,159 @@
+#!/usr/bin/env python3.8
+# in-process metrics for the webhook pipeline, rendered in the prometheus text format by server.py at /metrics.
+# stage timings are sampled: with METRICS_SAMPLE_RATE=0.1 one call in ten of each stage reads the clock,
+# the others only bump a counter.
+import os
+import time
+import bisect
+import threading
+
+# const
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0.1"))
+# seconds, from a cached token lookup to a slow open api call
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram(object):
+    # cumulative buckets, sum and count of the sampled observations
+    def __init__(self, buckets=DEFAULT_BUCKETS, sample_rate=METRICS_SAMPLE_RATE):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        self.set_sample_rate(sample_rate)
+        # not locked, a lost increment only shifts which call is sampled
+        self._ticks = 0
+
+    def set_sample_rate(self, sample_rate):
+        # 1 times every call, 0 disables the histogram
+        self._sample_every = max(int(round(1 / sample_rate)), 1) if sample_rate > 0 else 0
+
+    def start(self):
+        # returns a start time when this call is sampled, else None
+        if not self._sample_every:
+            return None
+        self._ticks += 1
+        if self._ticks % self._sample_every:
+            return None
+        return time.perf_counter()
+
+    def observe_since(self, start):
+        if start is not None:
+            self.observe(time.perf_counter() - start)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        # ([(upper bound, cumulative count)], sum, count)
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, buckets = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return buckets, total, cumulative
+
+
+class Counter(object):
+    # monotonic counter per label values tuple. label values are kept as strings, so that e.g. an int and
+    # an empty error code can be sorted together when rendering
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels):
+        labels = tuple(map(str, labels))
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Registry(object):
+    def __init__(self, sample_rate=METRICS_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        # name -> (kind, description, label names, {label values: metric})
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        family = self._family(name, "histogram", description, label_names)
+
+        def child(*labels):
+            labels = tuple(map(str, labels))
+            metric = family[3].get(labels)
+            if metric is None:
+                with self._lock:
+                    metric = family[3].setdefault(labels, Histogram(buckets, self.sample_rate))
+            return metric
+
+        return child
+
+    def set_sample_rate(self, sample_rate):
+        self.sample_rate = sample_rate
+        for kind, _, _, metrics in self._families.values():
+            if kind == "histogram":
+                for metric in metrics.values():
+                    metric.set_sample_rate(sample_rate)
+
+    def counter(self, name, description, label_names=()):
+        family = self._family(name, "counter", description, label_names)
+        with self._lock:
+            return family[3].setdefault((), Counter())
+
+    def render(self):
+        lines = []
+        for name, (kind, description, label_names, metrics) in sorted(self._families.items()):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, metric in sorted(metrics.items()):
+                if kind == "histogram":
+                    buckets, total, count = metric.snapshot()
+                    for bound, cumulative in buckets:
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(
+                            "{}_bucket{} {}".format(name, _labels(label_names + ("le",), labels + (le,)), cumulative)
+                        )
+                    lines.append("{}_sum{} {!r}".format(name, _labels(label_names, labels), total))
+                    lines.append("{}_count{} {}".format(name, _labels(label_names, labels), count))
+                else:
+                    values = metric.snapshot()
+                    if not label_names and not values:
+                        values = {(): 0}
+                    for values, value in sorted(values.items()):
+                        lines.append("{}{} {}".format(name, _labels(label_names, values), value))
+        return "\n".join(lines) + "\n"
+
+    def _family(self, name, kind, description, label_names):
+        with self._lock:
+            return self._families.setdefault(name, (kind, description, tuple(label_names), {}))
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ('{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+# process wide registry and the metrics of the callback pipeline
+registry = Registry()
+_stage_seconds = registry.histogram(
+    "lark_webhook_stage_seconds", "Time spent in each stage of handling a callback.", ("stage",)
+)
+STAGE_SIGNATURE = _stage_seconds("signature")
+STAGE_PARSE = _stage_seconds("parse")
+STAGE_DECRYPT = _stage_seconds("decrypt")
+STAGE_DICT_2_OBJ = _stage_seconds("dict_2_obj")
+STAGE_HANDLER = _stage_seconds("handler")
+STAGE_SEND = _stage_seconds("send")
+TOKEN_REFRESHES = registry.counter("lark_token_refreshes_total", "tenant_access_token requests to the open api.")
+OPEN_API_ERRORS = registry.counter(
+    "lark_open_api_errors_total", "Open api responses with an error, by http status and code.", ("status", "code")
+)
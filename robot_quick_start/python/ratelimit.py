@@ -0,0 +1,65 @@
+#!/usr/bin/env python3.8
+import time
+import threading
+
+
+class TokenBucket(object):
+    # thread safe token bucket, acquire() blocks until a token is available
+    def __init__(self, rate, capacity=None):
+        self._rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._fill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def _fill(self):
+        # must be called with self._lock held
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+
+class AimdRateLimiter(TokenBucket):
+    # token bucket whose rate follows AIMD: it grows by `increase` per second of successful calls
+    # and is multiplied by `decrease` when the server reports a rate limit
+    def __init__(self, rate, min_rate=1.0, increase=1.0, decrease=0.5, cooldown=1.0):
+        super(AimdRateLimiter, self).__init__(rate)
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self._increase = increase
+        self._decrease = decrease
+        self._cooldown = cooldown
+        self._last_decrease = 0.0
+        self.throttled = 0
+
+    def on_success(self):
+        with self._lock:
+            if self._rate < self.max_rate:
+                self._fill()
+                self._rate = min(self.max_rate, self._rate + self._increase / self._rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            # concurrent calls that were already in flight report the same limit, only back off once
+            if now - self._last_decrease < self._cooldown:
+                return
+            self._last_decrease = now
+            self._fill()
+            self._rate = max(self.min_rate, self._rate * self._decrease)
+            self._tokens = 0.0
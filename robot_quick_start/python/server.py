@@ -1,28 +1,45 @@
 #!/usr/bin/env python3.8
 
 import os
+import sys
+import atexit
+import signal
 import logging
 import requests
+import metrics
 from api import MessageApiClient
-from event import MessageReceiveEvent, UrlVerificationEvent, EventManager
-from flask import Flask, jsonify
+from background import BoundedExecutor
+from dedup import create_dedup_store
+from event import MessageReceiveEvent, UrlVerificationEvent, EventManager, InvalidEventException
+from flask import Flask, Response, jsonify, current_app
+from werkzeug.exceptions import HTTPException
 from dotenv import load_dotenv, find_dotenv
 
 # load env parameters form file named .env
 load_dotenv(find_dotenv())
 
-app = Flask(__name__)
-
 # load from env
 APP_ID = os.getenv("APP_ID")
 APP_SECRET = os.getenv("APP_SECRET")
 VERIFICATION_TOKEN = os.getenv("VERIFICATION_TOKEN")
 ENCRYPT_KEY = os.getenv("ENCRYPT_KEY")
 LARK_HOST = os.getenv("LARK_HOST")
+# ack-fast mode: answer the callback as soon as the event is verified and run handlers in the background
+ACK_FAST = os.getenv("ACK_FAST", "").lower() in ("1", "true", "yes")
+HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", "8"))
+HANDLER_QUEUE_SIZE = int(os.getenv("HANDLER_QUEUE_SIZE", "1000"))
+# skip events redelivered by lark: "memory" for one process, "sqlite" to share between worker processes
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "event_dedup.db")
 
 # init service
 message_api_client = MessageApiClient(APP_ID, APP_SECRET, LARK_HOST)
-event_manager = EventManager()
+event_manager = EventManager(create_dedup_store(DEDUP_BACKEND, DEDUP_SQLITE_PATH))
+background_executor = None
+if ACK_FAST:
+    background_executor = BoundedExecutor(HANDLER_WORKERS, HANDLER_QUEUE_SIZE)
+    # let queued events finish when the process exits
+    atexit.register(background_executor.shutdown)
 
 
 @event_manager.register("url_verification")
@@ -48,24 +65,83 @@ def message_receive_event_handler(req_data: MessageReceiveEvent):
     return jsonify()
 
 
-@app.errorhandler
 def msg_error_handler(ex):
-    logging.error(ex)
-    response = jsonify(message=str(ex))
+    # callers are not authenticated, the details only go to the log
+    if isinstance(ex, HTTPException):
+        return ex
+    if isinstance(ex, InvalidEventException):
+        logging.warning(ex)
+        response = jsonify(message="invalid event")
+        response.status_code = 400
+        return response
+    logging.exception(ex)
+    response = jsonify(message="internal error")
     response.status_code = (
         ex.response.status_code if isinstance(ex, requests.HTTPError) else 500
     )
     return response
 
 
-@app.route("/", methods=["POST"])
 def callback_event_handler():
     # init callback instance and handle
     event_handler, event = event_manager.get_handler_with_event(VERIFICATION_TOKEN, ENCRYPT_KEY)
+    if event_manager.is_duplicate(event):
+        return jsonify()
+
+    if background_executor is None or event is None or isinstance(event, UrlVerificationEvent):
+        return run_handler(event_handler, event)
+    app = current_app._get_current_object()
+    if not background_executor.submit(run_handler_in_app_context, app, event_handler, event):
+        # queue is full or draining, lark will deliver the event again later
+        event_manager.forget(event)
+        response = jsonify(message="server busy")
+        response.status_code = 503
+        return response
+    return jsonify()
+
+
+def run_handler(event_handler, event):
+    start = metrics.STAGE_HANDLER.start()
+    try:
+        return event_handler(event)
+    except Exception:
+        # the event was not handled, let lark's redelivery through
+        event_manager.forget(event)
+        raise
+    finally:
+        metrics.STAGE_HANDLER.observe_since(start)
+
+
+def metrics_handler():
+    # prometheus scrape endpoint
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def run_handler_in_app_context(app, event_handler, event):
+    # handlers build responses with jsonify, which needs an app context outside of a request
+    with app.app_context():
+        run_handler(event_handler, event)
+
+
+def create_app():
+    # app factory, used by gunicorn: gunicorn -c gunicorn.conf.py "server:create_app()"
+    app = Flask(__name__)
+    app.register_error_handler(Exception, msg_error_handler)
+    app.add_url_rule("/", view_func=callback_event_handler, methods=["POST"])
+    app.add_url_rule("/metrics", view_func=metrics_handler, methods=["GET"])
+    return app
+
 
-    return event_handler(event)
+def warm_up():
+    # get tenant_access_token and open a pooled connection before the first callback arrives
+    try:
+        message_api_client.token_manager.get()
+    except Exception as e:
+        logging.warning("warm up failed: %s", e)
 
 
 if __name__ == "__main__":
-    # init()
-    app.run(host="0.0.0.0", port=3000, debug=True)
+    # exit through sys.exit on SIGTERM so the atexit drain runs, e.g. on docker stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # flask development server, see gunicorn.conf.py for production
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "3000")), debug=True)
@@ -1,11 +1,58 @@
 #!/usr/bin/env python3.8
-class Obj(dict):
+class Obj(object):
+    # read-only attribute view over a parsed json dict. child dicts and lists are wrapped when
+    # they are accessed, so handlers only pay for the fields they read.
+    __slots__ = ("_data",)
+
     def __init__(self, d):
-        for a, b in d.items():
-            if isinstance(b, (list, tuple)):
-                setattr(self, a, [Obj(x) if isinstance(x, dict) else x for x in b])
-            else:
-                setattr(self, a, Obj(b) if isinstance(b, dict) else b)
+        self._data = d
+
+    def __getattribute__(self, name):
+        # look the name up in the payload first: falling back to __getattr__ after a failed normal
+        # lookup would raise and catch an AttributeError on every field access
+        try:
+            value = _get_data(self)[name]
+        except KeyError:
+            return object.__getattribute__(self, name)
+        if type(value) is dict:
+            return Obj(value)
+        if type(value) is list:
+            return _wrap(value)
+        return value
+
+    def __getitem__(self, name):
+        return _wrap(_get_data(self)[name])
+
+    def __contains__(self, name):
+        return name in _get_data(self)
+
+    def __iter__(self):
+        return iter(_get_data(self))
+
+    def __len__(self):
+        return len(_get_data(self))
+
+    def __eq__(self, other):
+        if isinstance(other, Obj):
+            return _get_data(self) == _get_data(other)
+        return _get_data(self) == other
+
+    def __repr__(self):
+        return "Obj({!r})".format(_get_data(self))
+
+    def to_dict(self):
+        return _get_data(self)
+
+
+_get_data = Obj._data.__get__
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return Obj(value)
+    if isinstance(value, (list, tuple)):
+        return [Obj(x) if isinstance(x, dict) else x for x in value]
+    return value
 
 
 def dict_2_obj(d: dict):
@@ -1,6 +1,6 @@
-import requests
 import logging
 from urllib import parse
+from transport import get_transport
 from flask import redirect, request
 
 # const
@@ -12,16 +12,14 @@ USER_INFO_URI = "/open-apis/authen/v1/user_info"
 
 
 class Auth(object):
-    def __init__(self, lark_host, app_id, app_secret):
+    def __init__(self, lark_host, app_id, app_secret, transport=None):
         self.lark_host = lark_host
         self.app_id = app_id
         self.app_secret = app_secret
+        self.transport = transport or get_transport()
+        # the app_access_token is the same for every request; user_access_tokens are per login and are never kept
+        # here, the server runs many requests at once on one Auth
         self._app_access_token = ""
-        self._user_access_token = ""
-
-    @property
-    def user_access_token(self):
-        return self._user_access_token
 
     @property
     def app_access_token(self):
@@ -37,10 +35,9 @@ class Auth(object):
             "Authorization": "Bearer " + self.app_access_token,
         }
         req_body = {"grant_type": "authorization_code", "code": code}
-        response = requests.post(url=url, headers=headers, json=req_body)
+        response = self.transport.post(url=url, headers=headers, json=req_body)
         Auth._check_error_response(response)
-
-        self._user_access_token = response.json().get("data").get("access_token")
+        return response.json().get("data").get("access_token")
 
     def redirect(self, redirect_url):
         # redirect to return authorization code, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/get-
@@ -51,14 +48,14 @@ class Auth(object):
         )
         return redirect(redirect_auth_url)
 
-    def get_user_info(self):
+    def get_user_info(self, user_access_token):
         # get user info, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/authen-v1/authen/user_info
         url = self._gen_url(USER_INFO_URI)
         headers = {
-            "Authorization": "Bearer " + self.user_access_token,
+            "Authorization": "Bearer " + user_access_token,
             "Content-Type": "application/json",
         }
-        response = requests.get(url=url, headers=headers)
+        response = self.transport.get(url=url, headers=headers)
         Auth._check_error_response(response)
         return response.json().get("data")
 
@@ -66,7 +63,7 @@ class Auth(object):
         # get app_access_token, implemented based on Feishu open api capability. doc link: https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/auth-v3/auth/app_access_token_internal
         url = self._gen_url(APP_ACCESS_TOKEN_URI)
         req_body = {"app_id": self.app_id, "app_secret": self.app_secret}
-        response = requests.post(url, req_body)
+        response = self.transport.post(url, req_body)
         Auth._check_error_response(response)
         self._app_access_token = response.json().get("app_access_token")
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 import os
+import logging
 
 from auth import Auth
 from functools import wraps
@@ -16,11 +17,6 @@ SECRET_KEY = "ThisIsSecretKey"
 # load env parameters form file named .env
 load_dotenv(find_dotenv())
 
-# init flask app
-app = Flask(__name__, static_url_path="/public", static_folder="./public")
-app.secret_key = SECRET_KEY
-app.debug = True
-
 # get env
 APP_ID = os.getenv("APP_ID")
 APP_SECRET = os.getenv("APP_SECRET")
@@ -64,30 +60,46 @@ def login_required(f):
     return decorated
 
 
-@app.errorhandler(Exception)
 def auth_error_handler(ex):
     return Biz.login_failed_handler(ex)
 
 
-@app.route("/", methods=["GET"])
 @login_required
 def get_home():
     return Biz.home_handler()
 
 
-@app.route("/login", methods=["GET"])
 def login():
     return auth.redirect(redirect_url=CALLBACK_URL)
 
 
-@app.route("/callback", methods=["GET"])
 def callback_handler():
     # get user info
-    auth.authorize_user_access_token()
-    user_info = auth.get_user_info()
+    user_access_token = auth.authorize_user_access_token()
+    user_info = auth.get_user_info(user_access_token)
     session[USER_INFO_KEY] = user_info
     return Biz.login_succeed_handler()
 
 
+def create_app():
+    # app factory, used by gunicorn: gunicorn -c gunicorn.conf.py "server:create_app()"
+    app = Flask(__name__, static_url_path="/public", static_folder="./public")
+    app.secret_key = SECRET_KEY
+    app.register_error_handler(Exception, auth_error_handler)
+    app.add_url_rule("/", view_func=get_home, methods=["GET"])
+    app.add_url_rule("/login", view_func=login, methods=["GET"])
+    app.add_url_rule("/callback", view_func=callback_handler, methods=["GET"])
+    return app
+
+
+def warm_up():
+    # get app_access_token and open a pooled connection before the first login arrives
+    try:
+        auth.authorize_app_access_token()
+    except Exception as e:
+        logging.warning("warm up failed: %s", e)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=3000, debug=True)
+    # flask development server, see gunicorn.conf.py for production
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "3000")), debug=True)
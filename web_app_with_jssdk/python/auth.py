@@ -1,5 +1,5 @@
-import requests
 import logging
+from transport import get_transport
 
 # const
 # 开放接口 URI
@@ -8,10 +8,11 @@ JSAPI_TICKET_URI = "/open-apis/jssdk/ticket/get"
 
 
 class Auth(object):
-    def __init__(self, lark_host, app_id, app_secret):
+    def __init__(self, lark_host, app_id, app_secret, transport=None):
         self.lark_host = lark_host
         self.app_id = app_id
         self.app_secret = app_secret
+        self.transport = transport or get_transport()
         self.tenant_access_token = ""
 
     def get_ticket(self):
@@ -23,7 +24,7 @@ class Auth(object):
             "Content-Type": "application/json",
         }
 
-        resp = requests.post(url=url, headers=headers)
+        resp = self.transport.post(url=url, headers=headers)
         Auth._check_error_response(resp)
         return resp.json().get("data").get("ticket", "")
 
@@ -31,7 +32,7 @@ class Auth(object):
         # 获取tenant_access_token，基于开放平台能力实现，具体参考文档：https://open.feishu.cn/document/ukTMukTMukTM/ukDNz4SO0MjL5QzM/auth-v3/auth/tenant_access_token_internal
         url = "{}{}".format(self.lark_host, TENANT_ACCESS_TOKEN_URI)
         req_body = {"app_id": self.app_id, "app_secret": self.app_secret}
-        response = requests.post(url, req_body)
+        response = self.transport.post(url, req_body)
         Auth._check_error_response(response)
         self.tenant_access_token = response.json().get("tenant_access_token")
 
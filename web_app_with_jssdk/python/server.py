@@ -2,6 +2,7 @@
 # -*- coding: UTF-8 -*-
 import os
 import time
+import logging
 import hashlib
 import requests
 from auth import Auth
@@ -15,16 +16,12 @@ NONCE_STR = "13oEviLbrTo458A3NjrOwS70oTOXVOAm"
 # 加载 .env文件内环境数据
 load_dotenv(find_dotenv())
 
-# 初始化 flask app
-app = Flask(__name__, static_url_path="/public", static_folder="./public")
-
 # 获取环境变量
 APP_ID = os.getenv("APP_ID")
 APP_SECRET = os.getenv("APP_SECRET")
 LARK_HOST = os.getenv("LARK_HOST")
 
 
-@app.errorhandler(Exception)
 def auth_error_handler(ex):
     response = jsonify(message=str(ex))
     response.status_code = (
@@ -37,13 +34,11 @@ def auth_error_handler(ex):
 auth = Auth(LARK_HOST, APP_ID, APP_SECRET)
 
 
-@app.route("/", methods=["GET"])
 def get_home():
     # 展示主页
     return render_template("index.html")
 
 
-@app.route("/get_signature", methods=["GET"])
 def get_signature():
     # 获取jsapi签名相关数据
     url = request.args.get("url")
@@ -63,5 +58,23 @@ def get_signature():
     )
 
 
+def create_app():
+    # app 工厂函数，供 gunicorn 使用：gunicorn -c gunicorn.conf.py "server:create_app()"
+    app = Flask(__name__, static_url_path="/public", static_folder="./public")
+    app.register_error_handler(Exception, auth_error_handler)
+    app.add_url_rule("/", view_func=get_home, methods=["GET"])
+    app.add_url_rule("/get_signature", view_func=get_signature, methods=["GET"])
+    return app
+
+
+def warm_up():
+    # 预先获取 tenant_access_token，并建立连接池中的连接
+    try:
+        auth.authorize_tenant_access_token()
+    except Exception as e:
+        logging.warning("warm up failed: %s", e)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=3000, debug=True)
+    # flask 开发服务器，生产环境请参考 gunicorn.conf.py
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "3000")), debug=True)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# shared http transport for the open api clients in this sample.
+# connections are pooled per host and kept alive between calls, so each open api call
+# after the first one skips the TCP and TLS handshakes.
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+# const
+DEFAULT_POOL_SIZE = int(os.getenv("LARK_HTTP_POOL_SIZE", "10"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("LARK_HTTP_CONNECT_TIMEOUT", "3"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("LARK_HTTP_READ_TIMEOUT", "10"))
+DEFAULT_HTTP2 = os.getenv("LARK_HTTP2", "").lower() in ("1", "true", "yes")
+
+
+class TransportStats(object):
+    # counters for requests sent and connections opened, reused = requests - connections
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @property
+    def reused(self):
+        return max(self.requests - self.connections, 0)
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": self.reused,
+        }
+
+
+class _CountingAdapter(HTTPAdapter):
+    # HTTPAdapter whose connection pools report every new connection to stats
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super(_CountingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self._stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self._stats),
+        }
+
+    def send(self, request, **kwargs):
+        self._stats.incr("requests")
+        return super(_CountingAdapter, self).send(request, **kwargs)
+
+
+def _counting_pool_class(base, stats):
+    def _new_conn(self):
+        stats.incr("connections")
+        return base._new_conn(self)
+
+    return type("Counting" + base.__name__, (base,), {"_new_conn": _new_conn})
+
+
+class HttpTransport(object):
+    # pooled keep-alive http client, responses expose status_code, json() and raise_for_status()
+    def __init__(
+        self,
+        pool_size=DEFAULT_POOL_SIZE,
+        host_pool_sizes=None,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        http2=DEFAULT_HTTP2,
+    ):
+        self.stats = TransportStats()
+        self.http2 = http2
+        self._timeout = (connect_timeout, read_timeout)
+        self._httpx = None
+        if http2:
+            self._client = self._build_http2_client(pool_size, connect_timeout, read_timeout)
+        else:
+            self._client = self._build_session(pool_size, host_pool_sizes or {})
+
+    def request(self, method, url, **kwargs):
+        if self.http2:
+            # httpx takes raw request bodies as content, data is only for form fields
+            if isinstance(kwargs.get("data"), (bytes, str)):
+                kwargs["content"] = kwargs.pop("data")
+            # httpx errors are raised as their requests counterparts, callers handle one set of exceptions
+            try:
+                response = self._client.request(method, url, extensions={"trace": self._trace}, **kwargs)
+            except self._httpx.TimeoutException as e:
+                raise requests.Timeout(str(e)) from e
+            except self._httpx.TransportError as e:
+                raise requests.ConnectionError(str(e)) from e
+            return _Http2Response(response, self._httpx)
+        kwargs.setdefault("timeout", self._timeout)
+        return self._client.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request("POST", url, data=data, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+    def _build_session(self, pool_size, host_pool_sizes):
+        session = requests.Session()
+        # pool_maxsize is the number of kept-alive connections per host
+        adapter = _CountingAdapter(self.stats, pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # per host overrides, e.g. {"https://open.feishu.cn": 50}
+        for host, size in host_pool_sizes.items():
+            session.mount(host, _CountingAdapter(self.stats, pool_connections=1, pool_maxsize=size))
+        return session
+
+    def _build_http2_client(self, pool_size, connect_timeout, read_timeout):
+        # http/2 multiplexes concurrent calls over one connection per host, needs `pip install httpx[http2]`
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("http2 transport requires httpx, run: pip install httpx[http2]")
+        self._httpx = httpx
+        return httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats.incr("connections")
+        elif event_name == "http11.send_request_headers.started" or event_name == "http2.send_request_headers.started":
+            self.stats.incr("requests")
+
+
+class _Http2Response(object):
+    # httpx response whose raise_for_status raises requests.HTTPError, as a response of the requests transport does
+    def __init__(self, response, httpx):
+        self._response = response
+        self._httpx = httpx
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def raise_for_status(self):
+        try:
+            self._response.raise_for_status()
+        except self._httpx.HTTPStatusError as e:
+            raise requests.HTTPError(str(e), response=self) from e
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_transport():
+    # process wide transport shared by all clients, created on first use
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HttpTransport()
+    return _default_transport